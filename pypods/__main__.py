@@ -0,0 +1,9 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+from pypods.cli import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,669 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import asyncio
+import os
+import time
+from asyncio.subprocess import PIPE
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Union
+
+from bson import loads
+
+from pypods.codec import DEFAULT_CODEC, Buffer, BsonCodec, Codec, get_codec
+from pypods.deadline import Deadline
+from pypods.errors import (
+    PyPodCancelledError,
+    PyPodError,
+    PyPodNotStartedError,
+    PyPodResponseError,
+    PyPodTimeoutError,
+    PyPodWorkerError,
+)
+from pypods.handles import returned_objects
+from pypods.metrics import CallTrace
+from pypods.pods import POOL_MODES, Object, PodBatch, PodLoader, get_pod_namespace
+from pypods.protocol import FRAME_HEADER
+from pypods.shm import SharedMemorySession
+from pypods.worker import WORKER_STOP_TIMEOUT, kill_process, worker_command
+
+
+async def read_frame_async(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Read a single length-prefixed frame from an asyncio stream.
+
+    Args:
+        reader (asyncio.StreamReader): The stream to read the frame from.
+
+    Returns:
+        Optional[bytes]: The frame payload, or None if the stream is closed.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise EOFError("Stream closed in the middle of a frame")
+
+
+async def write_frame_async(
+    writer: asyncio.StreamWriter, payload: Union[bytes, Sequence[Buffer]]
+) -> None:
+    """
+    Write a single length-prefixed frame to an asyncio stream.
+
+    Args:
+        writer (asyncio.StreamWriter): The stream to write the frame to.
+        payload (Union[bytes, Sequence[Buffer]]): The serialized message, or a list of
+            bytes-like buffers that are written back to back without being joined.
+    """
+    buffers = [payload] if isinstance(payload, (bytes, bytearray, memoryview)) else payload
+    writer.write(FRAME_HEADER.pack(sum(memoryview(b).nbytes for b in buffers)))
+    writer.writelines(buffers)
+    await writer.drain()
+
+
+async def aiter_stream(
+    replies: AsyncIterator[Dict[str, Any]], finish: Optional[Callable[[Optional[str]], None]] = None
+) -> AsyncIterator[Any]:
+    """
+    Unwrap the chunk replies streamed back by a generator pod function.
+
+    Args:
+        replies (AsyncIterator[Dict[str, Any]]): The remaining replies of the stream.
+        finish (Optional[Callable[[Optional[str]], None]]): Called with the error of the
+            stream, if any, once it is exhausted, fails or is closed, e.g. to finish the
+            trace of its call.
+
+    Returns:
+        AsyncIterator[Any]: The items yielded by the pod function.
+    """
+    error = None
+    try:
+        async for msg in replies:
+            if "error" in msg:
+                raise PyPodResponseError(f"PyPodResponseError: {msg['error']}")
+            if "chunk" in msg:
+                yield msg["chunk"]
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        try:
+            await replies.aclose()
+        finally:
+            if finish is not None:
+                finish(error)
+
+
+class AsyncPodWorker:
+    """
+    The asyncio counterpart of PodWorker. The pod process is driven through
+    asyncio pipes so that waiting for a reply never blocks a thread.
+    """
+
+    def __init__(
+        self,
+        interpreter: str,
+        module: str,
+        codecs: Sequence[str] = (DEFAULT_CODEC,),
+        fork: bool = False,
+        on_spawn: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Initialize the worker for a pod module.
+
+        Args:
+            interpreter (str): Path to the pod's python interpreter.
+            module (str): Dotted name of the pod module to serve.
+            codecs (Sequence[str]): Wire codec names in order of preference.
+            fork (bool): Handle every request in a forked child of the worker process.
+            on_spawn (Optional[Callable[[], None]]): Called every time the worker process is started.
+        """
+        self.interpreter = interpreter
+        self.module = module
+        self.codecs = list(codecs)
+        self.fork = fork
+        self.on_spawn = on_spawn
+        self.codec: Codec = BsonCodec()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.lock = asyncio.Lock()
+
+    def is_alive(self) -> bool:
+        """
+        Check if the worker process is running.
+
+        Returns:
+            bool: True if the worker process is running.
+        """
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        """
+        Start the worker process and wait until the pod module is imported.
+        """
+        if self.is_alive():
+            return
+        if not os.path.exists(self.interpreter):
+            raise PyPodNotStartedError("Pod interpreter is missing!")
+        process = self.process = await asyncio.create_subprocess_exec(
+            *worker_command(self.interpreter, self.module, self.codecs, self.fork),
+            stdin=PIPE,
+            stdout=PIPE,
+            # A zygote leads its own process group, which its forked children join.
+            start_new_session=self.fork,
+        )
+        if self.on_spawn is not None:
+            self.on_spawn()
+        ready = await read_frame_async(process.stdout)
+        if ready is None:
+            await self._reap()
+            # A call interrupted during startup kills the process without waiting for it.
+            await process.wait()
+            raise PyPodWorkerError(f"Pod worker {self.module} exited during startup")
+        ready = loads(ready)
+        if "error" in ready:
+            await self._reap()
+            raise PyPodWorkerError(ready["error"])
+        try:
+            self.codec = get_codec(ready["codec"])
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def stop(self) -> None:
+        """
+        Ask the worker process to exit by closing its stdin, killing it if it does not comply.
+        """
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        await self._reap()
+
+    async def _reap(self) -> None:
+        """
+        Release the resources of a dead or dying worker process.
+        """
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        if self.fork or process.returncode is None:
+            # The child forked for a call may outlive its zygote.
+            kill_process(process, self.fork)
+        await process.wait()
+
+    def _kill(self) -> None:
+        """
+        Kill the worker process without waiting for it, used when a call is cancelled
+        and the reply stream can no longer be trusted.
+        """
+        if self.process is not None and (self.fork or self.process.returncode is None):
+            kill_process(self.process, self.fork)
+        self.process = None
+
+    async def _send(
+        self, message: Dict[str, Any], trace: Optional[CallTrace] = None, deadline: Optional[Deadline] = None
+    ) -> None:
+        """
+        Write a request frame, restarting the worker if it is not running.
+        """
+        if not self.is_alive():
+            await self._reap()
+            await self.start()
+        start = time.perf_counter()
+        data = self.codec.dump_buffers(message)
+        if trace is not None:
+            trace.add_phase("encode", time.perf_counter() - start)
+            trace.request_bytes += sum(memoryview(buffer).nbytes for buffer in data)
+        try:
+            await write_frame_async(self.process.stdin, data)
+        except (ConnectionError, OSError):
+            # The worker died before reading the request, so it is safe to resend it,
+            # unless it was killed because the call was interrupted.
+            await self._reap()
+            if deadline is not None:
+                deadline.check()
+            await self.start()
+            await write_frame_async(self.process.stdin, data)
+
+    async def _receive(self, trace: Optional[CallTrace] = None) -> Dict[str, Any]:
+        """
+        Read and decode a reply frame, failing if the worker exits before sending it.
+        """
+        try:
+            response = await read_frame_async(self.process.stdout)
+        except EOFError:
+            response = None
+        if response is None:
+            await self._reap()
+            raise PyPodWorkerError(f"Pod worker {self.module} exited while handling a request")
+        if trace is None:
+            return self.codec.loads(response)
+        start = time.perf_counter()
+        reply = self.codec.loads(response)
+        trace.add_phase("decode", time.perf_counter() - start)
+        trace.response_bytes += len(response)
+        return reply
+
+    async def request(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send one request to the worker and yield its replies,
+        see PodWorker.request for the framing of streamed replies and deadlines.
+        Cancelling the awaiting task also kills the worker process.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            AsyncIterator[Dict[str, Any]]: The replies.
+        """
+        if trace is not None:
+            message = dict(message, trace=True)
+        if deadline is None:
+            deadline = Deadline()
+        async with self.lock:
+            finished = False
+            try:
+                async with deadline.watch_async(self._kill):
+                    try:
+                        await self._send(message, trace, deadline)
+                    except (PyPodWorkerError, ConnectionError, OSError):
+                        # The worker was killed while it was being (re)started.
+                        deadline.check()
+                        raise
+                    if deadline.reason is not None:
+                        deadline.check()
+                    sent = time.perf_counter()
+                    while not finished:
+                        try:
+                            reply = await self._receive(trace)
+                        except PyPodWorkerError:
+                            deadline.check()
+                            raise
+                        if deadline.reason is not None:
+                            # Replied as it was interrupted, the reply stream can no longer be trusted.
+                            deadline.check()
+                        if trace is not None and sent is not None:
+                            roundtrip = time.perf_counter() - sent - trace.phases.get("decode", 0.0)
+                            trace.add_pod_timings(reply.pop("trace", {}), roundtrip)
+                            sent = None
+                        finished = not {"stream", "chunk"}.intersection(reply)
+                        yield reply
+            finally:
+                if not finished:
+                    # Cancelled or abandoned mid-reply, the reply stream can no longer be trusted.
+                    self._kill()
+
+    async def call(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send one request to the worker and wait for its reply.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The reply.
+        """
+        replies = self.request(message, trace, deadline)
+        try:
+            return await replies.__anext__()
+        finally:
+            await replies.aclose()
+
+
+class AsyncPodBatch(PodBatch):
+    """
+    A PodBatch that is executed when its async with block exits.
+    """
+
+    async def __aenter__(self) -> "AsyncPodBatch":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            for future in self._futures:
+                future.cancel()
+            self._shm.cleanup()
+            return
+        await self._execute_async()
+
+    async def _execute_async(self) -> None:
+        """
+        Send every recorded call to the pod and resolve the futures with the results.
+        """
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        if not calls:
+            return
+        trace, error = self._loader.start_trace("<batch>"), None
+        try:
+            try:
+                reply = await self._loader.call_worker({"batch": calls}, trace, self._loader.call_deadline("<batch>"))
+            except Exception as e:
+                error = str(e)
+                self._fail(futures, e)
+            error = reply.get("error")
+            self._resolve(futures, reply)
+        finally:
+            self._shm.cleanup()
+            self._loader.finish_trace(trace, error)
+
+
+class AsyncLazyPod(Object):
+    """
+    Stands in for a pod loaded with AsyncPodLoader.load_pod(lazy=True). Its attributes are
+    coroutine functions that load the pod on first call, see LazyPod. Once loaded, the
+    pod's functions are bound on this very object.
+    """
+
+    def __init__(self, loader: "AsyncPodLoader") -> None:
+        self._pod_loader = loader
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for missing attributes, i.e. before the pod is loaded.
+        if name.startswith("__") or name == "_pod_loader" or self._pod_loader.loaded:
+            raise AttributeError(name)
+
+        async def load_and_call(*args, **kwargs):
+            await self._pod_loader.ensure_loaded()
+            return await object.__getattribute__(self, name)(*args, **kwargs)
+
+        return load_and_call
+
+
+class AsyncPodLoader(PodLoader):
+    """
+    A PodLoader whose injected pod functions are coroutines.
+
+    Calls are served by one or more long-lived pod workers driven through asyncio pipes,
+    so a single event loop can keep many pod calls in flight.
+    """
+
+    def __init__(self, pod_name: str, namespace: dict, size: int = 1, **kwargs) -> None:
+        """
+        Initialize the AsyncPodLoader with the pod name, namespace and number of workers.
+
+        Args:
+            pod_name (str): The name of the pod associated with this loader.
+            namespace (dict): The namespace dictionary where pod functions are loaded.
+            size (int): Number of pod workers serving calls concurrently.
+            **kwargs: Other PodLoader options, mode is "worker" (default) or "zygote".
+        """
+        kwargs.setdefault("mode", "worker")
+        if kwargs["mode"] not in POOL_MODES:
+            raise ValueError(f"mode: {kwargs['mode']} should be one of {POOL_MODES}")
+        if kwargs.get("manager") is not None:
+            raise ValueError("manager is not supported by AsyncPodLoader, its workers are driven by asyncio")
+        if kwargs.get("concurrency", 1) != 1:
+            raise ValueError("concurrency is not supported by AsyncPodLoader, size sets the calls run at once")
+        super().__init__(pod_name, namespace, **kwargs)
+        if size < 1:
+            raise ValueError("size must be a positive integer")
+        self.size = size
+        self.workers: List[AsyncPodWorker] = []
+        self.idle_workers: Optional[asyncio.Queue] = None
+        self.async_load_lock = asyncio.Lock()
+        self.prewarm_task: Optional[asyncio.Future] = None
+
+    async def load_pod(self, lazy: bool = False, prewarm: bool = False) -> None:
+        """
+        Load functions from the pod into the client's namespace and start the pod workers.
+
+        Args:
+            lazy (bool): Bind an AsyncLazyPod proxy right away and defer provisioning, function
+                discovery and worker startup to the first call of one of its functions.
+            prewarm (bool): With lazy, load the pod in a background task right away so the
+                first call does not wait for it. Errors are raised again on first use.
+        """
+        if not str.isidentifier(self.pod_name):
+            raise ValueError(f"pod_name: {self.pod_name} should be a valid python identifier")
+        if self.loaded:
+            return
+        if lazy:
+            self.namespace[self.pod_name] = AsyncLazyPod(self)
+            if prewarm:
+                self.prewarm_task = asyncio.ensure_future(self.prewarm())
+            return
+        self.namespace[self.pod_name] = Object()
+        await self.ensure_loaded()
+
+    async def ensure_loaded(self) -> None:
+        """
+        Provision the pod, bind its functions and start its workers, unless it is loaded already.
+        """
+        async with self.async_load_lock:
+            if self.loaded:
+                return
+            loop = asyncio.get_running_loop()
+            # Provisioning and discovery are blocking, keep them off the event loop.
+            await loop.run_in_executor(None, self.create_pod)
+            pod_ns = await loop.run_in_executor(None, get_pod_namespace, self.pod_name)
+            for function_name in pod_ns:
+                args, kwargs = pod_ns[function_name]
+                self.create_a_function(function_name, *args, **kwargs)
+            await self.start_worker()
+            self.loaded = True
+
+    async def prewarm(self) -> None:
+        """
+        Load a lazy pod ahead of its first use. Failures are left for the first call to raise.
+        """
+        try:
+            await self.ensure_loaded()
+        except Exception:
+            pass
+
+    async def unload_pod(self) -> None:
+        """
+        Unload pod object from the client's namespace and stop the pod workers.
+        """
+        async with self.async_load_lock:
+            await self.stop_worker()
+            self.loaded = False
+            if self.pod_name in self.namespace:
+                del self.namespace[self.pod_name]
+
+    async def start_worker(self) -> None:
+        """
+        Start all pod workers concurrently.
+        """
+        fork = self.mode == "zygote"
+        workers = [
+            AsyncPodWorker(self.pod_interpreter, self.pod_module, self.codecs, fork, self.record_spawn)
+            for _ in range(self.size)
+        ]
+        results = await asyncio.gather(
+            *(worker.start() for worker in workers), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await asyncio.gather(*(worker.stop() for worker in workers))
+            raise errors[0]
+        self.workers = workers
+        self.idle_workers = asyncio.Queue()
+        for worker in workers:
+            self.idle_workers.put_nowait(worker)
+
+    async def stop_worker(self) -> None:
+        """
+        Stop all pod workers.
+        """
+        workers, self.workers = self.workers, []
+        self.idle_workers = None
+        await asyncio.gather(*(worker.stop() for worker in workers))
+
+    async def request_worker(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send a request to an idle pod worker and yield its replies.
+        The worker goes back to the pool once every reply was read.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request, covering
+                the wait for an idle worker.
+
+        Returns:
+            AsyncIterator[Dict[str, Any]]: The replies.
+        """
+        if self.idle_workers is None:
+            raise PyPodNotStartedError("Pod worker is not running, call load_pod() first!")
+        idle_workers = self.idle_workers
+        if deadline is None:
+            worker = await idle_workers.get()
+        else:
+            deadline.check()
+            try:
+                worker = await asyncio.wait_for(idle_workers.get(), deadline.remaining())
+            except asyncio.TimeoutError:
+                raise PyPodTimeoutError("Pod call exceeded its deadline while waiting for a pod worker")
+        objects: List[str] = []
+        try:
+            async for reply in worker.request(message, trace, deadline):
+                objects.extend(returned_objects(reply))
+                yield reply
+        finally:
+            try:
+                if objects:
+                    await self.release_objects(worker, objects)
+            finally:
+                idle_workers.put_nowait(worker)
+
+    async def release_objects(self, worker: AsyncPodWorker, objects: List[str]) -> None:
+        """
+        Free the pod objects a worker returned by reference, which make_handle refuses.
+        Only the worker that stored them can free them, so it does before going back to the pool.
+
+        Args:
+            worker (AsyncPodWorker): The worker that returned the objects.
+            objects (List[str]): The IDs of the objects.
+        """
+        if not worker.is_alive():
+            return
+        try:
+            await worker.call({"release": objects})
+        except PyPodError:
+            # The pod process is gone and its objects with it.
+            pass
+
+    async def call_worker(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send a request to an idle pod worker and wait for its reply.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The reply.
+        """
+        replies = self.request_worker(message, trace, deadline)
+        try:
+            return await replies.__anext__()
+        finally:
+            await replies.aclose()
+
+    def batch(self) -> AsyncPodBatch:
+        """
+        Collect pod function calls and send them to a pod worker in a single message.
+
+            async with pl.batch() as b:
+                futures = [b.foo(i, i) for i in range(1000)]
+            results = [f.result() for f in futures]
+
+        Returns:
+            AsyncPodBatch: The batch, executed when its async with block exits.
+        """
+        return AsyncPodBatch(self)
+
+    def make_handle(self, reply: Dict[str, Any]) -> Any:
+        """
+        Pod objects cannot be returned by reference to an AsyncPodLoader, since the calls on
+        their handle would block the event loop and could go to any of its workers.
+        request_worker already freed the object in the pod.
+        """
+        raise PyPodResponseError("Remote objects are not supported by AsyncPodLoader, use a PodLoader in worker mode")
+
+    def create_a_function(self, func_name, *args, **kwargs) -> None:
+        """
+        Dynamically create a coroutine function that acts as a proxy for remote procedure calls to the pod.
+
+        Args:
+            func_name: The name of the function to be created.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+        """
+
+        async def rpc_proxy_function(*args, **kwargs):
+            function_output = None
+            shm = SharedMemorySession(self.shm_threshold)
+            trace, error = self.start_trace(func_name), None
+            streaming = False
+            try:
+                function_dict = shm.export_call({"name": func_name, "args": args, "kwargs": kwargs})
+                function_dict, profile = self.profile_request(function_dict)
+                replies = self.request_worker(function_dict, trace, self.call_deadline(func_name))
+                reply = await replies.__anext__()
+                if "stream" in reply:
+                    # The stream finishes the call once it is consumed.
+                    streaming = True
+                    return aiter_stream(replies, partial(self.finish_call, shm, trace))
+                await replies.aclose()
+                if profile is not None:
+                    profile.collect(reply)
+                if "error" in reply:
+                    raise PyPodResponseError(reply["error"])
+                if "handle" in reply:
+                    function_output = self.make_handle(reply)
+                else:
+                    function_output = shm.attach(reply["response"])
+            except (PyPodTimeoutError, PyPodCancelledError) as e:
+                error = str(e)
+                raise
+            except PyPodResponseError as e:
+                error = str(e)
+                raise PyPodResponseError(f"PyPodResponseError: {e}")
+            except Exception as e:
+                error = str(e)
+                raise Exception(f"Unknown error: {e}")
+            finally:
+                if not streaming:
+                    self.finish_call(shm, trace, error)
+            return function_output
+        self.namespace[self.pod_name].__setattr__(
+            func_name, self.cached_function(func_name, rpc_proxy_function)
+        )
@@ -0,0 +1,453 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+from os.path import join
+from typing import Any, Callable, Dict, List, Optional
+
+import pypods
+from pypods.codec import CODECS, get_codec
+from pypods.errors import PyPodError
+from pypods.ns import PODS_CONFIG, PODS_DIRECTORY
+from pypods.pods import PodLoader
+from pypods.pool import PodPool
+
+BENCH_POD = "bench_pod"
+BENCH_POD_FUNCTIONS = '''
+def noop():
+    return None
+
+
+def echo(value):
+    return value
+
+
+def nbytes(value):
+    return len(value)
+
+'''
+PAYLOAD_SIZES = {
+    "1KB": 1 << 10,
+    "64KB": 64 << 10,
+    "1MB": 1 << 20,
+    "16MB": 16 << 20,
+    "128MB": 128 << 20,
+    "500MB": 500 << 20,
+}
+# Metrics ending with one of these suffixes regress when they go down, every other one when it goes up.
+HIGHER_IS_BETTER = ("calls_per_second",)
+
+
+def codec_payloads() -> Dict[str, Any]:
+    """
+    Representative request payloads, from many small scalars to one large buffer.
+
+    Returns:
+        Dict[str, Any]: The payloads by name.
+    """
+    return {
+        "scalars": {"name": "foo", "args": [1, 2.5, "x", True], "kwargs": {"y": None}},
+        "list_10k": {"response": list(range(10000))},
+        "records_1k": {"response": [{"id": i, "name": f"row-{i}", "score": i / 3} for i in range(1000)]},
+        "bytes_1mb": {"response": b"\x00" * (1 << 20)},
+        "bytes_64mb": {"response": b"\x00" * (64 << 20)},
+    }
+
+
+def best_time(function: Callable[[], Any], repeat: int) -> float:
+    """
+    Run a function several times and return its fastest run.
+
+    Args:
+        function (Callable[[], Any]): The function to time.
+        repeat (int): Number of runs.
+
+    Returns:
+        float: The fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples.
+
+    Args:
+        samples (List[float]): The samples in seconds.
+
+    Returns:
+        Dict[str, float]: The mean, p50, p90 and p99 of the samples.
+    """
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+    }
+
+
+def bench_codecs(names: Optional[List[str]] = None, repeat: int = 5) -> List[Dict[str, Any]]:
+    """
+    Measure the encode and decode cost of every codec on every payload.
+
+    Args:
+        names (Optional[List[str]]): Codecs to compare, defaults to all of them.
+        repeat (int): Number of runs per measurement, the fastest one is kept.
+
+    Returns:
+        List[Dict[str, Any]]: One result per codec and payload. Codecs that are not
+        installed or cannot encode a payload report an error instead of timings.
+    """
+    results = []
+    payloads = codec_payloads()
+    for name in names or list(CODECS):
+        try:
+            codec = get_codec(name)
+        except PyPodError as e:
+            results.append({"codec": name, "error": str(e)})
+            continue
+        for payload_name, payload in payloads.items():
+            result = {"codec": name, "payload": payload_name}
+            try:
+                data = b"".join(bytes(buffer) for buffer in codec.dump_buffers(payload))
+                result["size"] = len(data)
+                result["encode"] = best_time(lambda: codec.dump_buffers(payload), repeat)
+                result["decode"] = best_time(lambda: codec.loads(data), repeat)
+            except Exception as e:
+                result["error"] = str(e)
+            results.append(result)
+    return results
+
+
+def make_bench_pod(pod_name: str = BENCH_POD) -> None:
+    """
+    Write a fixture pod into PODS_DIRECTORY of the current directory. Its requirements.txt
+    is empty so that provisioning it never needs a package index.
+
+    Args:
+        pod_name (str): The name of the pod.
+    """
+    pod_path = join(PODS_DIRECTORY, pod_name)
+    os.makedirs(pod_path, exist_ok=True)
+    template = join(os.path.dirname(os.path.abspath(__file__)), "template", f"{PODS_CONFIG}.py")
+    with open(template) as t:
+        source = t.read()
+    # The functions go above the template's __main__ block, which spawn mode relies on.
+    marker = "# Don't change anything here!"
+    with open(join(pod_path, f"{PODS_CONFIG}.py"), mode="w") as p:
+        p.write(source.replace(marker, BENCH_POD_FUNCTIONS + marker))
+    with open(join(pod_path, "requirements.txt"), mode="w") as r:
+        r.write("# The benchmark makes the client's pypods importable through a .pth file.\n")
+
+
+def link_pypods(pod_name: str = BENCH_POD) -> None:
+    """
+    Make the client's pypods package and its dependencies importable inside the pod's
+    venv, so the benchmark measures this checkout of pypods without installing it.
+
+    Args:
+        pod_name (str): The name of the pod.
+    """
+    venv_dir = os.path.abspath(join(PODS_DIRECTORY, pod_name, "venv"))
+    site_packages = sysconfig.get_path("purelib", vars={"base": venv_dir, "platbase": venv_dir})
+    os.makedirs(site_packages, exist_ok=True)
+    paths = [os.path.dirname(os.path.dirname(os.path.abspath(pypods.__file__)))]
+    paths += [sysconfig.get_path("purelib"), sysconfig.get_path("platlib")]
+    with open(join(site_packages, "pypods_bench.pth"), mode="w") as pth:
+        pth.write("\n".join(dict.fromkeys(paths)) + "\n")
+
+
+def bench_cold(repeat: int) -> Dict[str, float]:
+    """
+    Measure provisioning a new pod with create_pod(), and load_pod() of a provisioned pod.
+
+    Args:
+        repeat (int): Number of runs, the fastest one is kept.
+
+    Returns:
+        Dict[str, float]: Seconds per operation.
+    """
+    metrics = {}
+    create_times = []
+    for i in range(repeat):
+        pod_name = f"{BENCH_POD}_cold_{i}"
+        make_bench_pod(pod_name)
+        start = time.perf_counter()
+        PodLoader(pod_name, {}).create_pod()
+        create_times.append(time.perf_counter() - start)
+        shutil.rmtree(join(PODS_DIRECTORY, pod_name), ignore_errors=True)
+    metrics["cold.create_pod.seconds"] = min(create_times)
+    for mode in ("spawn", "worker", "zygote"):
+        if mode == "zygote" and not hasattr(os, "fork"):
+            continue
+        times = []
+        for _ in range(repeat):
+            pl = PodLoader(BENCH_POD, {}, mode=mode)
+            start = time.perf_counter()
+            pl.load_pod()
+            times.append(time.perf_counter() - start)
+            pl.unload_pod()
+        metrics[f"cold.load_pod.{mode}.seconds"] = min(times)
+    return metrics
+
+
+def bench_latency(modes: List[str], calls: int) -> Dict[str, float]:
+    """
+    Measure the latency of no-op pod calls in every mode.
+
+    Args:
+        modes (List[str]): The PodLoader modes to measure.
+        calls (int): Number of calls per mode. Spawn mode makes a tenth of them.
+
+    Returns:
+        Dict[str, float]: Latency percentiles in seconds per mode.
+    """
+    metrics = {}
+    for mode in modes:
+        pl = PodLoader(BENCH_POD, {}, mode=mode)
+        pl.load_pod()
+        try:
+            noop = pl.namespace[BENCH_POD].noop
+            noop()
+            samples = []
+            for _ in range(max(1, calls // 10) if mode == "spawn" else calls):
+                start = time.perf_counter()
+                noop()
+                samples.append(time.perf_counter() - start)
+        finally:
+            pl.unload_pod()
+        for name, value in percentiles(samples).items():
+            metrics[f"latency.{mode}.{name}.seconds"] = value
+    return metrics
+
+
+def bench_throughput(size: int, callers: int, calls: int) -> Dict[str, float]:
+    """
+    Measure the throughput of a PodPool under concurrent callers.
+
+    Args:
+        size (int): Number of pod workers.
+        callers (int): Number of client threads.
+        calls (int): Number of no-op calls per client thread.
+
+    Returns:
+        Dict[str, float]: Calls per second.
+    """
+    pool = PodPool(BENCH_POD, {}, size=size)
+    pool.load_pod()
+    try:
+        noop = pool.namespace[BENCH_POD].noop
+
+        def caller():
+            for _ in range(calls):
+                noop()
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.unload_pod()
+    return {f"throughput.pool_{size}.callers_{callers}.calls_per_second": callers * calls / elapsed}
+
+
+def bench_payloads(max_size: int, repeat: int) -> Dict[str, float]:
+    """
+    Measure a worker round-trip of bytes payloads of growing size, through the pipe
+    and through shared memory.
+
+    Args:
+        max_size (int): Largest payload size in bytes.
+        repeat (int): Number of runs per size, the fastest one is kept.
+
+    Returns:
+        Dict[str, float]: Seconds per round-trip by transport and size.
+    """
+    metrics = {}
+    for transport, options in (("pipe", {}), ("shm", {"shm_threshold": 1 << 16})):
+        pl = PodLoader(BENCH_POD, {}, mode="worker", **options)
+        pl.load_pod()
+        try:
+            nbytes = pl.namespace[BENCH_POD].nbytes
+            for name, size in PAYLOAD_SIZES.items():
+                if size > max_size:
+                    break
+                payload = b"\x00" * size
+                metrics[f"payload.{transport}.{name}.seconds"] = best_time(lambda: nbytes(payload), repeat)
+                del payload
+        finally:
+            pl.unload_pod()
+    return metrics
+
+
+def run_suite(
+    quick: bool = False, calls: int = 1000, workers: int = 4, max_payload: int = PAYLOAD_SIZES["500MB"]
+) -> Dict[str, Any]:
+    """
+    Run the whole benchmark suite against a fixture pod created in a temporary directory.
+
+    Args:
+        quick (bool): Fewer repetitions and payloads of at most 1MB, for smoke runs.
+        calls (int): Number of calls per latency and throughput measurement.
+        workers (int): Number of pod workers of the throughput measurement.
+        max_payload (int): Largest payload size in bytes.
+
+    Returns:
+        Dict[str, Any]: Run metadata under "meta" and flat "metrics".
+    """
+    repeat = 1 if quick else 3
+    if quick:
+        calls = min(calls, 100)
+        max_payload = min(max_payload, PAYLOAD_SIZES["1MB"])
+    modes = ["spawn", "worker"] + (["zygote"] if hasattr(os, "fork") else [])
+    metrics: Dict[str, float] = {}
+    cwd = os.getcwd()
+    # Pod creation logs to stdout, keep it clear for the JSON results.
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr):
+        os.chdir(tmp)
+        try:
+            make_bench_pod()
+            PodLoader(BENCH_POD, {}).create_pod()
+            link_pypods()
+            metrics.update(bench_cold(repeat))
+            metrics.update(bench_latency(modes, calls))
+            metrics.update(bench_throughput(workers, workers * 2, max(1, calls // workers)))
+            metrics.update(bench_payloads(max_payload, repeat))
+        finally:
+            os.chdir(cwd)
+    for result in bench_codecs(repeat=repeat):
+        if "error" not in result:
+            metrics[f"codec.{result['codec']}.{result['payload']}.encode.seconds"] = result["encode"]
+            metrics[f"codec.{result['codec']}.{result['payload']}.decode.seconds"] = result["decode"]
+    return {
+        "meta": {
+            "pypods": pypods.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quick": quick,
+        },
+        "metrics": metrics,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.1
+) -> List[Dict[str, Any]]:
+    """
+    Compare the metrics of two runs.
+
+    Args:
+        baseline (Dict[str, Any]): The saved run.
+        current (Dict[str, Any]): The new run.
+        threshold (float): Relative change beyond which a metric is flagged, e.g. 0.1 for 10%.
+
+    Returns:
+        List[Dict[str, Any]]: One entry per metric present in both runs, with its relative
+        change and whether it is a regression.
+    """
+    comparison = []
+    for name, before in baseline["metrics"].items():
+        after = current["metrics"].get(name)
+        if after is None or before <= 0:
+            continue
+        change = (after - before) / before
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        comparison.append(
+            {"metric": name, "baseline": before, "current": after, "change": change, "regression": worse > threshold}
+        )
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Entry point of python -m pypods.bench.
+    """
+    parser = argparse.ArgumentParser(prog="python -m pypods.bench", description="PyPods benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmark suite and write its results as JSON")
+    run.add_argument("-o", "--output", help="File the JSON results are written to, defaults to stdout")
+    run.add_argument("--quick", action="store_true", help="Few repetitions and small payloads only")
+    run.add_argument("--calls", type=int, default=1000, help="Calls per latency and throughput measurement")
+    run.add_argument("--workers", type=int, default=4, help="Pod workers of the throughput measurement")
+    run.add_argument(
+        "--max-payload", choices=list(PAYLOAD_SIZES), default="500MB", help="Largest payload size"
+    )
+
+    compare = commands.add_parser("compare", help="Flag regressions of a run against a saved baseline")
+    compare.add_argument("baseline", help="JSON results of the baseline run")
+    compare.add_argument("current", help="JSON results of the new run")
+    compare.add_argument("--threshold", type=float, default=0.1, help="Relative change flagged as a regression")
+
+    codecs = commands.add_parser("codecs", help="Compare the encode and decode cost of the wire codecs")
+    codecs.add_argument("--codec", action="append", choices=list(CODECS), help="Codec to include")
+    codecs.add_argument("--repeat", type=int, default=5, help="Runs per measurement")
+    codecs.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_suite(args.quick, args.calls, args.workers, PAYLOAD_SIZES[args.max_payload])
+        if args.output:
+            with open(args.output, mode="w") as o:
+                json.dump(results, o, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        return
+
+    if args.command == "compare":
+        with open(args.baseline) as b, open(args.current) as c:
+            comparison = compare_results(json.load(b), json.load(c), args.threshold)
+        regressions = [entry for entry in comparison if entry["regression"]]
+        for entry in comparison:
+            flag = "REGRESSION" if entry["regression"] else ""
+            print(f"{entry['metric']:<60} {entry['baseline']:>12.6g} -> {entry['current']:>12.6g} "
+                  f"{entry['change']:+8.1%} {flag}")
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    results = bench_codecs(args.codec, args.repeat)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    for result in results:
+        label = f"{result['codec']:<8} {result.get('payload', ''):<12}"
+        if "error" in result:
+            print(f"{label} error: {result['error']}")
+        else:
+            print(
+                f"{label} {result['size']:>12} bytes"
+                f"  encode {result['encode'] * 1e3:9.3f} ms"
+                f"  decode {result['decode'] * 1e3:9.3f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
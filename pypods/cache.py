@@ -0,0 +1,264 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pypods.ns import file_hash
+
+# Returned by ResultCache.get when a key is not cached, results may legitimately be None.
+MISSING = object()
+
+
+def canonical_value(value: Any) -> Any:
+    """
+    Convert a call argument into a JSON value that only depends on its content.
+    Every value is tagged with its type so that e.g. 1, 1.0, True, (1,) and [1] differ,
+    and dict and set items are sorted so that their insertion order does not matter.
+
+    Args:
+        value (Any): The argument.
+
+    Returns:
+        Any: The canonical JSON value.
+    """
+    if value is None or isinstance(value, (bool, int, str)):
+        return [type(value).__name__, value]
+    if isinstance(value, float):
+        return ["float", repr(value)]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return ["bytes", bytes(value).hex()]
+    if isinstance(value, (list, tuple)):
+        return [type(value).__name__, [canonical_value(v) for v in value]]
+    if isinstance(value, (set, frozenset)):
+        return ["set", sorted((canonical_value(v) for v in value), key=json.dumps)]
+    if isinstance(value, dict):
+        items = [[canonical_value(k), canonical_value(v)] for k, v in value.items()]
+        return ["dict", sorted(items, key=json.dumps)]
+    raise TypeError(f"Cannot build a cache key from an argument of type {type(value).__name__}")
+
+
+def canonical_key(func_name: str, args: tuple, kwargs: dict) -> str:
+    """
+    Build the cache key of a pod function call.
+
+    Args:
+        func_name (str): The name of the pod function.
+        args (tuple): Positional arguments of the call.
+        kwargs (dict): Keyword arguments of the call.
+
+    Returns:
+        str: The sha256 hex digest of the canonical encoding of the call.
+    """
+    encoded = json.dumps(
+        [func_name, canonical_value(list(args)), canonical_value(kwargs)], separators=(",", ":")
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Memoizes the results of one pure pod function.
+
+    Results are kept in a bounded in-memory LRU and, optionally, in pickle files under
+    the pod's state directory so they survive restarts of the client. Entries expire
+    after ttl seconds, and the whole cache is dropped as soon as one of its source files
+    (the pod's pod.py and requirements.txt) changes. Cached results are shared between
+    hits, so callers should not mutate them.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        ttl: Optional[float] = None,
+        directory: Optional[str] = None,
+        sources: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Initialize an empty cache.
+
+        Args:
+            maxsize (int): Maximum number of results kept in memory.
+            ttl (Optional[float]): Seconds a result stays valid, None keeps it forever.
+            directory (Optional[str]): Directory of the on-disk tier, None keeps results in memory only.
+            sources (Optional[List[str]]): Files whose change invalidates the cache.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be a positive number of seconds")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.directory = directory
+        self.sources = sources or []
+        self.entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.signature: Optional[List[Tuple[int, int]]] = None
+        self.fingerprint = ""
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Cache counters.
+
+        Returns:
+            Dict[str, int]: hits (including disk_hits), misses, disk_hits, size and maxsize.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self) -> None:
+        """
+        Drop every cached result, in memory and on disk. The counters are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get(self, key: str) -> Any:
+        """
+        Look a result up, counting a hit or a miss.
+
+        Args:
+            key (str): The key built by canonical_key.
+
+        Returns:
+            Any: The cached result, or MISSING.
+        """
+        with self.lock:
+            self.check_sources()
+            now = time.time()
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            entry = self.read_entry(key, now)
+            if entry is not None:
+                self.store(key, entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return entry[1]
+            self.misses += 1
+            return MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Cache a result.
+
+        Args:
+            key (str): The key built by canonical_key.
+            value (Any): The result of the pod function.
+        """
+        with self.lock:
+            self.check_sources()
+            expires = time.time() + self.ttl if self.ttl is not None else float("inf")
+            self.store(key, (expires, value))
+            self.write_entry(key, (expires, value))
+
+    def store(self, key: str, entry: Tuple[float, Any]) -> None:
+        """
+        Put an entry in the in-memory LRU, evicting the least recently used one if full.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def check_sources(self) -> None:
+        """
+        Drop the cache if a source file changed since the last call. Files are only
+        re-hashed when their size or modification time changed.
+        """
+        signature = []
+        for path in self.sources:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((0, 0))
+        if signature == self.signature:
+            return
+        self.signature = signature
+        fingerprint = hashlib.sha256(
+            "".join(file_hash(path) if os.path.exists(path) else "-" for path in self.sources).encode()
+        ).hexdigest()
+        if fingerprint != self.fingerprint:
+            self.entries.clear()
+            self.fingerprint = fingerprint
+            self.remove_stale_entries()
+
+    def entry_path(self, key: str) -> str:
+        """
+        Path of the on-disk entry of a key for the current source fingerprint.
+        """
+        return os.path.join(self.directory, self.fingerprint[:16], f"{key}.pickle")
+
+    def read_entry(self, key: str, now: float) -> Optional[Tuple[float, Any]]:
+        """
+        Read an unexpired entry from the on-disk tier.
+        """
+        if self.directory is None:
+            return None
+        path = self.entry_path(key)
+        try:
+            with open(path, mode="rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        if entry[0] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def write_entry(self, key: str, entry: Tuple[float, Any]) -> None:
+        """
+        Write an entry to the on-disk tier. Results that cannot be pickled stay in memory only.
+        """
+        if self.directory is None:
+            return
+        path = self.entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, mode="wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def remove_stale_entries(self) -> None:
+        """
+        Remove on-disk entries written for other versions of the source files.
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name != self.fingerprint[:16]:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
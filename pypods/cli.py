@@ -0,0 +1,168 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from pypods.daemon import ensure_daemon, read_daemon_info, stop_daemon
+from pypods.errors import PyPodError
+from pypods.ns import PODS_CONFIG, PODS_DIRECTORY
+from pypods.provision import (
+    VENV_BIN,
+    WHEELHOUSE_DIRECTORY,
+    list_pods,
+    pod_path,
+    provision_pods,
+    remove_unused_layers,
+    sync_pod,
+)
+
+
+def provision(args: argparse.Namespace) -> int:
+    """
+    Provision the venvs of the selected pods.
+
+    Returns:
+        int: The exit code, 1 if any pod failed.
+    """
+    pod_names = list_pods() if args.all else args.pods
+    if not pod_names:
+        print("No pods to provision, pass pod names or --all", file=sys.stderr)
+        return 1
+    try:
+        results = provision_pods(
+            pod_names,
+            jobs=args.jobs,
+            wheelhouse=args.wheelhouse,
+            offline=args.offline,
+            force=args.force,
+            layered=True if args.layered else None,
+        )
+    except PyPodError as e:
+        print(e, file=sys.stderr)
+        return 1
+    failed = False
+    for pod_name, result in results.items():
+        if result in ("skipped", "provisioned"):
+            print(f"{pod_name}: {result}")
+        else:
+            failed = True
+            print(f"{pod_name}: failed: {result}", file=sys.stderr)
+    if args.prune:
+        for layer in remove_unused_layers():
+            print(f"removed unused layer {layer}")
+    return 1 if failed else 0
+
+
+def sync(args: argparse.Namespace) -> int:
+    """
+    Sync the venvs of the selected pods with their requirements.txt and print what changed.
+
+    Returns:
+        int: The exit code, 1 if any pod failed.
+    """
+    pod_names = list_pods() if args.all else args.pods
+    if not pod_names:
+        print("No pods to sync, pass pod names or --all", file=sys.stderr)
+        return 1
+    failed = False
+    for pod_name in pod_names:
+        try:
+            changes = sync_pod(pod_name, wheelhouse=args.wheelhouse)
+        except (PyPodError, OSError) as e:
+            failed = True
+            print(f"{pod_name}: failed: {e}", file=sys.stderr)
+            continue
+        if not changes["installed"] and not changes["removed"]:
+            print(f"{pod_name}: up to date")
+        for package in changes["installed"]:
+            print(f"{pod_name}: installed {package}")
+        for package in changes["removed"]:
+            print(f"{pod_name}: removed {package}")
+    return 1 if failed else 0
+
+
+def daemon(args: argparse.Namespace) -> int:
+    """
+    Start, stop or report the daemons of the selected pods.
+
+    Returns:
+        int: The exit code, 1 if any pod failed or, for status, is not running.
+    """
+    pod_names = list_pods() if args.all else args.pods
+    if not pod_names:
+        print("No pods selected, pass pod names or --all", file=sys.stderr)
+        return 1
+    failed = False
+    for pod_name in pod_names:
+        try:
+            if args.action == "start":
+                interpreter = os.path.join(pod_path(pod_name), "venv", VENV_BIN, "python3")
+                module = f"{PODS_DIRECTORY}.{pod_name}.{PODS_CONFIG}"
+                address = ensure_daemon(pod_name, interpreter, module, workers=args.workers)
+                print(f"{pod_name}: listening on {address}")
+            elif args.action == "stop":
+                print(f"{pod_name}: {'stopped' if stop_daemon(pod_name) else 'not running'}")
+            else:
+                info = read_daemon_info(pod_name)
+                failed = failed or info is None
+                print(f"{pod_name}: " + (f"running, pid {info['pid']}" if info else "not running"))
+        except (PyPodError, OSError) as e:
+            failed = True
+            print(f"{pod_name}: failed: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Entry point of the pypods command, run it from the directory holding the pods directory.
+    """
+    parser = argparse.ArgumentParser(prog="pypods", description="Manage the pods of a project")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    provision_parser = commands.add_parser("provision", help="Create and install the venvs of pods")
+    provision_parser.add_argument("pods", nargs="*", help="Names of the pods to provision")
+    provision_parser.add_argument("--all", action="store_true", help="Provision every pod of the project")
+    provision_parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of pods provisioned concurrently"
+    )
+    provision_parser.add_argument(
+        "--wheelhouse", default=WHEELHOUSE_DIRECTORY, help="Wheel directory shared by all pods"
+    )
+    provision_parser.add_argument(
+        "--offline", action="store_true", help="Install from the wheelhouse only, never contact a package index"
+    )
+    provision_parser.add_argument(
+        "--force", action="store_true", help="Provision pods even if their requirements did not change"
+    )
+    provision_parser.add_argument(
+        "--layered", action="store_true", help="Share identical packages between pods through layers"
+    )
+    provision_parser.add_argument(
+        "--prune", action="store_true", help="Delete the layers no pod uses anymore"
+    )
+    provision_parser.set_defaults(handler=provision)
+
+    sync_parser = commands.add_parser("sync", help="Install and remove packages to match requirements.txt")
+    sync_parser.add_argument("pods", nargs="*", help="Names of the pods to sync")
+    sync_parser.add_argument("--all", action="store_true", help="Sync every pod of the project")
+    sync_parser.add_argument(
+        "--wheelhouse", default=None, help="Install from this wheel directory only, never contact a package index"
+    )
+    sync_parser.set_defaults(handler=sync)
+
+    daemon_parser = commands.add_parser("daemon", help="Manage the pod daemons shared by client processes")
+    daemon_parser.add_argument("action", choices=("start", "stop", "status"))
+    daemon_parser.add_argument("pods", nargs="*", help="Names of the pods")
+    daemon_parser.add_argument("--all", action="store_true", help="Select every pod of the project")
+    daemon_parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of pod processes serving each daemon"
+    )
+    daemon_parser.set_defaults(handler=daemon)
+
+    args = parser.parse_args(argv)
+    sys.exit(args.handler(args))
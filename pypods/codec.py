@@ -0,0 +1,225 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import pickle
+import struct
+from typing import Any, Dict, List, Sequence, Union
+
+import bson
+
+from pypods.errors import PyPodError
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+DEFAULT_CODEC = "bson"
+
+
+class Codec:
+    """
+    Base class of the wire codecs used between a pod client and a pod worker.
+
+    A codec turns a message (always a dict, e.g. {"response": ...}) into the payload of a
+    frame and back. The handshake that picks the codec is always BSON encoded.
+    """
+
+    name = ""
+
+    def dumps(self, message: Dict[str, Any]) -> bytes:
+        """
+        Serialize a message.
+
+        Args:
+            message (Dict[str, Any]): The message.
+
+        Returns:
+            bytes: The frame payload.
+        """
+        raise NotImplementedError
+
+    def dump_buffers(self, message: Dict[str, Any]) -> List[Buffer]:
+        """
+        Serialize a message as a list of buffers that are written back to back, which
+        lets codecs with out-of-band buffers avoid joining them into one bytes object.
+
+        Args:
+            message (Dict[str, Any]): The message.
+
+        Returns:
+            List[Buffer]: The frame payload split in buffers.
+        """
+        return [self.dumps(message)]
+
+    def loads(self, data: Buffer) -> Dict[str, Any]:
+        """
+        Deserialize a message.
+
+        Args:
+            data (Buffer): The frame payload.
+
+        Returns:
+            Dict[str, Any]: The message.
+        """
+        raise NotImplementedError
+
+
+class BsonCodec(Codec):
+    """
+    Binary JSON, the default codec. Tuples become lists and sets are not supported.
+    """
+
+    name = "bson"
+
+    def dumps(self, message: Dict[str, Any]) -> bytes:
+        return bson.dumps(message)
+
+    def loads(self, data: Buffer) -> Dict[str, Any]:
+        return bson.loads(bytes(data))
+
+
+class MsgpackCodec(Codec):
+    """
+    MessagePack through the optional msgpack package. Tuples and sets are preserved
+    through extension types, and dict keys do not have to be strings.
+    """
+
+    name = "msgpack"
+    TUPLE_EXT = 1
+    SET_EXT = 2
+    FROZENSET_EXT = 3
+
+    def __init__(self) -> None:
+        import msgpack
+
+        self.msgpack = msgpack
+
+    def default(self, obj: Any) -> Any:
+        if isinstance(obj, tuple):
+            return self.msgpack.ExtType(self.TUPLE_EXT, self.dumps(list(obj)))
+        if isinstance(obj, frozenset):
+            return self.msgpack.ExtType(self.FROZENSET_EXT, self.dumps(list(obj)))
+        if isinstance(obj, set):
+            return self.msgpack.ExtType(self.SET_EXT, self.dumps(list(obj)))
+        if isinstance(obj, (bytearray, memoryview)):
+            return bytes(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+    def ext_hook(self, code: int, data: bytes) -> Any:
+        items = self.loads(data)
+        if code == self.TUPLE_EXT:
+            return tuple(items)
+        if code == self.SET_EXT:
+            return set(items)
+        if code == self.FROZENSET_EXT:
+            return frozenset(items)
+        return self.msgpack.ExtType(code, data)
+
+    def dumps(self, message: Any) -> bytes:
+        # strict_types sends tuples to default() instead of packing them as lists.
+        return self.msgpack.packb(message, use_bin_type=True, strict_types=True, default=self.default)
+
+    def loads(self, data: Buffer) -> Any:
+        return self.msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=self.ext_hook)
+
+
+class PickleCodec(Codec):
+    """
+    Pickle protocol 5. Any picklable value round-trips, and large buffers such as NumPy
+    arrays are sent out-of-band: they are written to the pipe as-is after the pickle
+    stream instead of being copied into it.
+
+    Only use it with pods you trust, unpickling a reply can run arbitrary code.
+    """
+
+    name = "pickle"
+    HEADER = struct.Struct("<I")
+    BUFFER_SIZE = struct.Struct("<Q")
+
+    def __init__(self) -> None:
+        if pickle.HIGHEST_PROTOCOL < 5:
+            raise ImportError("The pickle codec requires pickle protocol 5 (Python 3.8+)")
+
+    def dumps(self, message: Dict[str, Any]) -> bytes:
+        return b"".join(bytes(buffer) for buffer in self.dump_buffers(message))
+
+    def dump_buffers(self, message: Dict[str, Any]) -> List[Buffer]:
+        buffers: List[pickle.PickleBuffer] = []
+        data = pickle.dumps(message, protocol=5, buffer_callback=buffers.append)
+        raw = [buffer.raw() for buffer in buffers]
+        header = self.HEADER.pack(len(raw)) + b"".join(
+            self.BUFFER_SIZE.pack(buffer.nbytes) for buffer in raw
+        )
+        return [header, data, *raw]
+
+    def loads(self, data: Buffer) -> Dict[str, Any]:
+        view = memoryview(data)
+        (count,) = self.HEADER.unpack_from(view)
+        offset = self.HEADER.size
+        sizes = []
+        for _ in range(count):
+            sizes.append(self.BUFFER_SIZE.unpack_from(view, offset)[0])
+            offset += self.BUFFER_SIZE.size
+        end = len(view) - sum(sizes)
+        buffers, start = [], end
+        for size in sizes:
+            buffers.append(view[start:start + size])
+            start += size
+        return pickle.loads(view[offset:end], buffers=buffers)
+
+
+CODECS = {codec.name: codec for codec in (BsonCodec, MsgpackCodec, PickleCodec)}
+
+
+def get_codec(name: str) -> Codec:
+    """
+    Create a codec by name.
+
+    Args:
+        name (str): One of the names in CODECS.
+
+    Returns:
+        Codec: The codec.
+    """
+    if name not in CODECS:
+        raise ValueError(f"codec: {name} should be one of {tuple(CODECS)}")
+    try:
+        return CODECS[name]()
+    except ImportError as e:
+        raise PyPodError(f"Codec {name} is not available: {e}")
+
+
+def codec_available(name: str) -> bool:
+    """
+    Check if a codec can be created in this interpreter, e.g. that its package is installed.
+
+    Args:
+        name (str): One of the names in CODECS.
+
+    Returns:
+        bool: True if get_codec(name) succeeds.
+    """
+    try:
+        get_codec(name)
+    except PyPodError:
+        return False
+    return True
+
+
+def negotiate_codec(names: Sequence[str]) -> Codec:
+    """
+    Pick the first codec of a preference list that is available in this interpreter.
+
+    Args:
+        names (Sequence[str]): Codec names in order of preference.
+
+    Returns:
+        Codec: The first available codec.
+    """
+    errors = []
+    for name in names:
+        try:
+            return get_codec(name)
+        except (PyPodError, ValueError) as e:
+            errors.append(str(e))
+    raise PyPodError(f"No codec of {list(names)} is available: {'; '.join(errors)}")
@@ -0,0 +1,792 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from os.path import exists, join
+from subprocess import DEVNULL
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+from bson import dumps, loads
+
+from pypods.codec import DEFAULT_CODEC, BsonCodec, Codec, PickleCodec, get_codec, negotiate_codec
+from pypods.deadline import Deadline
+from pypods.errors import PyPodError, PyPodWorkerError
+from pypods.metrics import CallTrace
+from pypods.ns import PODS_STATE
+from pypods.protocol import read_frame, write_frame
+from pypods.provision import pod_path
+from pypods.runtime import PodRuntime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DAEMON_MODULE = "pypods.daemon"
+DAEMON_SOCKET = "daemon.sock"
+# Written by a running daemon: its pid and the address it listens on.
+DAEMON_INFO = "daemon.json"
+DAEMON_LOCK = "daemon.lock"
+DAEMON_LOG = "daemon.log"
+DAEMON_START_TIMEOUT = 60
+DAEMON_STOP_TIMEOUT = 5
+# Seconds between checks for a shutdown request while waiting for connections. Signals can
+# be delivered to any thread, so the main thread cannot rely on being interrupted.
+DAEMON_POLL_INTERVAL = 0.1
+# Idle connections a client keeps open to a daemon.
+DAEMON_MAX_IDLE = 8
+
+# A Unix socket path, or a (host, port) pair for TCP.
+Address = Union[str, Tuple[str, int]]
+
+
+def daemon_file(pod_name: str, name: str) -> str:
+    """
+    Path of one of the daemon's files inside the pod's state directory.
+    """
+    return join(pod_path(pod_name), PODS_STATE, name)
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Check if a process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_daemon_info(pod_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the info file of the pod's daemon, cleaning up after a daemon that died.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        Optional[Dict[str, Any]]: The pid and address of the running daemon, or None.
+    """
+    info_path = daemon_file(pod_name, DAEMON_INFO)
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if "pid" not in info or not pid_alive(info["pid"]) or not reachable(info_address(info)):
+        remove_daemon_files(info_path, info.get("address"))
+        return None
+    return info
+
+
+def reachable(address: Address) -> bool:
+    """
+    Check that a daemon accepts connections on an address.
+    """
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    with socket.socket(family, socket.SOCK_STREAM) as probe:
+        probe.settimeout(1)
+        try:
+            probe.connect(address)
+        except OSError:
+            return False
+    return True
+
+
+def info_address(info: Dict[str, Any]) -> Address:
+    """
+    Read the address of a daemon info file, JSON turns (host, port) into a list.
+    """
+    address = info["address"]
+    return address if isinstance(address, str) else (address[0], address[1])
+
+
+def remove_daemon_files(info_path: str, address: Optional[Any]) -> None:
+    """
+    Remove a daemon's info file and Unix socket.
+    """
+    for path in (info_path, address if isinstance(address, str) else None):
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class DaemonLock:
+    """
+    An exclusive lock on the pod's daemon files, held while a client checks for a running
+    daemon and starts one. Many client processes can then race to use the same pod safely.
+    """
+
+    def __init__(self, pod_name: str) -> None:
+        self.path = daemon_file(pod_name, DAEMON_LOCK)
+        self.file = None
+
+    def __enter__(self) -> "DaemonLock":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, mode="a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def ensure_daemon(
+    pod_name: str,
+    interpreter: str,
+    module: str,
+    workers: int = 1,
+    on_spawn: Optional[Callable[[], None]] = None,
+) -> Address:
+    """
+    Find the pod's running daemon, or start one listening on pods/<pod_name>/.pypods/daemon.sock
+    (localhost TCP where Unix sockets are not available). The daemon outlives the client
+    process that started it, until stop_daemon() is called.
+
+    Args:
+        pod_name (str): The name of the pod.
+        interpreter (str): Path to the pod's python interpreter.
+        module (str): Dotted name of the pod module to serve.
+        workers (int): Number of pod processes serving the daemon's connections.
+        on_spawn (Optional[Callable[[], None]]): Called if a daemon is started.
+
+    Returns:
+        Address: The address the daemon listens on.
+    """
+    with DaemonLock(pod_name):
+        info = read_daemon_info(pod_name)
+        if info is not None:
+            return info_address(info)
+        if not os.path.exists(interpreter):
+            raise PyPodWorkerError("Pod interpreter is missing!")
+        info_path = daemon_file(pod_name, DAEMON_INFO)
+        command = [interpreter, "-m", DAEMON_MODULE, module, "--info", info_path, "--workers", str(workers)]
+        if hasattr(socket, "AF_UNIX"):
+            command += ["--socket", daemon_file(pod_name, DAEMON_SOCKET)]
+        else:
+            command += ["--port", "0"]
+        with open(daemon_file(pod_name, DAEMON_LOG), mode="ab") as log:
+            if hasattr(os, "fork"):
+                # The launcher forks the daemon off and exits, so nobody has to reap the daemon.
+                launcher = subprocess.run(command + ["--detach"], stdin=DEVNULL, stdout=DEVNULL, stderr=log)
+                if launcher.returncode != 0:
+                    raise PyPodWorkerError(
+                        f"Pod daemon {pod_name} failed to start, see {daemon_file(pod_name, DAEMON_LOG)}"
+                    )
+            else:
+                subprocess.Popen(command, stdin=DEVNULL, stdout=DEVNULL, stderr=log)
+        if on_spawn is not None:
+            on_spawn()
+        limit = time.monotonic() + DAEMON_START_TIMEOUT
+        while time.monotonic() < limit:
+            try:
+                with open(info_path) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                time.sleep(0.01)
+                continue
+            if "error" in info:
+                os.remove(info_path)
+                raise PyPodWorkerError(info["error"])
+            return info_address(info)
+        raise PyPodWorkerError(
+            f"Pod daemon {pod_name} did not start in {DAEMON_START_TIMEOUT}s, "
+            f"see {daemon_file(pod_name, DAEMON_LOG)}"
+        )
+
+
+def stop_daemon(pod_name: str, timeout: float = DAEMON_STOP_TIMEOUT) -> bool:
+    """
+    Ask the pod's daemon to shut down gracefully: it stops accepting connections, lets the
+    calls in flight finish and removes its files. It is killed if it takes longer than timeout.
+
+    Args:
+        pod_name (str): The name of the pod.
+        timeout (float): Seconds to wait for the daemon to exit.
+
+    Returns:
+        bool: True if a daemon was running.
+    """
+    with DaemonLock(pod_name):
+        info = read_daemon_info(pod_name)
+        if info is None:
+            return False
+        pid, info_path = info["pid"], daemon_file(pod_name, DAEMON_INFO)
+        os.kill(pid, signal.SIGTERM)
+        # The daemon removes its info file last. Its pid may linger as a zombie until it is reaped.
+        limit = time.monotonic() + timeout
+        while exists(info_path) and pid_alive(pid) and time.monotonic() < limit:
+            time.sleep(0.01)
+        if exists(info_path) and pid_alive(pid):
+            os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        remove_daemon_files(info_path, info.get("address"))
+        return True
+
+
+class DaemonConnection:
+    """
+    One framed connection to a pod daemon. The codec is negotiated when it is opened.
+    """
+
+    def __init__(self, address: Address, codecs: Sequence[str]) -> None:
+        """
+        Connect to a daemon and negotiate the wire codec.
+
+        Args:
+            address (Address): Unix socket path or (host, port) of the daemon.
+            codecs (Sequence[str]): Wire codec names in order of preference.
+        """
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(address)
+            if family == socket.AF_INET:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.rfile = self.sock.makefile("rb")
+            self.wfile = self.sock.makefile("wb")
+            write_frame(self.wfile, dumps({"codecs": list(codecs)}))
+            ready = read_frame(self.rfile)
+        except BaseException:
+            self.sock.close()
+            raise
+        if ready is None:
+            self.close()
+            raise PyPodWorkerError(f"Pod daemon at {address} closed the connection")
+        ready = loads(ready)
+        if "error" in ready:
+            self.close()
+            raise PyPodWorkerError(ready["error"])
+        try:
+            self.codec: Codec = get_codec(ready["codec"])
+        except BaseException:
+            self.close()
+            raise
+
+    def send(self, message: Dict[str, Any], trace: Optional[CallTrace] = None) -> None:
+        """
+        Write a request frame.
+        """
+        start = time.perf_counter()
+        data = self.codec.dump_buffers(message)
+        if trace is not None:
+            trace.add_phase("encode", time.perf_counter() - start)
+            trace.request_bytes += sum(memoryview(buffer).nbytes for buffer in data)
+        write_frame(self.wfile, data)
+
+    def receive(self, trace: Optional[CallTrace] = None) -> Dict[str, Any]:
+        """
+        Read and decode a reply frame, failing if the daemon closes the connection first.
+        """
+        try:
+            response = read_frame(self.rfile)
+        except (EOFError, OSError):
+            response = None
+        if response is None:
+            raise PyPodWorkerError("Pod daemon closed the connection while handling a request")
+        start = time.perf_counter()
+        reply = self.codec.loads(response)
+        if trace is not None:
+            trace.add_phase("decode", time.perf_counter() - start)
+            trace.response_bytes += len(response)
+        return reply
+
+    def is_open(self) -> bool:
+        """
+        Check that an idle connection was not closed by the daemon, e.g. because it restarted.
+        """
+        try:
+            self.sock.setblocking(False)
+            try:
+                data = self.sock.recv(1, socket.MSG_PEEK)
+            finally:
+                self.sock.setblocking(True)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        # Either the daemon closed the connection, or it holds a leftover of a broken call.
+        return False
+
+    def interrupt(self) -> None:
+        """
+        Abort the request in flight from another thread. The daemon keeps running.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        """
+        Close the connection.
+        """
+        for stream in (getattr(self, "rfile", None), getattr(self, "wfile", None), self.sock):
+            try:
+                if stream is not None:
+                    stream.close()
+            except OSError:
+                pass
+
+
+class DaemonClient:
+    """
+    A pool of connections to a pod daemon, with the request()/call() interface of PodWorker.
+
+    Connections are opened on demand, so concurrent callers each get their own, and up to
+    max_idle of them are kept open between calls. When resolve is given, it is used to find
+    or start the daemon, and to start it again if it went away.
+    """
+
+    def __init__(
+        self,
+        address: Optional[Address] = None,
+        codecs: Sequence[str] = (DEFAULT_CODEC,),
+        resolve: Optional[Callable[[], Address]] = None,
+        max_idle: int = DAEMON_MAX_IDLE,
+    ) -> None:
+        """
+        Initialize the client.
+
+        Args:
+            address (Optional[Address]): Unix socket path or (host, port) of the daemon.
+            codecs (Sequence[str]): Wire codec names in order of preference.
+            resolve (Optional[Callable[[], Address]]): Finds or starts the daemon, see ensure_daemon().
+            max_idle (int): Number of idle connections kept open.
+        """
+        if address is None and resolve is None:
+            raise ValueError("DaemonClient needs an address or a resolve callable")
+        self.address = address
+        self.codecs = list(codecs)
+        self.resolve = resolve
+        self.max_idle = max_idle
+        self.idle: List[DaemonConnection] = []
+        self.lock = threading.Lock()
+        self.codec: Codec = BsonCodec()
+
+    def start(self) -> None:
+        """
+        Find or start the daemon and open a first connection to it.
+        """
+        self.release(self.connect())
+
+    def stop(self) -> None:
+        """
+        Close the idle connections. The daemon keeps serving other clients.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def connect(self) -> DaemonConnection:
+        """
+        Open a connection, finding or restarting the daemon through resolve if needed.
+        """
+        if self.address is None:
+            self.address = self.resolve()
+        try:
+            connection = DaemonConnection(self.address, self.codecs)
+        except (ConnectionRefusedError, FileNotFoundError):
+            if self.resolve is None:
+                raise PyPodWorkerError(f"No pod daemon is listening on {self.address}")
+            self.address = self.resolve()
+            connection = DaemonConnection(self.address, self.codecs)
+        self.codec = connection.codec
+        return connection
+
+    def acquire(self) -> DaemonConnection:
+        """
+        Take an idle connection, or open a new one.
+        """
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                connection = self.idle.pop()
+            if connection.is_open():
+                return connection
+            connection.close()
+        return self.connect()
+
+    def release(self, connection: DaemonConnection) -> None:
+        """
+        Give a healthy connection back to the pool.
+        """
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def request(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Send one request to the daemon and yield its replies, see PodWorker.request.
+        When the deadline passes or the call is cancelled, the connection is closed and the
+        call fails, but the daemon is shared and keeps running.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The replies.
+        """
+        if trace is not None:
+            message = dict(message, trace=True)
+        if deadline is None:
+            deadline = Deadline()
+        deadline.check()
+        try:
+            connection = self.acquire()
+        except (PyPodWorkerError, OSError):
+            # The deadline may have passed while the daemon was being started.
+            deadline.check()
+            raise
+        finished = False
+        resend = False
+        try:
+            try:
+                with deadline.watch(connection.interrupt):
+                    connection.send(message, trace)
+            except OSError:
+                # A pooled connection the daemon closed, nothing was read so it is safe to resend,
+                # unless the send failed because the call was interrupted.
+                connection.close()
+                deadline.check()
+                try:
+                    connection = self.connect()
+                except (PyPodWorkerError, OSError):
+                    deadline.check()
+                    raise
+                resend = True
+            # The rest of the call is watched on the connection that carries it.
+            with deadline.watch(connection.interrupt):
+                if resend:
+                    try:
+                        connection.send(message, trace)
+                    except OSError:
+                        deadline.check()
+                        raise
+                sent = time.perf_counter()
+                while not finished:
+                    try:
+                        reply = connection.receive(trace)
+                    except PyPodWorkerError:
+                        deadline.check()
+                        raise
+                    if trace is not None and sent is not None:
+                        roundtrip = time.perf_counter() - sent - trace.phases.get("decode", 0.0)
+                        trace.add_pod_timings(reply.pop("trace", {}), roundtrip)
+                        sent = None
+                    finished = not {"stream", "chunk"}.intersection(reply)
+                    yield reply
+        finally:
+            if finished and deadline.reason is None:
+                self.release(connection)
+            else:
+                connection.close()
+
+    def call(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send one request to the daemon and wait for its reply.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The reply.
+        """
+        replies = self.request(message, trace, deadline)
+        try:
+            return next(replies)
+        finally:
+            replies.close()
+
+
+class PodDaemon:
+    """
+    Serves a pod module to many clients over a listening socket, one thread per connection.
+    Calls of functions marked with threadsafe overlap across connections, any other
+    function runs one call at a time. Runs inside the pod's interpreter.
+    """
+
+    def __init__(self, namespace: Dict[str, Any], listener: socket.socket, allow_pickle: bool = True) -> None:
+        """
+        Initialize the daemon.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            listener (socket.socket): The bound and listening socket.
+            allow_pickle (bool): Whether clients may pick the pickle codec. Unpickling a request
+                runs arbitrary code, so only clients trusted with the pod's user should reach it.
+        """
+        self.namespace = namespace
+        self.listener = listener
+        self.allow_pickle = allow_pickle
+        self.connections: Set[socket.socket] = set()
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        # Shared by the connections, so that pod functions not marked threadsafe run one
+        # call at a time as in a worker, whichever connection called them.
+        self.runtime = PodRuntime()
+
+    def serve_forever(self) -> None:
+        """
+        Accept connections until stop() is called, then wait for the calls in flight.
+        """
+        self.listener.settimeout(DAEMON_POLL_INTERVAL)
+        while not self.stopping.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.stopping.is_set():
+                    break
+                raise
+            thread = threading.Thread(target=self.serve_connection, args=(connection,), daemon=True)
+            with self.lock:
+                self.connections.add(connection)
+                self.threads = [t for t in self.threads if t.is_alive()] + [thread]
+            thread.start()
+        with self.lock:
+            connections, threads = list(self.connections), list(self.threads)
+        # Idle connections see the end of their stream, busy ones once their reply is written.
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        limit = time.monotonic() + DAEMON_STOP_TIMEOUT
+        for thread in threads:
+            thread.join(max(0.0, limit - time.monotonic()))
+        self.runtime.shutdown()
+
+    def serve_connection(self, connection: socket.socket) -> None:
+        """
+        Negotiate the codec of a connection and serve its requests.
+
+        Args:
+            connection (socket.socket): The client's connection.
+        """
+        from pypods.pods import PodListener
+
+        rfile, wfile = connection.makefile("rb"), connection.makefile("wb")
+        try:
+            hello = read_frame(rfile)
+            if hello is None:
+                return
+            try:
+                names = loads(hello).get("codecs", [DEFAULT_CODEC])
+                if not self.allow_pickle:
+                    names = [name for name in names if name != PickleCodec.name]
+                    if not names:
+                        raise PyPodError("Pod daemon refuses the pickle codec, start it with --allow-pickle")
+                codec = negotiate_codec(names)
+            except Exception as e:
+                write_frame(wfile, dumps({"error": str(e)}))
+                return
+            write_frame(wfile, dumps({"ready": True, "codec": codec.name}))
+            PodListener().serve(self.namespace, rfile, wfile, codec, runtime=self.runtime)
+        except (OSError, EOFError):
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+            for stream in (rfile, wfile, connection):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+
+    def stop(self) -> None:
+        """
+        Stop accepting connections, safe to call from a signal handler.
+        """
+        self.stopping.set()
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+
+
+def write_info(path: str, info: Dict[str, Any]) -> None:
+    """
+    Atomically write the daemon's info file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode="w") as f:
+        json.dump(info, f)
+    os.replace(tmp_path, path)
+
+
+def listen(socket_path: Optional[str], host: str, port: Optional[int]) -> Tuple[socket.socket, Address]:
+    """
+    Create the daemon's listening socket.
+
+    Returns:
+        Tuple[socket.socket, Address]: The socket and the address clients connect to.
+    """
+    if port is not None:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        address: Address = listener.getsockname()[:2]
+    else:
+        if exists(socket_path):
+            # Left behind by a daemon that was killed, clients were told it is dead.
+            os.remove(socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socket_path)
+        address = socket_path
+    listener.listen(128)
+    return listener, address
+
+
+def serve_workers(namespace: Dict[str, Any], listener: socket.socket, workers: int, allow_pickle: bool = True) -> None:
+    """
+    Serve the listening socket from forked copies of this process, restarting any that dies,
+    until SIGTERM is received. Every copy inherits the already imported pod module.
+
+    Args:
+        namespace (Dict[str, Any]): The pod module's global namespace.
+        listener (socket.socket): The bound and listening socket.
+        workers (int): Number of processes.
+        allow_pickle (bool): Whether clients may pick the pickle codec, see PodDaemon.
+    """
+    stopping = threading.Event()
+    children: Set[int] = set()
+
+    def fork_worker() -> None:
+        pid = os.fork()
+        if pid == 0:
+            daemon = PodDaemon(namespace, listener, allow_pickle)
+            signal.signal(signal.SIGTERM, lambda *args: daemon.stop())
+            signal.signal(signal.SIGINT, lambda *args: daemon.stop())
+            status = 1
+            try:
+                daemon.serve_forever()
+                status = 0
+            finally:
+                sys.stderr.flush()
+                os._exit(status)
+        children.add(pid)
+
+    def stop(*args) -> None:
+        stopping.set()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        fork_worker()
+    listener.close()
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping.is_set():
+            print(f"Pod daemon worker {pid} exited, starting a new one", file=sys.stderr)
+            fork_worker()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Entry point of the daemon process that runs inside the pod's interpreter.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments, defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(prog=f"python -m {DAEMON_MODULE}")
+    parser.add_argument("module", help="Dotted name of the pod module to serve")
+    parser.add_argument("--socket", help="Path of the Unix socket to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on with --port")
+    parser.add_argument("--port", type=int, help="Listen on TCP instead, 0 picks a free port")
+    parser.add_argument("--info", required=True, help="Where to write the daemon's pid and address")
+    parser.add_argument("--workers", type=int, default=1, help="Number of forked pod processes (POSIX)")
+    parser.add_argument(
+        "--allow-pickle",
+        action="store_true",
+        help="Let clients pick the pickle codec over --port. Unpickling runs arbitrary code, so it is "
+        "refused on TCP unless every client that can reach the port is trusted",
+    )
+    parser.add_argument("--detach", action="store_true", help="Fork into the background and return")
+    args = parser.parse_args(argv)
+    if (args.socket is None) == (args.port is None):
+        parser.error("pass exactly one of --socket and --port")
+
+    if args.detach:
+        if os.fork() != 0:
+            os._exit(0)
+        os.setsid()
+    # Anything the pod prints goes to the daemon's log, i.e. its stderr.
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    from pypods.ns import get_module_namespace
+
+    try:
+        if args.workers < 1:
+            raise ValueError("workers must be a positive integer")
+        if args.workers > 1 and not hasattr(os, "fork"):
+            raise PyPodWorkerError("Pod daemon workers require os.fork, which this platform lacks")
+        namespace = get_module_namespace(args.module)
+        listener, address = listen(args.socket, args.host, args.port)
+    except Exception as e:
+        write_info(args.info, {"error": f"Pod daemon failed to start: {e}"})
+        sys.exit(1)
+    write_info(args.info, {"pid": os.getpid(), "address": address})
+    # A Unix socket is only reachable by the users its file permissions let in.
+    allow_pickle = args.port is None or args.allow_pickle
+    try:
+        if args.workers > 1:
+            serve_workers(namespace, listener, args.workers, allow_pickle)
+        else:
+            daemon = PodDaemon(namespace, listener, allow_pickle)
+            signal.signal(signal.SIGTERM, lambda *args: daemon.stop())
+            signal.signal(signal.SIGINT, lambda *args: daemon.stop())
+            daemon.serve_forever()
+    finally:
+        remove_daemon_files(args.info, address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Iterator, List, Optional
+
+from pypods.errors import PyPodCancelledError, PyPodTimeoutError
+
+
+class CancelToken:
+    """
+    Lets a caller abort pod calls from any thread. Cancelling the token kills the pod
+    process serving every in-flight call that was made with it.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.callbacks: List[Callable[[], None]] = []
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Cancel the token and abort the calls made with it.
+        """
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback when the token is cancelled, right away if it already is.
+
+        Args:
+            callback (Callable[[], None]): The callback.
+        """
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Forget a callback added with add_callback().
+
+        Args:
+            callback (Callable[[], None]): The callback.
+        """
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class DeadlineTimer:
+    """
+    Runs the callbacks of the watched deadlines of every thread from one timer thread,
+    earliest first, instead of starting a thread per call. The thread is started on
+    first use.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget every scheduled callback and the timer thread, e.g. in a forked child, where
+        the thread does not exist and its lock may have been held at the time of the fork.
+        """
+        self.condition = threading.Condition()
+        # [expires, sequence, callback] entries, the callback of a cancelled one is None.
+        self.heap: List[List[Any]] = []
+        self.cancelled = 0
+        self.sequence = itertools.count()
+        self.thread: Optional[threading.Thread] = None
+
+    def schedule(self, expires: float, callback: Callable[[], None]) -> List[Any]:
+        """
+        Run callback on the timer thread at a time.monotonic().
+
+        Args:
+            expires (float): When to run the callback.
+            callback (Callable[[], None]): The callback.
+
+        Returns:
+            List[Any]: The entry of the callback, to pass to cancel().
+        """
+        entry = [expires, next(self.sequence), callback]
+        with self.condition:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="pypods-deadlines", daemon=True)
+                self.thread.start()
+            if self.heap[0] is entry:
+                self.condition.notify()
+        return entry
+
+    def cancel(self, entry: List[Any]) -> None:
+        """
+        Drop a callback that did not run yet.
+
+        Args:
+            entry (List[Any]): The entry returned by schedule().
+        """
+        with self.condition:
+            if entry[2] is None:
+                return
+            entry[2] = None
+            self.cancelled += 1
+            # Calls usually finish long before their deadline, so cancelled entries are
+            # dropped in bulk rather than left to pile up until they expire.
+            if self.cancelled > len(self.heap) // 2:
+                self.heap = [item for item in self.heap if item[2] is not None]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def run(self) -> None:
+        """
+        Run the callbacks as they expire, the target of the timer thread.
+        """
+        while True:
+            with self.condition:
+                while self.heap and self.heap[0][2] is None:
+                    heapq.heappop(self.heap)
+                    self.cancelled -= 1
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                delay = self.heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                entry = heapq.heappop(self.heap)
+                callback, entry[2] = entry[2], None
+            try:
+                callback()
+            except Exception:
+                # A failing callback must not stop the deadlines of the other calls.
+                pass
+
+
+TIMER = DeadlineTimer()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=TIMER.reset)
+
+
+class Deadline:
+    """
+    The time limit and cancel token of a single pod call.
+
+    While a call is watched, expiring or cancelling it runs a kill callback that terminates
+    the pod process serving it. The caller then raises the matching error.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+        expires: Optional[float] = None,
+    ) -> None:
+        """
+        Initialize the deadline of a call.
+
+        Args:
+            timeout (Optional[float]): Seconds the call may take from now, None for no limit.
+            cancel (Optional[CancelToken]): Token that aborts the call.
+            expires (Optional[float]): An earlier time.monotonic() the call must finish by,
+                e.g. the deadline of an enclosing deadline() block.
+        """
+        if timeout is not None:
+            if timeout <= 0:
+                raise ValueError("timeout must be a positive number of seconds")
+            limit = time.monotonic() + timeout
+            expires = limit if expires is None else min(expires, limit)
+        self.expires = expires
+        self.cancel = cancel
+        # Why the call was interrupted: "timeout" or "cancel".
+        self.reason: Optional[str] = None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left before the deadline.
+
+        Returns:
+            Optional[float]: The seconds left, 0 once expired, None if the call has no time limit.
+        """
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self) -> None:
+        """
+        Raise if the call was interrupted, or if it is already cancelled or past its deadline.
+        """
+        if self.reason is None:
+            if self.cancel is not None and self.cancel.cancelled:
+                self.reason = "cancel"
+            elif self.remaining() == 0:
+                self.reason = "timeout"
+        if self.reason == "cancel":
+            raise PyPodCancelledError("Pod call was cancelled")
+        if self.reason == "timeout":
+            raise PyPodTimeoutError("Pod call exceeded its deadline")
+
+    def interrupt(self, reason: str, kill: Callable[[], None]) -> None:
+        """
+        Interrupt the call, terminating the pod process serving it. The first reason is kept,
+        but the kill of every watch runs, e.g. of a worker and of the budget slot it waits for.
+        """
+        if self.reason is None:
+            self.reason = reason
+        kill()
+
+    @contextmanager
+    def watch(self, kill: Callable[[], None]) -> Iterator["Deadline"]:
+        """
+        Run kill from the timer thread when the deadline passes, or when the call is cancelled.
+
+        Args:
+            kill (Callable[[], None]): Terminates the pod process serving the call.
+        """
+        self.check()
+        timer = None
+        if self.expires is not None:
+            timer = TIMER.schedule(self.expires, partial(self.interrupt, "timeout", kill))
+
+        def on_cancel() -> None:
+            self.interrupt("cancel", kill)
+
+        if self.cancel is not None:
+            self.cancel.add_callback(on_cancel)
+        try:
+            yield self
+        finally:
+            if timer is not None:
+                TIMER.cancel(timer)
+            if self.cancel is not None:
+                self.cancel.remove_callback(on_cancel)
+
+    @asynccontextmanager
+    async def watch_async(self, kill: Callable[[], None]):
+        """
+        The asyncio counterpart of watch(), kill runs on the event loop.
+
+        Args:
+            kill (Callable[[], None]): Terminates the pod process serving the call.
+        """
+        self.check()
+        loop = asyncio.get_running_loop()
+        timer = None
+        if self.expires is not None:
+            timer = loop.call_later(self.remaining(), self.interrupt, "timeout", kill)
+
+        def on_cancel() -> None:
+            loop.call_soon_threadsafe(self.interrupt, "cancel", kill)
+
+        if self.cancel is not None:
+            self.cancel.add_callback(on_cancel)
+        try:
+            yield self
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if self.cancel is not None:
+                self.cancel.remove_callback(on_cancel)
+
+
+# The deadline of the enclosing deadline() block, if any.
+CURRENT_DEADLINE: ContextVar[Optional[Deadline]] = ContextVar("pypods_deadline", default=None)
+
+
+@contextmanager
+def deadline(timeout: Optional[float] = None, cancel: Optional[CancelToken] = None) -> Iterator[Deadline]:
+    """
+    Bound every pod call made in the block, from this thread or asyncio task:
+
+        with deadline(0.5):
+            hello_world_pod.foo()
+
+    The timeout starts when the block is entered and is shared by all its calls. Calls that
+    do not finish in time, or that are cancelled through the token, have their pod process
+    killed and raise PyPodTimeoutError or PyPodCancelledError. Nested blocks keep the
+    earliest deadline.
+
+    Args:
+        timeout (Optional[float]): Seconds the block may spend in pod calls, None for no limit.
+        cancel (Optional[CancelToken]): Token that aborts the block's calls.
+    """
+    outer = CURRENT_DEADLINE.get()
+    expires = outer.expires if outer is not None else None
+    if cancel is None and outer is not None:
+        cancel = outer.cancel
+    scope = CURRENT_DEADLINE.set(Deadline(timeout, cancel, expires))
+    try:
+        yield CURRENT_DEADLINE.get()
+    finally:
+        CURRENT_DEADLINE.reset(scope)
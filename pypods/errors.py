@@ -24,4 +24,29 @@ class PyPodResponseError(PyPodError):
 class PyPodNotFound(PyPodError):
     """Raised when pod could not be located"""
 
-    pass
\ No newline at end of file
+    pass
+
+class PyPodWorkerError(PyPodError):
+    """Raised when a persistent pod worker process fails"""
+
+    pass
+
+class PyPodProvisionError(PyPodError):
+    """Raised when a pod's virtual environment could not be provisioned"""
+
+    pass
+
+class PyPodTimeoutError(PyPodError):
+    """Raised when a pod call does not finish before its deadline"""
+
+    pass
+
+class PyPodCancelledError(PyPodError):
+    """Raised when a pod call is cancelled through its cancel token"""
+
+    pass
+
+class PyPodNamespaceWarning(UserWarning):
+    """Issued when a pod function's signature cannot be fully read without importing the pod"""
+
+    pass
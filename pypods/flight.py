@@ -0,0 +1,252 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import asyncio
+import collections.abc
+import copy
+import threading
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pypods.deadline import CURRENT_DEADLINE, Deadline
+from pypods.errors import PyPodCancelledError, PyPodError, PyPodTimeoutError
+
+
+class Flight:
+    """
+    One pod execution in progress, awaited by every call that joined it.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        # False when the outcome cannot be shared, e.g. an iterator that a single caller
+        # consumes, the calls that joined the execution then run their own.
+        self.shared = True
+        # Events of the threads waiting for the execution.
+        self.waiters: List[threading.Event] = []
+        # Futures of the asyncio calls waiting for the execution, with their event loops.
+        self.futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls of one pod function.
+
+    The first call with given arguments runs in the pod, and every call with the same
+    arguments made while it is in flight waits for it and gets its result, or raises its
+    error. Nothing is kept once the execution finished, unlike ResultCache. Results are
+    shared between the coalesced calls, so callers should not mutate them.
+    """
+
+    def __init__(self, on_coalesced: Optional[Callable[[], None]] = None) -> None:
+        """
+        Initialize the group with no call in flight.
+
+        Args:
+            on_coalesced (Optional[Callable[[], None]]): Called for every call that joined
+                an execution in flight, e.g. to count it in the loader's metrics.
+        """
+        self.lock = threading.Lock()
+        self.flights: Dict[str, Flight] = {}
+        self.on_coalesced = on_coalesced
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Single-flight counters.
+
+        Returns:
+            Dict[str, int]: calls, executions (calls that ran in the pod), coalesced (calls
+            that shared the execution of another one) and in_flight.
+        """
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.flights),
+            }
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """
+        Find the execution in flight for a key, or register a new one.
+
+        Args:
+            key (str): The key built by canonical_key.
+
+        Returns:
+            Tuple[Flight, bool]: The flight, and True if the caller must execute it.
+        """
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self.flights[key] = Flight()
+                self.executions += 1
+                leader = True
+        if not leader and self.on_coalesced is not None:
+            self.on_coalesced()
+        return flight, leader
+
+    def land(self, key: str, flight: Flight, value: Any = None, error: Optional[BaseException] = None) -> None:
+        """
+        Publish the outcome of an execution to the calls that joined it.
+        """
+        flight.value, flight.error = value, error
+        flight.shared = not isinstance(value, (collections.abc.Iterator, collections.abc.AsyncIterator))
+        if error is not None and (
+            isinstance(error, (PyPodTimeoutError, PyPodCancelledError)) or not isinstance(error, Exception)
+        ):
+            # The leader's own deadline or cancellation, not an outcome of the call.
+            flight.error, flight.shared = None, False
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            flight.done.set()
+            waiters, flight.waiters = flight.waiters, []
+            futures, flight.futures = flight.futures, []
+        for waiter in waiters:
+            waiter.set()
+        for loop, future in futures:
+            loop.call_soon_threadsafe(wake, future)
+
+    def call(self, key: str, function: Callable[[], Any], deadline: Optional[Deadline] = None) -> Any:
+        """
+        Run function, or wait for the execution in flight with the same key.
+        A waiting call gives up when its deadline passes or its cancel token is cancelled.
+
+        Args:
+            key (str): The key built by canonical_key.
+            function (Callable[[], Any]): Executes the call in the pod.
+            deadline (Optional[Deadline]): Time limit and cancel token of the call, e.g. from
+                PodLoader.call_deadline(), defaults to the enclosing deadline() block.
+
+        Returns:
+            Any: The result of the execution.
+        """
+        flight, leader = self.join(key)
+        if leader:
+            try:
+                value = function()
+            except BaseException as e:
+                self.land(key, flight, error=e)
+                raise
+            self.land(key, flight, value)
+            return value
+        deadline = waiter_deadline(deadline)
+        woken = threading.Event()
+        with self.lock:
+            if not flight.done.is_set():
+                flight.waiters.append(woken)
+            else:
+                woken.set()
+        with deadline.watch(woken.set):
+            woken.wait()
+        if not flight.done.is_set():
+            deadline.check()
+        return self.result(flight, function)
+
+    async def call_async(
+        self, key: str, function: Callable[[], Awaitable[Any]], deadline: Optional[Deadline] = None
+    ) -> Any:
+        """
+        The asyncio counterpart of call(), waiting calls do not block the event loop.
+
+        Args:
+            key (str): The key built by canonical_key.
+            function (Callable[[], Awaitable[Any]]): Executes the call in the pod.
+            deadline (Optional[Deadline]): Time limit and cancel token of the call, defaults
+                to the enclosing deadline() block.
+
+        Returns:
+            Any: The result of the execution.
+        """
+        flight, leader = self.join(key)
+        if leader:
+            try:
+                value = await function()
+            except BaseException as e:
+                self.land(key, flight, error=e)
+                raise
+            self.land(key, flight, value)
+            return value
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if not flight.done.is_set():
+                # The leader may run on another thread or event loop.
+                flight.futures.append((loop, future))
+            else:
+                future.set_result(None)
+        deadline = waiter_deadline(deadline)
+        async with deadline.watch_async(partial(wake, future)):
+            await future
+        if not flight.done.is_set():
+            deadline.check()
+        if flight.error is None and not flight.shared:
+            return await function()
+        return self.result(flight, function)
+
+    def result(self, flight: Flight, function: Optional[Callable[[], Any]]) -> Any:
+        """
+        The outcome of a finished execution for a call that joined it.
+        """
+        if flight.error is not None:
+            raise copy_error(flight.error) from flight.error
+        if not flight.shared:
+            return function()
+        return flight.value
+
+
+def waiter_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """
+    The deadline of a call waiting for an execution in flight. A waiter interrupted by its
+    deadline must not mark the enclosing deadline() block as interrupted, so it gets its own.
+
+    Args:
+        deadline (Optional[Deadline]): The deadline of the call, if any.
+
+    Returns:
+        Deadline: The deadline to wait with.
+    """
+    if deadline is not None:
+        return deadline
+    scope = CURRENT_DEADLINE.get()
+    if scope is None:
+        return Deadline()
+    return Deadline(cancel=scope.cancel, expires=scope.expires)
+
+
+def copy_error(error: BaseException) -> BaseException:
+    """
+    A copy of the error of an execution, raised by a call that joined it. The calls run on
+    different threads, and raising the same exception object from each of them would mix
+    their tracebacks in it.
+
+    Args:
+        error (BaseException): The error of the execution.
+
+    Returns:
+        BaseException: An exception of the same type and arguments.
+    """
+    try:
+        return copy.copy(error)
+    except Exception:
+        return PyPodError(str(error))
+
+
+def wake(future: asyncio.Future) -> None:
+    """
+    Resolve the future of a waiting asyncio call, unless the call gave up.
+    """
+    if not future.done():
+        future.set_result(None)
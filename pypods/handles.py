@@ -0,0 +1,252 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import collections
+import itertools
+import os
+import secrets
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, List, Set
+
+from pypods.errors import PyPodResponseError
+
+if TYPE_CHECKING:
+    from pypods.pods import PodLoader
+
+
+class PodObject:
+    """
+    Marks a pod function's return value to be kept in the pod instead of being serialized.
+    """
+
+    def __init__(self, obj: Any) -> None:
+        self.obj = obj
+
+
+def handle(obj: Any) -> PodObject:
+    """
+    Return an object from a pod function by reference. The object stays in the pod
+    process and the client gets a PodHandle whose method calls and attribute reads run
+    in the pod:
+
+        def load_model(path):
+            return handle(Model(path))
+
+    Args:
+        obj (Any): The object to keep in the pod, e.g. a loaded model or an index.
+
+    Returns:
+        PodObject: The value to return from the pod function.
+    """
+    return PodObject(obj)
+
+
+class ObjectTable:
+    """
+    The objects of a pod process that clients hold handles to.
+    """
+
+    def __init__(self) -> None:
+        self.objects: Dict[str, Any] = {}
+        self.reseed()
+
+    def reseed(self) -> None:
+        """
+        Start a new sequence of IDs. IDs are unique across pod processes, so a handle that
+        outlived a restarted worker cannot reach an object of the new one. Forked pod
+        processes, e.g. the workers of a daemon, call it so that they do not issue the IDs
+        of the process they were forked from.
+        """
+        # The lock may have been held by another thread of the parent at fork time.
+        self.lock = threading.Lock()
+        self.prefix = secrets.token_hex(4)
+        self.ids = itertools.count(1)
+
+    def put(self, obj: Any) -> str:
+        """
+        Keep an object and return its ID.
+
+        Args:
+            obj (Any): The object.
+
+        Returns:
+            str: The ID of the object.
+        """
+        with self.lock:
+            object_id = f"{self.prefix}-{next(self.ids)}"
+            self.objects[object_id] = obj
+        return object_id
+
+    def get(self, object_id: str) -> Any:
+        """
+        Look up an object by ID.
+
+        Args:
+            object_id (str): The ID of the object.
+
+        Returns:
+            Any: The object.
+        """
+        with self.lock:
+            if object_id not in self.objects:
+                raise PyPodResponseError(
+                    f"Remote object {object_id} does not exist, it was released or its pod process restarted"
+                )
+            return self.objects[object_id]
+
+    def release(self, object_ids: Iterable[str]) -> None:
+        """
+        Drop objects, ignoring IDs that are not in the table.
+
+        Args:
+            object_ids (Iterable[str]): The IDs of the objects.
+        """
+        with self.lock:
+            for object_id in object_ids:
+                self.objects.pop(object_id, None)
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+
+# The object table of this pod process.
+OBJECTS = ObjectTable()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=OBJECTS.reseed)
+
+
+# Returned by PodLoader.call_handle() when the attribute read is a method of the pod object.
+METHOD = object()
+
+
+class PodHandle:
+    """
+    Client-side proxy of an object that lives in a pod process.
+
+    Method calls and attribute reads are sent to the pod. Methods are told apart from
+    other attributes by the pod on first use, so later calls to the same method cost a
+    single round-trip. The pod object is released when the handle is closed or garbage
+    collected. Handles need a pod process that outlives the call, i.e. worker or daemon mode.
+    """
+
+    def __init__(self, loader: "PodLoader", object_id: str, type_name: str) -> None:
+        """
+        Initialize the proxy of a pod object.
+
+        Args:
+            loader (PodLoader): The loader of the pod holding the object.
+            object_id (str): The ID of the object in the pod's object table.
+            type_name (str): The name of the object's type.
+        """
+        self._loader = loader
+        self._id = object_id
+        self._type = type_name
+        self._methods: Set[str] = set()
+        self._finalizer = weakref.finalize(self, loader.release_handle, object_id)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._methods:
+            return self._method(name)
+        reply = self._request({"handle": self._id, "attr": name}, name)
+        if reply is METHOD:
+            self._methods.add(name)
+            return self._method(name)
+        return reply
+
+    def _method(self, name: str) -> Callable[..., Any]:
+        """
+        Build the proxy of a method of the pod object.
+        """
+
+        def remote_method(*args, **kwargs):
+            return self._request({"handle": self._id, "method": name, "args": args, "kwargs": kwargs}, name)
+
+        remote_method.__name__ = name
+        return remote_method
+
+    def _request(self, message: Dict[str, Any], name: str) -> Any:
+        """
+        Send a request about the pod object and return its result.
+        """
+        if not self._finalizer.alive:
+            raise PyPodResponseError(f"Remote object {self._id} is closed")
+        return self._loader.call_handle(message, f"{self._type}.{name}")
+
+    @property
+    def closed(self) -> bool:
+        """
+        True once the handle was closed.
+        """
+        return not self._finalizer.alive
+
+    def close(self) -> None:
+        """
+        Release the pod object right away.
+        """
+        if self._finalizer.alive:
+            self._finalizer()
+            self._loader.flush_releases()
+
+    def __enter__(self) -> "PodHandle":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        state = " closed" if self.closed else ""
+        return f"<PodHandle {self._type} {self._id} of pod {self._loader.pod_name}{state}>"
+
+
+class ReleaseQueue:
+    """
+    IDs of pod objects whose handles were garbage collected, waiting to be sent to the pod.
+
+    Handles are often collected in the middle of another pod call, so they only queue
+    their ID without locking and the IDs travel with the next request.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Deque[str] = collections.deque()
+
+    def put(self, object_id: str) -> None:
+        """
+        Queue the ID of a released pod object.
+        """
+        self.ids.append(object_id)
+
+    def drain(self) -> List[str]:
+        """
+        Take every queued ID.
+
+        Returns:
+            List[str]: The IDs.
+        """
+        ids = []
+        while True:
+            try:
+                ids.append(self.ids.popleft())
+            except IndexError:
+                return ids
+
+    def __bool__(self) -> bool:
+        return bool(self.ids)
+
+
+def returned_objects(reply: Dict[str, Any]) -> List[str]:
+    """
+    IDs of the pod objects a reply returned by reference, including those of a batch reply.
+
+    Args:
+        reply (Dict[str, Any]): The pod's reply.
+
+    Returns:
+        List[str]: The IDs.
+    """
+    items = reply["batch"] if isinstance(reply.get("batch"), list) else [reply]
+    return [item["handle"] for item in items if isinstance(item, dict) and "handle" in item]
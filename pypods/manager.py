@@ -0,0 +1,457 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+from pypods.deadline import Deadline
+from pypods.errors import PyPodTimeoutError
+
+if TYPE_CHECKING:
+    from pypods.pods import PodLoader
+    from pypods.pool import PodPool
+    from pypods.worker import PodWorker
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """
+    Resident set size of a process.
+
+    Args:
+        pid (int): The process ID.
+
+    Returns:
+        Optional[int]: The RSS in bytes, None if it cannot be read, e.g. outside Linux.
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class WorkerState:
+    """
+    What a PodManager knows about one pod worker.
+    """
+
+    def __init__(self, pod_name: str) -> None:
+        self.pod_name = pod_name
+        # True while the worker has a process, which holds one of the manager's slots.
+        self.running = False
+        # Requests in progress or waiting for the worker.
+        self.busy = 0
+        # Requests served by the current process.
+        self.calls = 0
+        self.last_used = time.monotonic()
+
+
+class PodManager:
+    """
+    Owns the PodLoaders of a service and bounds the pod processes they run.
+
+    Every pod process started by a managed loader takes a slot: a spawned process for the
+    duration of its call, a worker process for as long as it runs. When no slot is free,
+    the least recently used idle worker process is stopped to make room, and if every
+    process is busy the caller waits for one. Worker processes are also recycled after a
+    number of calls or once their memory grows past a limit, and can be stopped when they
+    sit idle for too long. A stopped worker restarts transparently on the next call.
+
+    Pod daemons own their processes and asyncio loaders drive their own, so neither can be
+    managed. A zygote takes one slot, its forked children run one at a time.
+    """
+
+    def __init__(
+        self,
+        max_processes: int,
+        quotas: Optional[Dict[str, int]] = None,
+        max_calls: Optional[int] = None,
+        max_rss: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Initialize the manager with its process budget.
+
+        Args:
+            max_processes (int): Pod processes running at once across all pods.
+            quotas (Optional[Dict[str, int]]): Pod processes running at once per pod name,
+                pods without a quota can use the whole budget.
+            max_calls (Optional[int]): Recycle a worker process once it served this many calls.
+            max_rss (Optional[int]): Recycle a worker process once its resident memory exceeds
+                this many bytes, checked after every call. Linux only.
+            idle_timeout (Optional[float]): Stop worker processes that served no call for this
+                many seconds.
+        """
+        if max_processes < 1:
+            raise ValueError("max_processes must be a positive integer")
+        for pod_name, quota in (quotas or {}).items():
+            if quota < 1:
+                raise ValueError(f"quota of pod {pod_name} must be a positive integer")
+        if max_calls is not None and max_calls < 1:
+            raise ValueError("max_calls must be a positive integer")
+        if max_rss is not None and max_rss < 1:
+            raise ValueError("max_rss must be a positive number of bytes")
+        if idle_timeout is not None and idle_timeout <= 0:
+            raise ValueError("idle_timeout must be a positive number of seconds")
+        self.max_processes = max_processes
+        self.quotas = dict(quotas or {})
+        self.max_calls = max_calls
+        self.max_rss = max_rss
+        self.idle_timeout = idle_timeout
+        self.condition = threading.Condition()
+        self.loaders: List["PodLoader"] = []
+        # Running pod processes, by pod name.
+        self.running: Dict[str, int] = {}
+        # Known workers from least to most recently used.
+        self.workers: "OrderedDict[PodWorker, WorkerState]" = OrderedDict()
+        self.evicting: Set["PodWorker"] = set()
+        self.waiting = 0
+        self.counters = {"started": 0, "queued": 0, "evicted": 0, "recycled": 0, "expired": 0}
+        self.closed = threading.Event()
+        self.reaper: Optional[threading.Thread] = None
+        if idle_timeout is not None:
+            self.reaper = threading.Thread(target=self._reap_idle, name="pypods-manager", daemon=True)
+            self.reaper.start()
+
+    def loader(self, pod_name: str, namespace: dict, **kwargs) -> "PodLoader":
+        """
+        Create a PodLoader owned by the manager.
+
+        Args:
+            pod_name (str): The name of the pod.
+            namespace (dict): The namespace dictionary where pod functions are loaded.
+            **kwargs: Other PodLoader options.
+
+        Returns:
+            PodLoader: The loader.
+        """
+        from pypods.pods import PodLoader
+
+        return PodLoader(pod_name, namespace, manager=self, **kwargs)
+
+    def pool(self, pod_name: str, namespace: dict, size: Optional[int] = None, **kwargs) -> "PodPool":
+        """
+        Create a PodPool owned by the manager.
+
+        Args:
+            pod_name (str): The name of the pod.
+            namespace (dict): The namespace dictionary where pod functions are loaded.
+            size (Optional[int]): Number of pod workers, defaults to the number of CPUs.
+            **kwargs: Other PodLoader options.
+
+        Returns:
+            PodPool: The pool.
+        """
+        from pypods.pool import PodPool
+
+        return PodPool(pod_name, namespace, size, manager=self, **kwargs)
+
+    def register(self, loader: "PodLoader") -> "PodBudget":
+        """
+        Take ownership of a loader, called by PodLoader when it is given a manager.
+
+        Args:
+            loader (PodLoader): The loader.
+
+        Returns:
+            PodBudget: The view of the budget the loader's processes are started from.
+        """
+        if loader.mode == "daemon":
+            raise ValueError("A PodManager cannot manage daemon mode, the pod daemon owns its processes")
+        with self.condition:
+            self.loaders.append(loader)
+        return PodBudget(self, loader.pod_name)
+
+    def quota(self, pod_name: str) -> int:
+        """
+        Pod processes a pod may run at once.
+        """
+        return min(self.quotas.get(pod_name, self.max_processes), self.max_processes)
+
+    def has_room(self, pod_name: str) -> bool:
+        """
+        Check if a pod may start a process right away, the caller must hold the condition.
+        """
+        return (
+            sum(self.running.values()) < self.max_processes
+            and self.running.get(pod_name, 0) < self.quota(pod_name)
+        )
+
+    def state(self, pod_name: str, worker: "PodWorker") -> WorkerState:
+        """
+        The state of a worker, created on first use. The caller must hold the condition.
+        """
+        state = self.workers.get(worker)
+        if state is None:
+            state = self.workers[worker] = WorkerState(pod_name)
+        return state
+
+    def acquire(self, pod_name: str, worker: Optional["PodWorker"] = None, deadline: Optional[Deadline] = None) -> None:
+        """
+        Take a slot for a new pod process, stopping idle worker processes to make room or
+        waiting for a slot if every process is busy.
+
+        Args:
+            pod_name (str): The name of the pod.
+            worker (Optional[PodWorker]): The worker starting the process, None for a spawned process.
+            deadline (Optional[Deadline]): Time limit and cancel token of the wait.
+        """
+        if deadline is None:
+            deadline = Deadline()
+        with deadline.watch(self.wake), self.condition:
+            queued = False
+            try:
+                while not self.has_room(pod_name):
+                    try:
+                        deadline.check()
+                    except PyPodTimeoutError:
+                        raise PyPodTimeoutError(
+                            "Pod call exceeded its deadline while waiting for a pod process slot"
+                        ) from None
+                    victim = self.idle_victim(pod_name)
+                    if victim is not None:
+                        self.evict(victim)
+                        continue
+                    if not queued:
+                        queued = True
+                        self.waiting += 1
+                        self.counters["queued"] += 1
+                    self.condition.wait()
+            finally:
+                if queued:
+                    self.waiting -= 1
+            self.running[pod_name] = self.running.get(pod_name, 0) + 1
+            self.counters["started"] += 1
+            if worker is not None:
+                state = self.state(pod_name, worker)
+                state.running, state.calls = True, 0
+
+    def release(self, pod_name: str, worker: Optional["PodWorker"] = None) -> None:
+        """
+        Give back the slot of a pod process that exited.
+
+        Args:
+            pod_name (str): The name of the pod.
+            worker (Optional[PodWorker]): The worker whose process exited, None for a spawned process.
+        """
+        with self.condition:
+            if worker is not None:
+                state = self.workers.get(worker)
+                if state is None or not state.running:
+                    return
+                state.running = False
+                if not state.busy:
+                    del self.workers[worker]
+            self.running[pod_name] -= 1
+            if not self.running[pod_name]:
+                del self.running[pod_name]
+            self.condition.notify_all()
+
+    def wake(self) -> None:
+        """
+        Wake the callers waiting for a slot, e.g. so that they notice their deadline passed.
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def idle_victim(self, pod_name: str) -> Optional["PodWorker"]:
+        """
+        The least recently used idle worker whose process can be stopped to make room for
+        a process of pod_name. The caller must hold the condition.
+        """
+        same_pod = self.running.get(pod_name, 0) >= self.quota(pod_name)
+        for worker, state in self.workers.items():
+            if not state.running or state.busy or worker in self.evicting:
+                continue
+            if same_pod and state.pod_name != pod_name:
+                continue
+            return worker
+        return None
+
+    def evict(self, worker: "PodWorker", counter: str = "evicted") -> None:
+        """
+        Stop the process of an idle worker. The caller must hold the condition, which is
+        released while the process exits and calls touching the worker wait for it.
+        """
+        self.evicting.add(worker)
+        self.condition.release()
+        try:
+            worker.stop()
+        finally:
+            self.condition.acquire()
+            self.evicting.discard(worker)
+            self.counters[counter] += 1
+            self.condition.notify_all()
+
+    def busy(self, pod_name: str, worker: "PodWorker") -> None:
+        """
+        Mark a worker as serving a request, waiting if its process is being stopped.
+
+        Args:
+            pod_name (str): The name of the pod.
+            worker (PodWorker): The worker.
+        """
+        with self.condition:
+            while worker in self.evicting:
+                self.condition.wait()
+            state = self.state(pod_name, worker)
+            state.busy += 1
+            self.workers.move_to_end(worker)
+
+    def done(self, worker: "PodWorker", served: bool = True) -> bool:
+        """
+        Mark the end of a request of a worker and tell if its process should be recycled.
+
+        Args:
+            worker (PodWorker): The worker.
+            served (bool): The request reached the worker process.
+
+        Returns:
+            bool: True if the process served max_calls calls or uses more than max_rss bytes.
+        """
+        with self.condition:
+            state = self.workers.get(worker)
+            if state is None:
+                return False
+            state.busy -= 1
+            state.last_used = time.monotonic()
+            if not state.busy:
+                # Callers waiting for a slot may stop it now.
+                self.condition.notify_all()
+            if served and state.running:
+                state.calls += 1
+            if not state.running:
+                if not state.busy:
+                    del self.workers[worker]
+                return False
+            if self.max_calls is not None and state.calls >= self.max_calls:
+                return True
+        process = worker.process
+        if self.max_rss is not None and process is not None:
+            rss = process_rss(process.pid)
+            return rss is not None and rss > self.max_rss
+        return False
+
+    def recycled(self) -> None:
+        """
+        Count a worker process stopped by its worker after done() asked for it.
+        """
+        with self.condition:
+            self.counters["recycled"] += 1
+
+    def _reap_idle(self) -> None:
+        """
+        Stop the worker processes idle for longer than idle_timeout until the manager is closed.
+        """
+        interval = min(self.idle_timeout, 1.0)
+        while not self.closed.wait(interval):
+            with self.condition:
+                expired = time.monotonic() - self.idle_timeout
+                for worker, state in list(self.workers.items()):
+                    if state.running and not state.busy and state.last_used < expired and worker not in self.evicting:
+                        self.evict(worker, "expired")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Current utilization of the process budget.
+
+        Returns:
+            Dict[str, Any]: The budget ("max_processes"), the pod processes "running" and how
+            many of them are "busy" or "idle", the callers "waiting" for a slot, lifetime
+            counters ("started", "queued", "evicted", "recycled", "expired") and, per pod,
+            its "running", "busy" and "quota" processes and their "rss" in bytes when known.
+        """
+        with self.condition:
+            pods: Dict[str, Dict[str, Any]] = {}
+            for pod_name in set(self.running) | {state.pod_name for state in self.workers.values()}:
+                pods[pod_name] = {
+                    "running": self.running.get(pod_name, 0),
+                    "busy": 0,
+                    "idle": 0,
+                    "quota": self.quota(pod_name),
+                    "rss": 0,
+                }
+            idle = 0
+            for worker, state in self.workers.items():
+                if not state.running:
+                    continue
+                process = worker.process
+                rss = process_rss(process.pid) if process is not None else None
+                pods[state.pod_name]["rss"] += rss or 0
+                if not state.busy:
+                    idle += 1
+                    pods[state.pod_name]["idle"] += 1
+            # Spawned processes only exist while their call runs, so they are all busy.
+            for pod in pods.values():
+                pod["busy"] = pod["running"] - pod.pop("idle")
+            running = sum(self.running.values())
+            return {
+                "max_processes": self.max_processes,
+                "running": running,
+                "busy": running - idle,
+                "idle": idle,
+                "waiting": self.waiting,
+                **self.counters,
+                "pods": pods,
+            }
+
+    def close(self) -> None:
+        """
+        Unload every loader of the manager, stopping their pod processes.
+        """
+        self.closed.set()
+        with self.condition:
+            loaders, self.loaders = self.loaders, []
+        for loader in loaders:
+            loader.unload_pod()
+
+    def __enter__(self) -> "PodManager":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class PodBudget:
+    """
+    The process budget of a PodManager as seen by the loader and workers of one pod.
+    """
+
+    def __init__(self, manager: PodManager, pod_name: str) -> None:
+        self.manager = manager
+        self.pod_name = pod_name
+
+    def acquire(self, worker: Optional["PodWorker"] = None, deadline: Optional[Deadline] = None) -> None:
+        """
+        Take a slot for a new process of the pod, see PodManager.acquire().
+        """
+        self.manager.acquire(self.pod_name, worker, deadline)
+
+    def release(self, worker: Optional["PodWorker"] = None) -> None:
+        """
+        Give back the slot of a process of the pod, see PodManager.release().
+        """
+        self.manager.release(self.pod_name, worker)
+
+    def busy(self, worker: "PodWorker") -> None:
+        """
+        Mark a worker of the pod as serving a request, see PodManager.busy().
+        """
+        self.manager.busy(self.pod_name, worker)
+
+    def done(self, worker: "PodWorker", served: bool = True) -> bool:
+        """
+        Mark the end of a request of a worker of the pod, see PodManager.done().
+        """
+        return self.manager.done(worker, served)
+
+    def recycled(self) -> None:
+        """
+        Count a recycled worker process, see PodManager.recycled().
+        """
+        self.manager.recycled()
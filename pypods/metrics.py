@@ -0,0 +1,278 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds of the duration histograms, from a fast worker call to a cold spawn.
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class CallTrace:
+    """
+    Timeline of a single pod call.
+
+    The client fills in its own phases and the pod reports its side in the reply envelope:
+        spawn: starting the pod interpreter and importing the pod (spawn mode only).
+        encode / decode: serializing the request and deserializing the reply on the client.
+        pod_decode: deserializing the request in the pod.
+        execute: running the pod function.
+        transport: everything else between sending the request and reading the reply,
+            i.e. pipe transfers and serializing the reply in the pod.
+    """
+
+    def __init__(self, pod: str, function: str, mode: str) -> None:
+        """
+        Start the trace of a call.
+
+        Args:
+            pod (str): The name of the pod.
+            function (str): The name of the pod function, "<batch>" for a batch.
+            mode (str): The PodLoader mode.
+        """
+        self.pod = pod
+        self.function = function
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.phases: Dict[str, float] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.error: Optional[str] = None
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        """
+        Add time to a phase of the call.
+
+        Args:
+            phase (str): The name of the phase.
+            seconds (float): The time spent.
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_pod_timings(self, timings: Dict[str, float], roundtrip: float) -> None:
+        """
+        Merge the timings reported by the pod and attribute the rest of the round-trip to transport.
+
+        Args:
+            timings (Dict[str, float]): The "trace" of the pod's reply.
+            roundtrip (float): Seconds between sending the request and reading the reply.
+        """
+        pod_time = 0.0
+        for phase in ("pod_decode", "execute"):
+            if phase in timings:
+                self.add_phase(phase, timings[phase])
+                pod_time += timings[phase]
+        self.add_phase("transport", max(0.0, roundtrip - pod_time - self.phases.get("spawn", 0.0)))
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """
+        Stop the trace of the call.
+
+        Args:
+            error (Optional[str]): The error of the call, if it failed.
+        """
+        self.duration = time.perf_counter() - self.start
+        self.error = error
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed buckets, as exported to Prometheus.
+    """
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Record one observation.
+        """
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class PodMetrics:
+    """
+    Counters and histograms of pod calls, labelled by pod and function.
+
+    Every PodLoader records into the module-level METRICS registry by default. Hooks are
+    called with the CallTrace of every finished call, e.g. to forward it to OpenTelemetry,
+    and to_prometheus() renders everything in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Initialize an empty registry.
+
+        Args:
+            buckets (Sequence[float]): Upper bounds in seconds of the duration histograms.
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.hooks: List[Callable[[CallTrace], None]] = []
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Drop every recorded value. Hooks are kept.
+        """
+        with self.lock:
+            self.counters: Dict[str, Dict[Tuple[str, ...], float]] = {
+                "calls": {}, "errors": {}, "request_bytes": {}, "response_bytes": {}, "spawns": {},
+                "coalesced": {},
+            }
+            self.durations: Dict[Tuple[str, str], Histogram] = {}
+            self.phases: Dict[Tuple[str, str, str], Histogram] = {}
+
+    def add_hook(self, hook: Callable[[CallTrace], None]) -> None:
+        """
+        Call hook with the CallTrace of every finished call. Hooks run on the calling thread,
+        exceptions they raise are ignored.
+
+        Args:
+            hook (Callable[[CallTrace], None]): The callback.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[CallTrace], None]) -> None:
+        """
+        Stop calling a hook added with add_hook().
+
+        Args:
+            hook (Callable[[CallTrace], None]): The callback.
+        """
+        self.hooks.remove(hook)
+
+    def increment(self, counter: str, labels: Tuple[str, ...], value: float = 1) -> None:
+        """
+        Add to a counter, the lock must be held.
+        """
+        self.counters[counter][labels] = self.counters[counter].get(labels, 0) + value
+
+    def record_spawn(self, pod: str) -> None:
+        """
+        Count a pod process start.
+
+        Args:
+            pod (str): The name of the pod.
+        """
+        with self.lock:
+            self.increment("spawns", (pod,))
+
+    def record_coalesced(self, pod: str, function: str) -> None:
+        """
+        Count a call that shared the execution of an identical call in flight.
+
+        Args:
+            pod (str): The name of the pod.
+            function (str): The name of the pod function.
+        """
+        with self.lock:
+            self.increment("coalesced", (pod, function))
+
+    def record(self, trace: CallTrace) -> None:
+        """
+        Record a finished call and pass it to the hooks.
+
+        Args:
+            trace (CallTrace): The trace of the call.
+        """
+        labels = (trace.pod, trace.function)
+        with self.lock:
+            self.increment("calls", labels)
+            if trace.error is not None:
+                self.increment("errors", labels)
+            self.increment("request_bytes", labels, trace.request_bytes)
+            self.increment("response_bytes", labels, trace.response_bytes)
+            if labels not in self.durations:
+                self.durations[labels] = Histogram(self.buckets)
+            self.durations[labels].observe(trace.duration)
+            for phase, seconds in trace.phases.items():
+                key = labels + (phase,)
+                if key not in self.phases:
+                    self.phases[key] = Histogram(self.buckets)
+                self.phases[key].observe(seconds)
+        for hook in list(self.hooks):
+            try:
+                hook(trace)
+            except Exception:
+                pass
+
+    def to_prometheus(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, ready to be served on a /metrics endpoint.
+        """
+        lines = []
+        counters = (
+            ("calls", "pypods_calls_total", "Pod function calls.", ("pod", "function")),
+            ("errors", "pypods_call_errors_total", "Pod function calls that failed.", ("pod", "function")),
+            ("request_bytes", "pypods_request_bytes_total", "Serialized request bytes sent to pods.", ("pod", "function")),
+            ("response_bytes", "pypods_response_bytes_total", "Serialized reply bytes received from pods.", ("pod", "function")),
+            ("spawns", "pypods_process_spawns_total", "Pod processes started.", ("pod",)),
+            ("coalesced", "pypods_coalesced_calls_total", "Calls that shared an identical call in flight.", ("pod", "function")),
+        )
+        with self.lock:
+            for counter, name, help_text, label_names in counters:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for labels, value in sorted(self.counters[counter].items()):
+                    lines.append(f"{name}{format_labels(label_names, labels)} {value:g}")
+            lines += self.histogram_lines(
+                "pypods_call_duration_seconds", "Duration of pod function calls.",
+                ("pod", "function"), self.durations,
+            )
+            lines += self.histogram_lines(
+                "pypods_call_phase_seconds", "Time spent in each phase of pod function calls.",
+                ("pod", "function", "phase"), self.phases,
+            )
+        return "\n".join(lines) + "\n"
+
+    def histogram_lines(
+        self, name: str, help_text: str, label_names: Tuple[str, ...], histograms: Dict[Tuple[str, ...], Histogram]
+    ) -> List[str]:
+        """
+        Render a family of histograms in the Prometheus text exposition format.
+        """
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, histogram in sorted(histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                le = format_labels(label_names + ("le",), labels + (f"{bound:g}",))
+                lines.append(f"{name}_bucket{le} {count}")
+            le = format_labels(label_names + ("le",), labels + ("+Inf",))
+            lines.append(f"{name}_bucket{le} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(label_names, labels)} {histogram.sum:g}")
+            lines.append(f"{name}_count{format_labels(label_names, labels)} {histogram.count}")
+        return lines
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """
+    Format Prometheus labels, escaping their values.
+
+    Args:
+        names (Sequence[str]): The label names.
+        values (Sequence[str]): The label values.
+
+    Returns:
+        str: The labels, e.g. {pod="nlp",function="tokenize"}.
+    """
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+# The registry PodLoaders record into unless they are given another one.
+METRICS = PodMetrics()
@@ -3,13 +3,25 @@ PyPods
 Rohan Deshpande
 """
 
-import inspect
+import ast
+import hashlib
 import importlib
+import json
+import os
+import warnings
+from os.path import exists, join
+from typing import Any, Dict, List, Optional, Tuple
 
-from pypods.errors import PyPodNotFound
+from pypods.errors import PyPodNamespaceWarning, PyPodNotFound
 
 PODS_DIRECTORY = "pods"
 PODS_CONFIG = "pod"
+# Files pypods generates for a pod live in this directory inside the pod.
+PODS_STATE = ".pypods"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 2
+# Key of the JSON object a default that JSON cannot represent is stored under in a manifest.
+DEFAULT_KEY = "__pypods_default__"
 
 def get_module_namespace(module_name):
     """
@@ -34,6 +46,11 @@ def get_pod_namespace(pod_name):
     """
     Get the functions within the pod's namespace.
 
+    The pod is never imported in the client. Its pod.py file, and the pod's own
+    submodules it imports functions from, are parsed statically and the result is
+    cached in a manifest file. The manifest is reused as long as the hashes of the
+    parsed files match, so later calls are a single file read.
+
     Args:
         pod_name (str): The name of the pod.
 
@@ -41,20 +58,290 @@ def get_pod_namespace(pod_name):
         dict: The namespace containing the function name as the key
         and function signature's parameters as the value.
     """
+    manifest_path = join(PODS_DIRECTORY, pod_name, PODS_STATE, MANIFEST_FILE)
+    manifest = read_manifest(manifest_path)
+    if manifest is not None:
+        return {name: (ar, kw) for name, (ar, kw) in manifest["functions"].items()}
+
+    ns, sources, missing = parse_pod_namespace(pod_name)
+    write_manifest(manifest_path, ns, sources, missing)
+    return ns
+
+
+class NonLiteralDefault:
+    """
+    The default of a pod function parameter that is not a literal, e.g. a module constant.
+    It cannot be evaluated without importing the pod, so only its source is known. The pod
+    applies the actual default when the argument is omitted.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, NonLiteralDefault) and other.source == self.source
+
+    def __hash__(self) -> int:
+        return hash(self.source)
+
+    def __repr__(self) -> str:
+        return f"<default {self.source}>"
+
+
+def encode_default(value: Any) -> Dict[str, str]:
+    """
+    Store a default that JSON cannot represent, e.g. bytes or a NonLiteralDefault, as its source.
+
+    Args:
+        value (Any): The default.
+
+    Returns:
+        Dict[str, str]: The JSON object holding the source of the default.
+    """
+    return {DEFAULT_KEY: value.source if isinstance(value, NonLiteralDefault) else repr(value)}
+
+
+def decode_default(obj: Dict[str, Any]) -> Any:
+    """
+    Rebuild a default stored by encode_default, used as the object hook of the manifest.
+
+    Args:
+        obj (Dict[str, Any]): A JSON object of the manifest.
+
+    Returns:
+        Any: The default, or obj as is if it is not a stored default.
+    """
+    if list(obj) != [DEFAULT_KEY]:
+        return obj
+    try:
+        return ast.literal_eval(obj[DEFAULT_KEY])
+    except (ValueError, TypeError, SyntaxError):
+        return NonLiteralDefault(obj[DEFAULT_KEY])
+
+
+def file_hash(path: str) -> str:
+    """
+    Hash the content of a file.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: The sha256 hex digest of the file.
+    """
+    with open(path, mode="rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_manifest(manifest_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a pod manifest if it is still valid for the pod's source files.
+
+    Args:
+        manifest_path (str): Path of the manifest file.
+
+    Returns:
+        Optional[Dict[str, Any]]: The manifest, or None if it is missing or stale.
+    """
+    try:
+        with open(manifest_path, mode="r") as m:
+            manifest = json.load(m, object_hook=decode_default)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        for path, digest in manifest["sources"].items():
+            if file_hash(path) != digest:
+                return None
+        # A module the pod imported from that did not exist, e.g. a submodule added since.
+        for path in manifest["missing"]:
+            if exists(path):
+                return None
+        return manifest
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+
+def write_manifest(
+    manifest_path: str,
+    ns: Dict[str, Tuple[List[str], Dict[str, Any]]],
+    sources: List[str],
+    missing: List[str] = (),
+) -> None:
+    """
+    Write a pod manifest. Failing to write it only costs a re-parse on the next load.
+
+    Args:
+        manifest_path (str): Path of the manifest file.
+        ns (Dict[str, Tuple[List[str], Dict[str, Any]]]): The pod's namespace.
+        sources (List[str]): The files the namespace was parsed from.
+        missing (List[str]): Files the pod imports from that do not exist, the manifest is
+            stale once one of them is created.
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "sources": {path: file_hash(path) for path in sources},
+        "missing": sorted(set(missing)),
+        "functions": ns,
+    }
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, mode="w") as m:
+            json.dump(manifest, m, default=encode_default)
+        os.replace(tmp_path, manifest_path)
+    except OSError:
+        pass
+
+
+def parse_pod_namespace(
+    pod_name: str,
+) -> Tuple[Dict[str, Tuple[List[str], Dict[str, Any]]], List[str], List[str]]:
+    """
+    Statically parse the functions of a pod without importing it.
+
+    Functions the pod imports from its own submodules are followed. Names imported from
+    other modules, e.g. "from requests import get", are not exposed, since telling functions
+    from other objects would mean importing those modules. Wrap them in a def to expose them.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        Tuple: The pod's namespace, the list of parsed files and the list of files the pod
+        imports from that do not exist.
+    """
     module_name = f"{PODS_DIRECTORY}.{pod_name}.{PODS_CONFIG}"
-    module_ns = get_module_namespace(module_name)
-
-    ns = {}
-    for name, value in module_ns.items():
-        if inspect.isfunction(value):
-            function_parm = inspect.signature(value).parameters
-            ar, kw = [], {}
-            for _param in function_parm:
-                _param_name = function_parm[_param].name
-                if function_parm[_param].default == function_parm[_param].empty:
-                    ar.append(_param_name)
-                else:
-                    kw[_param_name] = function_parm[_param].default
-
-            ns[name] = (ar, kw)
+    if module_file(module_name) is None:
+        raise PyPodNotFound(f"Module '{module_name}' not found.")
+    parsed: Dict[str, Dict[str, Tuple[List[str], Dict[str, Any]]]] = {}
+    missing: List[str] = []
+    ns = parse_module_functions(module_name, f"{PODS_DIRECTORY}.{pod_name}", parsed, missing)
+    return ns, list(parsed), missing
+
+
+def module_paths(module_name: str) -> List[str]:
+    """
+    The paths the source file of a module can have relative to the project root.
+
+    Args:
+        module_name (str): The dotted module name.
+
+    Returns:
+        List[str]: The paths of the module as a file and as a package.
+    """
+    base = join(*module_name.split("."))
+    return [f"{base}.py", join(base, "__init__.py")]
+
+
+def module_file(module_name: str) -> Optional[str]:
+    """
+    Locate the source file of a module relative to the project root.
+
+    Args:
+        module_name (str): The dotted module name.
+
+    Returns:
+        Optional[str]: The path of the module's source file, or None if it does not exist.
+    """
+    for path in module_paths(module_name):
+        if exists(path):
+            return path
+    return None
+
+
+def function_signature(node: ast.AST) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Read the parameters of a function definition the same way inspect.signature does:
+    parameters without a default are positional, the others are keyword parameters.
+    Defaults that are not literals are recorded as a NonLiteralDefault, with a warning.
+
+    Args:
+        node (ast.AST): The function definition.
+
+    Returns:
+        Tuple[List[str], Dict[str, Any]]: The positional names and the keyword defaults.
+    """
+    def literal(name, default):
+        try:
+            return ast.literal_eval(default)
+        except (ValueError, TypeError, SyntaxError):
+            # ast.unparse is only available from Python 3.9.
+            source = ast.unparse(default) if hasattr(ast, "unparse") else ast.dump(default)
+            warnings.warn(
+                f"Default {source} of parameter {name} of pod function {node.name} is not a literal, "
+                "the client only knows its source",
+                PyPodNamespaceWarning,
+                stacklevel=2,
+            )
+            return NonLiteralDefault(source)
+
+    arguments = node.args
+    positional = getattr(arguments, "posonlyargs", []) + arguments.args
+    first_default = len(positional) - len(arguments.defaults)
+    ar, kw = [], {}
+    for i, arg in enumerate(positional):
+        if i < first_default:
+            ar.append(arg.arg)
+        else:
+            kw[arg.arg] = literal(arg.arg, arguments.defaults[i - first_default])
+    if arguments.vararg is not None:
+        ar.append(arguments.vararg.arg)
+    for arg, default in zip(arguments.kwonlyargs, arguments.kw_defaults):
+        if default is None:
+            ar.append(arg.arg)
+        else:
+            kw[arg.arg] = literal(arg.arg, default)
+    if arguments.kwarg is not None:
+        ar.append(arguments.kwarg.arg)
+    return ar, kw
+
+
+def parse_module_functions(
+    module_name: str,
+    pod_package: str,
+    parsed: Dict[str, Dict[str, Tuple[List[str], Dict[str, Any]]]],
+    missing: Optional[List[str]] = None,
+) -> Dict[str, Tuple[List[str], Dict[str, Any]]]:
+    """
+    Collect the functions defined in a module's global scope, following
+    "from ... import" statements that target the pod's own submodules.
+
+    Args:
+        module_name (str): The dotted module name.
+        pod_package (str): The pod's package, e.g. pods.hello_world_pod.
+        parsed (Dict): The functions of every file parsed so far, keyed by path.
+        missing (Optional[List[str]]): Receives the paths of the modules that do not exist.
+
+    Returns:
+        Dict[str, Tuple[List[str], Dict[str, Any]]]: The functions of the module.
+    """
+    path = module_file(module_name)
+    if path is None:
+        if missing is not None:
+            missing.extend(module_paths(module_name))
+        return {}
+    if path in parsed:
+        return parsed[path]
+    ns = parsed[path] = {}
+    with open(path, mode="rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+    is_package = path.endswith("__init__.py")
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            ns[node.name] = function_signature(node)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                package = module_name if is_package else module_name.rpartition(".")[0]
+                package = package.rsplit(".", node.level - 1)[0] if node.level > 1 else package
+                source = f"{package}.{node.module}" if node.module else package
+            else:
+                source = node.module
+            if source != pod_package and not source.startswith(f"{pod_package}."):
+                continue
+            source_ns = parse_module_functions(source, pod_package, parsed, missing)
+            for alias in node.names:
+                if alias.name == "*":
+                    ns.update({k: v for k, v in source_ns.items() if not k.startswith("_")})
+                elif alias.name in source_ns:
+                    ns[alias.asname or alias.name] = source_ns[alias.name]
     return ns
@@ -0,0 +1,297 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import argparse
+import os
+import sys
+import threading
+from subprocess import PIPE, Popen, TimeoutExpired
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from bson import dumps, loads
+
+from pypods.codec import CODECS, DEFAULT_CODEC, BsonCodec, Codec, get_codec, negotiate_codec
+from pypods.deadline import CURRENT_DEADLINE, Deadline
+from pypods.errors import PyPodNotStartedError, PyPodResponseError, PyPodWorkerError
+from pypods.pods import PodLoader
+from pypods.protocol import read_frame, write_frame
+
+PIPELINE_MODULE = "pypods.pipeline"
+PIPELINE_STOP_TIMEOUT = 5
+
+
+class PodPipeline:
+    """
+    A chain of pod functions whose stage processes pass items straight to each other.
+
+    Every stage runs one pod function in a long-lived process of its pod's interpreter.
+    The stdout of a stage is the stdin of the next one, so intermediate results go from
+    pod to pod through an OS pipe without being deserialized by the client, and all
+    stages work at the same time on successive items.
+    """
+
+    def __init__(self, stages: Sequence[str], codec: str = DEFAULT_CODEC) -> None:
+        """
+        Initialize the pipeline from its stages.
+
+        Args:
+            stages (Sequence[str]): The "pod_name.function" of every stage in order, e.g.
+                ["parser_pod.parse", "model_pod.embed", "index_pod.insert"].
+            codec (str): Wire codec of the pipeline, see pypods.codec. It must be available
+                in the interpreter of every stage.
+        """
+        if not stages:
+            raise ValueError("stages should name at least one pod function")
+        self.stages: List[Tuple[str, str]] = []
+        for stage in stages:
+            pod_name, _, function = stage.rpartition(".")
+            if not pod_name or not function:
+                raise ValueError(f"stage: {stage} should be of the form pod_name.function")
+            self.stages.append((pod_name, function))
+        if codec not in CODECS:
+            raise ValueError(f"codec: {codec} should be one of {tuple(CODECS)}")
+        self.codec_name = codec
+        self.codec: Codec = BsonCodec()
+        self.processes: List[Popen] = []
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "PodPipeline":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def is_alive(self) -> bool:
+        """
+        Check if every stage process is running.
+
+        Returns:
+            bool: True if every stage process is running.
+        """
+        return bool(self.processes) and all(p.poll() is None for p in self.processes)
+
+    def start(self) -> None:
+        """
+        Provision the pods, start the stage processes and wait until every stage is ready.
+        """
+        with self.lock:
+            self._start()
+
+    def _start(self) -> None:
+        """
+        Start the stage processes, the caller must hold the pipeline's lock.
+        """
+        if self.is_alive():
+            return
+        self._stop()
+        self.codec = get_codec(self.codec_name)
+        commands = []
+        for pod_name, function in self.stages:
+            loader = PodLoader(pod_name, {})
+            loader.create_pod()
+            if not os.path.exists(loader.pod_interpreter):
+                raise PyPodNotStartedError("Pod interpreter is missing!")
+            commands.append(pipeline_command(loader.pod_interpreter, loader.pod_module, function, self.codec_name))
+        upstream: Any = PIPE
+        for command in commands:
+            # The pod's stderr is inherited so that pod logs reach the client's terminal.
+            process = Popen(command, stdin=upstream, stdout=PIPE)
+            if upstream is not PIPE:
+                # The stage process holds the read end of the pipe now.
+                upstream.close()
+            upstream = process.stdout
+            self.processes.append(process)
+        # The probe goes through every stage once its pod module is imported. A stage that
+        # fails to start sends its error down the pipeline instead.
+        try:
+            write_frame(self.processes[0].stdin, dumps({"ready": True}))
+        except OSError:
+            pass
+        ready = read_frame(self.processes[-1].stdout)
+        if ready is None:
+            self._stop()
+            raise PyPodWorkerError("A pipeline stage exited during startup")
+        ready = loads(ready)
+        if "error" in ready:
+            self._stop()
+            raise PyPodWorkerError(ready["error"])
+
+    def stop(self) -> None:
+        """
+        Stop the stage processes by closing the stdin of the first one, killing them if
+        they do not comply.
+        """
+        with self.lock:
+            self._stop()
+
+    def _stop(self, kill: bool = False) -> None:
+        """
+        Stop the stage processes, the caller must hold the pipeline's lock.
+
+        Args:
+            kill (bool): Kill the processes right away, e.g. in the middle of a run.
+        """
+        if not self.processes:
+            return
+        if kill:
+            self._interrupt()
+        try:
+            self.processes[0].stdin.close()
+        except OSError:
+            pass
+        for process in self.processes:
+            try:
+                process.wait(timeout=PIPELINE_STOP_TIMEOUT)
+            except TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes[-1].stdout.close()
+        self.processes = []
+
+    def _interrupt(self) -> None:
+        """
+        Kill every stage process from another thread, aborting the run in flight.
+        """
+        for process in list(self.processes):
+            process.kill()
+
+    def imap(self, items: Iterable[Any]) -> Iterator[Any]:
+        """
+        Send items through the pipeline and yield the results of the last stage in order.
+
+        Items are fed to the first stage from a background thread while results are read,
+        so every stage is busy with a different item. A stage whose pod function is a
+        generator sends every item it yields to the next stage. If a stage fails on an item,
+        or the run is abandoned or passes its deadline, the stage processes are killed and
+        the next run restarts them.
+
+        Args:
+            items (Iterable[Any]): The inputs of the first stage.
+
+        Returns:
+            Iterator[Any]: The outputs of the last stage.
+        """
+        deadline = CURRENT_DEADLINE.get() or Deadline()
+        with self.lock:
+            self._start()
+            errors: List[Exception] = []
+            feeder = threading.Thread(
+                target=self._feed, args=(items, self.processes[0].stdin, self.codec, errors), daemon=True
+            )
+            finished = False
+            try:
+                with deadline.watch(self._interrupt):
+                    feeder.start()
+                    while True:
+                        try:
+                            data = read_frame(self.processes[-1].stdout)
+                        except EOFError:
+                            data = None
+                        if data is None:
+                            deadline.check()
+                            raise PyPodWorkerError("A pipeline stage exited while processing items")
+                        reply = self.codec.loads(data)
+                        if "end" in reply:
+                            break
+                        if "error" in reply:
+                            raise PyPodResponseError(reply["error"])
+                        yield reply["item"]
+                finished = True
+            finally:
+                if not finished:
+                    self._stop(kill=True)
+                if feeder.is_alive():
+                    feeder.join()
+        if errors:
+            raise errors[0]
+
+    def map(self, items: Iterable[Any]) -> List[Any]:
+        """
+        Send items through the pipeline and wait for all the results of the last stage.
+
+        Args:
+            items (Iterable[Any]): The inputs of the first stage.
+
+        Returns:
+            List[Any]: The outputs of the last stage, in order.
+        """
+        return list(self.imap(items))
+
+    def _feed(self, items: Iterable[Any], stdin: BinaryIO, codec: Codec, errors: List[Exception]) -> None:
+        """
+        Write the items of a run to the first stage, followed by the end of the run.
+        """
+        try:
+            try:
+                for item in items:
+                    write_frame(stdin, codec.dump_buffers({"item": item}))
+            except OSError:
+                raise
+            except Exception as e:
+                # Raised by the run once the items already sent are through the pipeline.
+                errors.append(e)
+            write_frame(stdin, codec.dump_buffers({"end": True}))
+        except OSError:
+            # The pipeline was stopped, the reading side reports why.
+            pass
+
+
+def pipeline_command(interpreter: str, module: str, function: str, codec: str) -> List[str]:
+    """
+    Build the command line that starts a pipeline stage process.
+
+    Args:
+        interpreter (str): Path to the pod's python interpreter.
+        module (str): Dotted name of the pod module.
+        function (str): Name of the pod function of the stage.
+        codec (str): Wire codec of the pipeline.
+
+    Returns:
+        List[str]: The command line.
+    """
+    return [interpreter, "-m", PIPELINE_MODULE, module, function, "--codec", codec]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Entry point of a pipeline stage process that runs inside the pod's interpreter.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments, defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(prog=f"python -m {PIPELINE_MODULE}")
+    parser.add_argument("module", help="Dotted name of the pod module")
+    parser.add_argument("function", help="Name of the pod function of the stage")
+    parser.add_argument("--codec", default=DEFAULT_CODEC, help="Wire codec of the pipeline")
+    args = parser.parse_args(argv)
+
+    # Items are written to the original stdout, which is the next stage's stdin. Anything
+    # the pod prints is sent to stderr instead so that it cannot corrupt the stream.
+    channel_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    from pypods.ns import get_module_namespace
+    from pypods.pods import PodListener
+
+    try:
+        try:
+            codec = negotiate_codec([args.codec])
+            namespace = get_module_namespace(args.module)
+            if not callable(namespace.get(args.function)):
+                raise PyPodWorkerError(f"Function {args.function} does not exist in pod {args.module}")
+        except Exception as e:
+            write_frame(channel_out, dumps({"error": f"Pipeline stage {args.function}: {e}"}))
+            sys.exit(1)
+        PodListener().serve_stage(namespace[args.function], sys.stdin.buffer, channel_out, codec)
+    except BrokenPipeError:
+        # The next stage exited, the client reports why.
+        sys.stderr.flush()
+        os._exit(1)
+
+
+if __name__ == "__main__":
+    main()
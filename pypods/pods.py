@@ -5,18 +5,97 @@ Rohan Deshpande
 
 import sys
 import os
+import asyncio
+import inspect
 import shutil
-import venv
+import threading
+import time
+import collections.abc
+from concurrent.futures import Future
+from functools import partial, wraps
 from os.path import exists, join
-from subprocess import PIPE, Popen, run
-from typing import Any, Dict, Optional
+from subprocess import PIPE, Popen
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 from pypods.ns import *
-from pypods.errors import PyPodNotStartedError, PyPodResponseError
+from pypods.cache import MISSING, ResultCache, canonical_key
+from pypods.codec import CODECS, DEFAULT_CODEC, Buffer, BsonCodec, Codec, codec_available
+from pypods.daemon import Address, DaemonClient, ensure_daemon
+from pypods.deadline import CURRENT_DEADLINE, Deadline
+from pypods.flight import SingleFlight
+from pypods.handles import METHOD, OBJECTS, PodHandle, PodObject, ReleaseQueue
+from pypods.errors import (
+    PyPodCancelledError,
+    PyPodError,
+    PyPodNotStartedError,
+    PyPodResponseError,
+    PyPodTimeoutError,
+)
+from pypods.manager import PodBudget, PodManager
+from pypods.metrics import METRICS, CallTrace, PodMetrics
+from pypods.profiling import CURRENT_PROFILE, DEFAULT_INTERVAL, DEFAULT_PROFILER, CallProfiler, PodProfile
+from pypods.protocol import read_frame, write_frame
+from pypods.provision import VENV_BIN, is_provisioned, sync_pod
+from pypods.runtime import PodRuntime, is_async, is_threadsafe
+from pypods.shm import SharedMemorySession, attach_value, export_value, release_mappings
+from pypods.worker import MultiplexedPodWorker, PodWorker
 
 from bson import dumps, loads
 
-VENV_BIN = "Scripts" if os.name == 'nt' else "bin"
+# spawn: start a new pod interpreter for every call.
+# worker: keep one pod interpreter running between load_pod() and unload_pod().
+# zygote: keep one pod interpreter running and fork a fresh child of it for every call.
+# daemon: connect to a pod daemon shared by every client process, see pypods.daemon.
+POD_MODES = ("spawn", "worker", "zygote", "daemon")
+# Modes served by a long-lived pod process over the framed protocol.
+WORKER_MODES = ("worker", "zygote", "daemon")
+# Modes whose pod workers are started by the client itself, so they can be pooled.
+POOL_MODES = ("worker", "zygote")
+
+def iter_stream(replies: Iterator[Dict[str, Any]]) -> Iterator[Any]:
+    """
+    Unwrap the chunk replies streamed back by a generator pod function.
+
+    Args:
+        replies (Iterator[Dict[str, Any]]): The remaining replies of the stream.
+
+    Returns:
+        Iterator[Any]: The items yielded by the pod function.
+    """
+    try:
+        for msg in replies:
+            if "error" in msg:
+                raise PyPodResponseError(f"PyPodResponseError: {msg['error']}")
+            if "chunk" in msg:
+                yield msg["chunk"]
+    finally:
+        replies.close()
+
+
+def finish_stream(stream: Iterator[Any], finish: Callable[[Optional[str]], None]) -> Iterator[Any]:
+    """
+    Yield the items of a stream, then finish its call.
+
+    Args:
+        stream (Iterator[Any]): The stream returned by iter_stream.
+        finish (Callable[[Optional[str]], None]): Called with the error of the stream, if
+            any, once it is exhausted, fails or is closed, e.g. to finish the trace of its call.
+
+    Returns:
+        Iterator[Any]: The items of the stream.
+    """
+    error = None
+    try:
+        yield from stream
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        try:
+            stream.close()
+        finally:
+            finish(error)
+
 
 class Object(object):
     """
@@ -32,6 +111,24 @@ class Object(object):
         Scoping will avoid polluting the client's namespace with similar function names but from different pods.
     """
     pass
+
+
+class LazyPod(Object):
+    """
+    Stands in for a pod loaded with load_pod(lazy=True). The first access to one of its
+    functions provisions the pod, discovers its functions and starts its workers. The
+    functions are then bound on this very object, so later accesses are plain attribute lookups.
+    """
+
+    def __init__(self, loader: "PodLoader") -> None:
+        self._pod_loader = loader
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for missing attributes, i.e. before the pod is loaded.
+        if name.startswith("__") or name == "_pod_loader":
+            raise AttributeError(name)
+        self._pod_loader.ensure_loaded()
+        return object.__getattribute__(self, name)
 class PodLoader:
     """
     This class is for managing the lifecycle and interactions of a client with a specific pod.
@@ -39,7 +136,19 @@ class PodLoader:
     and handles responses and errors.
     """
 
-    def __init__(self, pod_name: str, namespace: dict) -> None:
+    def __init__(
+        self,
+        pod_name: str,
+        namespace: dict,
+        mode: str = "spawn",
+        shm_threshold: Optional[int] = None,
+        codec: Union[str, Sequence[str]] = DEFAULT_CODEC,
+        metrics: Optional[PodMetrics] = METRICS,
+        timeout: Optional[float] = None,
+        address: Optional[Address] = None,
+        concurrency: int = 1,
+        manager: Optional[PodManager] = None,
+    ) -> None:
         """
         Initialize the PodLoader with the pod name and namespace.
         If the pod name does not exist in the file system, then it
@@ -48,9 +157,95 @@ class PodLoader:
         Args:
             pod_name (str): The name of the pod associated with this loader.
             namespace (dict): The namespace dictionary where pod functions are loaded.
+            mode (str): How pod functions are executed. "spawn" starts a pod interpreter
+                per call, "worker" keeps a long-lived pod interpreter between load_pod()
+                and unload_pod(), "zygote" keeps a long-lived pod interpreter that forks a
+                fresh child for every call so no state leaks between calls (POSIX only), "daemon"
+                connects to a pod daemon shared by every client process of the project.
+            shm_threshold (Optional[int]): Arguments and results of at least this many bytes
+                (bytes, bytearray, memoryview or NumPy arrays) are passed through shared memory
+                instead of the pipe. Disabled by default, requires worker or zygote mode.
+            codec (Union[str, Sequence[str]]): Wire codec name, or names in order of preference,
+                see pypods.codec. The pod worker picks the first one it supports. Codecs other
+                than "bson" require worker or zygote mode.
+            metrics (Optional[PodMetrics]): Registry the calls are traced into, see pypods.metrics.
+                Defaults to the global METRICS registry, None disables tracing.
+            timeout (Optional[float]): Seconds a call to the pod may take before its pod process is
+                killed and PyPodTimeoutError is raised. None (default) waits forever. Can be
+                overridden per function with set_timeout() and bounded per call with deadline().
+            address (Optional[Address]): Daemon mode only, the Unix socket path or (host, port) of a
+                running pod daemon. None finds the pod's daemon through pods/<pod_name>/.pypods
+                and starts it if it is not running.
+            concurrency (int): Worker mode only, calls the pod worker runs at once. Above 1 the
+                worker's channel is multiplexed: calls from different threads are in flight
+                together and each reply comes back as soon as it is ready, so a slow call does not
+                hold up the others. async def functions then overlap on the pod's event loop and
+                functions marked with pypods.runtime.threadsafe on concurrency threads.
+            manager (Optional[PodManager]): The PodManager owning the loader, which bounds the pod
+                processes it runs, see pypods.manager. Not available in daemon mode.
         """
+        if mode not in POD_MODES:
+            raise ValueError(f"mode: {mode} should be one of {POD_MODES}")
+        if shm_threshold is not None:
+            if mode not in WORKER_MODES:
+                raise ValueError(f"shm_threshold requires mode to be one of {WORKER_MODES}")
+            if shm_threshold < 1:
+                raise ValueError("shm_threshold must be a positive integer")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be a positive number of seconds")
+        if address is not None and mode != "daemon":
+            raise ValueError("address requires mode to be daemon")
+        if concurrency < 1:
+            raise ValueError("concurrency must be a positive integer")
+        if concurrency > 1 and mode != "worker":
+            raise ValueError("concurrency requires mode to be worker")
+        codecs = [codec] if isinstance(codec, str) else list(codec)
+        if not codecs:
+            raise ValueError("codec should name at least one codec")
+        for name in codecs:
+            if name not in CODECS:
+                raise ValueError(f"codec: {name} should be one of {tuple(CODECS)}")
+            # The pod may pick any of them, so the client must be able to decode each one.
+            if not codec_available(name):
+                raise ValueError(f"codec: {name} is not available in this interpreter")
+        if mode not in WORKER_MODES and codecs != [DEFAULT_CODEC]:
+            raise ValueError(f"codec: {codec} requires mode to be one of {WORKER_MODES}")
         self.pod_name = pod_name
         self.namespace = namespace
+        self.mode = mode
+        self.shm_threshold = shm_threshold
+        self.codecs = codecs
+        self.metrics = metrics
+        self.timeout = timeout
+        self.timeouts: Dict[str, Optional[float]] = {}
+        self.address = address
+        self.concurrency = concurrency
+        self.worker: Optional[Union[PodWorker, DaemonClient]] = None
+        self.caches: Dict[str, ResultCache] = {}
+        self.flights: Dict[str, SingleFlight] = {}
+        # IDs of the pod objects whose handles were closed or collected, see pypods.handles.
+        self.released = ReleaseQueue()
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self.prewarm_thread: Optional[threading.Thread] = None
+        self.manager = manager
+        self.budget: Optional[PodBudget] = manager.register(self) if manager is not None else None
+        # Profiles every call of the pod while set, see start_profiling().
+        self.profile: Optional[PodProfile] = None
+
+    @property
+    def pod_interpreter(self) -> str:
+        """
+        Path to the python interpreter inside the pod's virtual environment.
+        """
+        return join(PODS_DIRECTORY, f"{self.pod_name}", "venv", VENV_BIN, "python3")
+
+    @property
+    def pod_module(self) -> str:
+        """
+        Dotted module name of the pod's config file.
+        """
+        return f"{PODS_DIRECTORY}.{self.pod_name}.{PODS_CONFIG}"
     def create_pod(self) -> None:
         """
         Create a new pod by setting up the necessary directory structure and dependencies.
@@ -86,72 +281,653 @@ class PodLoader:
             print(f"Creating .gitignore file...")
             with open(gitignore_file, mode="w") as r:
                 r.write(
-                    "venv"
+                    f"venv\n{PODS_STATE}\n"
                 )
-        venv_dir = join(pod_path, "venv")
-        if "venv" not in pod_files:
-            print("Creating virtual environment inside pod...")
-            venv.create(venv_dir, with_pip=True)
-            print("Installing basic pod dependencies...")
-            pip_executable = join(venv_dir, VENV_BIN, "pip")
-            run(
-                [
-                    pip_executable,
-                    "install",
-                    "--disable-pip-version-check",
-                    "-qr",
-                    req_file,
-                ]
-            )
+        # The stamp records which requirements.txt the venv was built from, so an edited
+        # requirements.txt is synced on the next load. See pypods.provision for bulk provisioning.
+        if not is_provisioned(self.pod_name):
+            if "venv" not in pod_files:
+                print("Creating virtual environment inside pod...")
+            print("Syncing pod dependencies...")
+            sync_pod(self.pod_name)
 
-    def load_pod(self) -> None:
+    def load_pod(self, lazy: bool = False, prewarm: bool = False) -> None:
         """
         Load functions from the pod into the client's namespace.
+
+        Args:
+            lazy (bool): Bind a LazyPod proxy right away and defer provisioning, function
+                discovery and worker startup to the first access to one of its functions.
+            prewarm (bool): With lazy, load the pod in a background thread right away so the
+                first call does not wait for it. Errors are raised again on first use.
         """
         if not str.isidentifier(self.pod_name):
             raise ValueError(f"pod_name: {self.pod_name} should be a valid python identifier")
-        self.create_pod()
+        if self.loaded:
+            return
+        if lazy:
+            self.namespace[self.pod_name] = LazyPod(self)
+            if prewarm:
+                self.prewarm_thread = threading.Thread(
+                    target=self.prewarm, name=f"pypods-prewarm-{self.pod_name}", daemon=True
+                )
+                self.prewarm_thread.start()
+            return
         self.namespace[self.pod_name] = Object()
+        self.ensure_loaded()
 
-        pod_ns = get_pod_namespace(self.pod_name)
-        for function_name in pod_ns:
-            args, kwargs = pod_ns[function_name]
-            self.create_a_function(function_name, *args, **kwargs)
+    def ensure_loaded(self) -> None:
+        """
+        Provision the pod, bind its functions and start its workers, unless it is loaded already.
+        """
+        with self.load_lock:
+            if self.loaded:
+                return
+            self.create_pod()
+            pod_ns = get_pod_namespace(self.pod_name)
+            for function_name in pod_ns:
+                args, kwargs = pod_ns[function_name]
+                self.create_a_function(function_name, *args, **kwargs)
+
+            if self.mode in WORKER_MODES:
+                self.start_worker()
+            self.loaded = True
+
+    def prewarm(self) -> None:
+        """
+        Load a lazy pod ahead of its first use. Failures are left for the first call to raise.
+        """
+        try:
+            self.ensure_loaded()
+        except Exception:
+            pass
 
     def unload_pod(self) -> None:
         """
-        Unload pod object from the client's namespace.
+        Unload pod object from the client's namespace and stop the pod worker if any.
+        """
+        with self.load_lock:
+            self.stop_worker()
+            self.loaded = False
+            if self.pod_name in self.namespace:
+                del self.namespace[self.pod_name]
+
+    def start_worker(self) -> None:
+        """
+        Start the long-lived pod worker used in worker and zygote modes,
+        or connect to the pod daemon in daemon mode.
+        """
+        if self.mode == "daemon":
+            resolve = None
+            if self.address is None:
+                resolve = partial(
+                    ensure_daemon,
+                    self.pod_name,
+                    self.pod_interpreter,
+                    self.pod_module,
+                    on_spawn=self.record_spawn,
+                )
+            self.worker = DaemonClient(self.address, self.codecs, resolve)
+            self.worker.start()
+            return
+        if self.concurrency > 1:
+            self.worker = MultiplexedPodWorker(
+                self.pod_interpreter,
+                self.pod_module,
+                self.codecs,
+                self.concurrency,
+                on_spawn=self.record_spawn,
+                budget=self.budget,
+            )
+            self.worker.start()
+            return
+        self.worker = PodWorker(
+            self.pod_interpreter,
+            self.pod_module,
+            self.codecs,
+            fork=self.mode == "zygote",
+            on_spawn=self.record_spawn,
+            budget=self.budget,
+        )
+        self.worker.start()
+
+    def stop_worker(self) -> None:
+        """
+        Stop the long-lived pod worker if it is running. A pod daemon keeps running for
+        its other clients, see pypods.daemon.stop_daemon.
+        """
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+    def request_worker(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Send a request to the long-lived pod worker and yield its replies.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The replies.
+        """
+        if self.worker is None:
+            raise PyPodNotStartedError("Pod worker is not running, call load_pod() first!")
+        if self.released and "batch" not in message:
+            message = dict(message, release=self.released.drain())
+        yield from self.worker.request(message, trace, deadline)
+
+    def call_worker(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
         """
-        if self.pod_name in self.namespace:
-            del self.namespace[self.pod_name]
+        Send a request to the long-lived pod worker and wait for its reply.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The reply.
+        """
+        replies = self.request_worker(message, trace, deadline)
+        try:
+            return next(replies)
+        finally:
+            replies.close()
 
-    def send_data(self, data: bytes) -> None:
+    def send_data(self, data: bytes, deadline: Optional[Deadline] = None) -> None:
         """
         Send data to the pod for processing and handle the response.
+        The pod process is killed if the deadline passes or the call is cancelled.
 
         Args:
             data (bytes): The data to be sent to the pod.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
 
         Returns:
             tuple: A tuple containing the stdout and stderr from the pod.
         """
         if not isinstance(data, bytes):
             raise ValueError("data must be BSON serialized bytes")
-        pod_interpreter = join(
-            PODS_DIRECTORY, f"{self.pod_name}", "venv", VENV_BIN, "python3"
-        )
+        pod_interpreter = self.pod_interpreter
         if not exists(pod_interpreter):
             raise PyPodNotStartedError("Pod interpreter is missing!")
+        if deadline is None:
+            deadline = Deadline()
+        deadline.check()
         stdout, stderr = None, None
-        with Popen(
-            [pod_interpreter, "-m", f"{PODS_DIRECTORY}.{self.pod_name}.{PODS_CONFIG}"],
-            stdin=PIPE,
-            stdout=PIPE,
-            stderr=PIPE,
-        ) as process:
-            stdout, stderr = process.communicate(input=data)
+        if self.budget is not None:
+            self.budget.acquire(deadline=deadline)
+        try:
+            with Popen(
+                [pod_interpreter, "-m", self.pod_module],
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=PIPE,
+            ) as process:
+                with deadline.watch(process.kill):
+                    stdout, stderr = process.communicate(input=data)
+        finally:
+            if self.budget is not None:
+                self.budget.release()
+        if deadline.reason is not None:
+            deadline.check()
         return stdout, stderr
 
+    def send_request(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send a request to the pod using the loader's mode.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The pod's reply, holding either a "response" or an "error" key.
+            The response of a generator pod function is an iterator over its items.
+        """
+        if self.mode in WORKER_MODES:
+            replies = self.request_worker(message, trace, deadline)
+            reply = next(replies)
+            if "stream" in reply:
+                return {"response": iter_stream(replies)}
+            replies.close()
+            return reply
+        if trace is None:
+            stdout, stderr = self.send_data(dumps(message), deadline)
+            return loads(stderr or stdout)
+
+        start = time.perf_counter()
+        data = dumps(dict(message, trace=True))
+        trace.add_phase("encode", time.perf_counter() - start)
+        trace.request_bytes += len(data)
+        spawned, start = time.time(), time.perf_counter()
+        stdout, stderr = self.send_data(data, deadline)
+        roundtrip = time.perf_counter() - start
+        self.record_spawn()
+
+        start = time.perf_counter()
+        reply = loads(stderr or stdout)
+        trace.add_phase("decode", time.perf_counter() - start)
+        trace.response_bytes += len(stderr or stdout)
+        timings = reply.pop("trace", {})
+        if "received" in timings:
+            trace.add_phase("spawn", max(0.0, timings["received"] - spawned))
+        trace.add_pod_timings(timings, roundtrip)
+        return reply
+
+    def send_batch(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send a batch of calls to the pod in a single round-trip.
+        Batches need the framed protocol, so in spawn mode a one-off pod worker serves them.
+
+        Args:
+            message (Dict[str, Any]): The batch request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The pod's reply, holding either a "batch" or an "error" key.
+        """
+        if self.mode in WORKER_MODES:
+            return self.call_worker(message, trace, deadline)
+        worker = PodWorker(self.pod_interpreter, self.pod_module, on_spawn=self.record_spawn, budget=self.budget)
+        worker.start()
+        try:
+            return worker.call(message, trace, deadline)
+        finally:
+            worker.stop()
+
+    def record_spawn(self) -> None:
+        """
+        Count a pod process start in the loader's metrics.
+        """
+        if self.metrics is not None:
+            self.metrics.record_spawn(self.pod_name)
+
+    def set_timeout(self, func_name: str, timeout: Optional[float]) -> None:
+        """
+        Override the pod's timeout for one of its functions. Can be called before or after load_pod().
+
+        Args:
+            func_name (str): The name of the pod function.
+            timeout (Optional[float]): Seconds a call may take, None lets the function run forever.
+        """
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be a positive number of seconds")
+        self.timeouts[func_name] = timeout
+
+    def call_deadline(self, func_name: str) -> Optional[Deadline]:
+        """
+        Build the deadline of a call from the function's or the pod's timeout and the
+        enclosing deadline() block, the earliest limit wins.
+
+        Args:
+            func_name (str): The name of the pod function, "<batch>" for a batch.
+
+        Returns:
+            Optional[Deadline]: The deadline, or None if the call is unbounded.
+        """
+        timeout = self.timeouts.get(func_name, self.timeout)
+        scope = CURRENT_DEADLINE.get()
+        if scope is None:
+            return None if timeout is None else Deadline(timeout)
+        return Deadline(timeout, scope.cancel, scope.expires)
+
+    def start_trace(self, func_name: str) -> Optional[CallTrace]:
+        """
+        Start tracing a pod call.
+
+        Args:
+            func_name (str): The name of the pod function.
+
+        Returns:
+            Optional[CallTrace]: The trace, or None if the loader has no metrics.
+        """
+        if self.metrics is None:
+            return None
+        return CallTrace(self.pod_name, func_name, self.mode)
+
+    def finish_call(
+        self, shm: SharedMemorySession, trace: Optional[CallTrace], error: Optional[str] = None
+    ) -> None:
+        """
+        Release the shared memory segments of a pod call and finish its trace.
+
+        Args:
+            shm (SharedMemorySession): The shared memory session of the call.
+            trace (Optional[CallTrace]): The trace returned by start_trace.
+            error (Optional[str]): The error of the call, if it failed.
+        """
+        try:
+            shm.cleanup()
+        finally:
+            self.finish_trace(trace, error)
+
+    def finish_trace(self, trace: Optional[CallTrace], error: Optional[str] = None) -> None:
+        """
+        Finish tracing a pod call and record it in the loader's metrics.
+
+        Args:
+            trace (Optional[CallTrace]): The trace returned by start_trace.
+            error (Optional[str]): The error of the call, if it failed.
+        """
+        if trace is not None:
+            trace.finish(error)
+            self.metrics.record(trace)
+
+    def start_profiling(self, profiler: str = DEFAULT_PROFILER, interval: float = DEFAULT_INTERVAL) -> PodProfile:
+        """
+        Profile every call of the pod's functions in the pod processes running them, until
+        stop_profiling(). The profiles are aggregated on the client:
+
+            profile = pl.start_profiling("sampling", interval=0.001)
+            hello_world_pod.foo(1, 2)
+            pl.stop_profiling()
+            profile.stats().sort_stats("cumulative").print_stats(20)
+
+        Calls made in a pypods.profiling.profile() block go to the block's profile instead.
+
+        Args:
+            profiler (str): "cprofile" or "sampling", see pypods.profiling.PodProfile.
+            interval (float): Seconds between two stack samples of the sampling profiler.
+
+        Returns:
+            PodProfile: The profile the calls are added to.
+        """
+        self.profile = PodProfile(profiler, interval)
+        return self.profile
+
+    def stop_profiling(self) -> Optional[PodProfile]:
+        """
+        Stop profiling the calls of the pod.
+
+        Returns:
+            Optional[PodProfile]: The profile of the calls made since start_profiling().
+        """
+        profile, self.profile = self.profile, None
+        return profile
+
+    def profile_request(self, message: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[PodProfile]]:
+        """
+        Ask the pod to profile a call if a profile is active.
+
+        Args:
+            message (Dict[str, Any]): The request.
+
+        Returns:
+            Tuple[Dict[str, Any], Optional[PodProfile]]: The request, and the profile to
+            collect the reply's profile into, if any.
+        """
+        profile = CURRENT_PROFILE.get() or self.profile
+        if profile is None:
+            return message, None
+        return dict(message, profile=profile.settings), profile
+
+    def memoize(
+        self, func_name: str, maxsize: int = 128, ttl: Optional[float] = None, disk: bool = False
+    ) -> ResultCache:
+        """
+        Cache the results of a pure pod function on the client, so repeated calls with the
+        same arguments skip the pod entirely. The cache is dropped whenever the pod's pod.py
+        or requirements.txt changes. Calls whose arguments cannot be canonically encoded,
+        generator results, errors and batched calls are never cached.
+
+            pl.memoize("tokenize", maxsize=1024, ttl=3600, disk=True)
+            hello_world_pod.tokenize.cache.stats()  # {"hits": ..., "misses": ..., ...}
+
+        Can be called before or after load_pod().
+
+        Args:
+            func_name (str): The name of the pod function.
+            maxsize (int): Maximum number of results kept in memory.
+            ttl (Optional[float]): Seconds a result stays valid, None keeps it until the pod changes.
+            disk (bool): Also keep results under pods/<pod_name>/.pypods/cache so they survive restarts.
+
+        Returns:
+            ResultCache: The function's cache, also available as the proxy's cache attribute.
+        """
+        pod_path = join(PODS_DIRECTORY, self.pod_name)
+        cache = ResultCache(
+            maxsize,
+            ttl,
+            directory=join(pod_path, PODS_STATE, "cache", func_name) if disk else None,
+            sources=[join(pod_path, f"{PODS_CONFIG}.py"), join(pod_path, "requirements.txt")],
+        )
+        self.caches[func_name] = cache
+        self.rewrap_function(func_name)
+        return cache
+
+    def single_flight(self, func_name: str) -> SingleFlight:
+        """
+        Coalesce identical concurrent calls of a pod function: while a call is in flight,
+        calls with the same arguments wait for it and share its result or error instead of
+        running the function again in the pod. Calls whose arguments cannot be canonically
+        encoded and batched calls run on their own.
+
+            pl.single_flight("fetch_schema")
+            config_pod.fetch_schema.flight.stats()  # {"calls": ..., "coalesced": ..., ...}
+
+        Can be called before or after load_pod(), and combined with memoize().
+
+        Args:
+            func_name (str): The name of the pod function.
+
+        Returns:
+            SingleFlight: The function's single-flight group, also available as the proxy's
+            flight attribute.
+        """
+        on_coalesced = None
+        if self.metrics is not None:
+            on_coalesced = partial(self.metrics.record_coalesced, self.pod_name, func_name)
+        flight = SingleFlight(on_coalesced)
+        self.flights[func_name] = flight
+        self.rewrap_function(func_name)
+        return flight
+
+    def rewrap_function(self, func_name: str) -> None:
+        """
+        Wrap the proxy of an already loaded pod function again, after its cache or
+        single-flight group changed.
+
+        Args:
+            func_name (str): The name of the pod function.
+        """
+        pod = self.namespace.get(self.pod_name)
+        # vars() so that configuring the function of a lazy pod does not load it.
+        function = vars(pod).get(func_name) if pod is not None else None
+        if function is not None:
+            wrapped = self.cached_function(func_name, inspect.unwrap(function))
+            # Keep the helpers attached to the proxy, e.g. the map() of pool functions.
+            vars(wrapped).update({k: v for k, v in vars(function).items() if k not in vars(wrapped)})
+            setattr(pod, func_name, wrapped)
+
+    def cached_function(self, func_name: str, function: Callable) -> Callable:
+        """
+        Wrap a proxy function with the single-flight group registered by single_flight(),
+        then with the result cache registered by memoize(), if any.
+
+        Args:
+            func_name (str): The name of the pod function.
+            function (Callable): The proxy function.
+
+        Returns:
+            Callable: The wrapped proxy, or the proxy itself if the function is not configured.
+        """
+        if func_name in self.flights:
+            function = self.single_flight_function(func_name, function)
+        if func_name not in self.caches:
+            return function
+
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def cached_proxy(*args, **kwargs):
+                cache = cached_proxy.cache
+                try:
+                    key = canonical_key(func_name, args, kwargs)
+                except TypeError:
+                    return await function(*args, **kwargs)
+                value = cache.get(key)
+                if value is MISSING:
+                    value = await function(*args, **kwargs)
+                    if not isinstance(value, collections.abc.AsyncIterator):
+                        cache.set(key, value)
+                return value
+        else:
+            @wraps(function)
+            def cached_proxy(*args, **kwargs):
+                cache = cached_proxy.cache
+                try:
+                    key = canonical_key(func_name, args, kwargs)
+                except TypeError:
+                    return function(*args, **kwargs)
+                value = cache.get(key)
+                if value is MISSING:
+                    value = function(*args, **kwargs)
+                    if not isinstance(value, collections.abc.Iterator):
+                        cache.set(key, value)
+                return value
+        cached_proxy.cache = self.caches[func_name]
+        return cached_proxy
+
+    def single_flight_function(self, func_name: str, function: Callable) -> Callable:
+        """
+        Wrap a proxy function with its single-flight group.
+
+        Args:
+            func_name (str): The name of the pod function.
+            function (Callable): The proxy function.
+
+        Returns:
+            Callable: The wrapped proxy.
+        """
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def flight_proxy(*args, **kwargs):
+                try:
+                    key = canonical_key(func_name, args, kwargs)
+                except TypeError:
+                    return await function(*args, **kwargs)
+                return await flight_proxy.flight.call_async(
+                    key, partial(function, *args, **kwargs), self.call_deadline(func_name)
+                )
+        else:
+            @wraps(function)
+            def flight_proxy(*args, **kwargs):
+                try:
+                    key = canonical_key(func_name, args, kwargs)
+                except TypeError:
+                    return function(*args, **kwargs)
+                return flight_proxy.flight.call(key, partial(function, *args, **kwargs), self.call_deadline(func_name))
+        flight_proxy.flight = self.flights[func_name]
+        return flight_proxy
+
+    def make_handle(self, reply: Dict[str, Any]) -> PodHandle:
+        """
+        Create the client-side proxy of an object the pod returned by reference.
+
+        Args:
+            reply (Dict[str, Any]): The pod's reply, holding the "handle" and "type" of the object.
+
+        Returns:
+            PodHandle: The proxy of the pod object.
+        """
+        return PodHandle(self, reply["handle"], reply["type"])
+
+    def release_handle(self, object_id: str) -> None:
+        """
+        Queue the release of a pod object, it is sent with the next request to the pod.
+        Called when a PodHandle is closed or garbage collected, possibly in the middle of a call.
+
+        Args:
+            object_id (str): The ID of the pod object.
+        """
+        self.released.put(object_id)
+
+    def flush_releases(self) -> None:
+        """
+        Send the queued releases of pod objects right away.
+        """
+        if not self.released or self.worker is None:
+            return
+        try:
+            self.call_worker({"release": self.released.drain()})
+        except PyPodError:
+            # The pod process is gone and its objects with it.
+            pass
+
+    def call_handle(self, message: Dict[str, Any], name: str) -> Any:
+        """
+        Send a method call or an attribute read to a pod object.
+
+        Args:
+            message (Dict[str, Any]): The request, holding the "handle" of the object.
+            name (str): The name the call is traced under, e.g. "Model.predict".
+
+        Returns:
+            Any: The result, a PodHandle if it was returned by reference, or METHOD if the
+            attribute read is a method.
+        """
+        trace, error = self.start_trace(name), None
+        message, profile = self.profile_request(message)
+        try:
+            reply = self.send_request(message, trace, self.call_deadline(name))
+            if profile is not None:
+                profile.collect(reply)
+            if "error" in reply:
+                raise PyPodResponseError(reply["error"])
+            if "method" in reply:
+                return METHOD
+            if "handle" in reply:
+                return self.make_handle(reply)
+            return reply["response"]
+        except (PyPodTimeoutError, PyPodCancelledError) as e:
+            error = str(e)
+            raise
+        except PyPodResponseError as e:
+            error = str(e)
+            raise PyPodResponseError(f"PyPodResponseError: {e}")
+        except Exception as e:
+            error = str(e)
+            raise Exception(f"Unknown error: {e}")
+        finally:
+            self.finish_trace(trace, error)
+
+    def batch(self) -> "PodBatch":
+        """
+        Collect pod function calls and send them to the pod in a single message.
+
+            with pl.batch() as b:
+                futures = [b.foo(i, i) for i in range(1000)]
+            results = [f.result() for f in futures]
+
+        Returns:
+            PodBatch: The batch, executed when its with block exits.
+        """
+        return PodBatch(self)
+
     def create_a_function(self, func_name, *args, **kwargs) -> str:
         """
         Dynamically create a function that acts as a proxy for remote procedure calls to the pod.
@@ -167,19 +943,147 @@ class PodLoader:
 
         def rpc_proxy_function(*args, **kwargs):
             function_output = None
+            shm = SharedMemorySession(self.shm_threshold)
+            trace, error = self.start_trace(func_name), None
+            streaming = False
             try:
-                function_dict = {"name": func_name, "args": args, "kwargs": kwargs}
-                stdout, stderr = self.send_data(dumps(function_dict))
-                if stderr:
-                    error = loads(stderr)["error"]
-                    raise PyPodResponseError(error)
-                function_output = loads(stdout)["response"]
+                function_dict = shm.export_call({"name": func_name, "args": args, "kwargs": kwargs})
+                function_dict, profile = self.profile_request(function_dict)
+                reply = self.send_request(function_dict, trace, self.call_deadline(func_name))
+                if profile is not None:
+                    profile.collect(reply)
+                if "error" in reply:
+                    raise PyPodResponseError(reply["error"])
+                if "handle" in reply:
+                    function_output = self.make_handle(reply)
+                elif inspect.isgenerator(reply["response"]):
+                    # The stream finishes the call once it is consumed.
+                    streaming = True
+                    function_output = finish_stream(reply["response"], partial(self.finish_call, shm, trace))
+                else:
+                    function_output = shm.attach(reply["response"])
+            except (PyPodTimeoutError, PyPodCancelledError) as e:
+                error = str(e)
+                raise
             except PyPodResponseError as e:
+                error = str(e)
                 raise PyPodResponseError(f"PyPodResponseError: {e}")
             except Exception as e:
+                error = str(e)
                 raise Exception(f"Unknown error: {e}")
+            finally:
+                if not streaming:
+                    self.finish_call(shm, trace, error)
             return function_output
-        self.namespace[self.pod_name].__setattr__(func_name, rpc_proxy_function)
+        self.namespace[self.pod_name].__setattr__(
+            func_name, self.cached_function(func_name, rpc_proxy_function)
+        )
+
+
+class PodBatch:
+    """
+    Records calls to pod functions and ships them to the pod as one message.
+    Each recorded call returns a Future that is resolved once the batch is executed.
+    """
+
+    def __init__(self, loader: PodLoader) -> None:
+        """
+        Initialize an empty batch.
+
+        Args:
+            loader (PodLoader): The loader of the pod the calls are sent to.
+        """
+        self._loader = loader
+        self._calls: List[Dict[str, Any]] = []
+        self._futures: List[Future] = []
+        self._shm = SharedMemorySession(loader.shm_threshold)
+
+    def __getattr__(self, func_name: str) -> Callable[..., Future]:
+        if func_name.startswith("__"):
+            raise AttributeError(func_name)
+        pod = self._loader.namespace.get(self._loader.pod_name)
+        if not hasattr(pod, func_name):
+            raise AttributeError(f"Pod {self._loader.pod_name} has no function {func_name}")
+
+        def record_call(*args, **kwargs) -> Future:
+            self._calls.append(
+                self._shm.export_call({"name": func_name, "args": args, "kwargs": kwargs})
+            )
+            self._futures.append(Future())
+            return self._futures[-1]
+        return record_call
+
+    def __enter__(self) -> "PodBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            for future in self._futures:
+                future.cancel()
+            self._shm.cleanup()
+            return
+        self._execute()
+
+    def _execute(self) -> None:
+        """
+        Send every recorded call to the pod and resolve the futures with the results.
+        """
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        if not calls:
+            return
+        trace, error = self._loader.start_trace("<batch>"), None
+        try:
+            try:
+                reply = self._loader.send_batch({"batch": calls}, trace, self._loader.call_deadline("<batch>"))
+            except Exception as e:
+                error = str(e)
+                self._fail(futures, e)
+            error = reply.get("error")
+            self._resolve(futures, reply)
+        finally:
+            self._shm.cleanup()
+            self._loader.finish_trace(trace, error)
+
+    def _fail(self, futures: List[Future], e: Exception) -> None:
+        """
+        Fail every future of the batch with the same error and raise it.
+
+        Args:
+            futures (List[Future]): The futures of the batch.
+            e (Exception): The error that prevented the batch from running.
+        """
+        if isinstance(e, (PyPodTimeoutError, PyPodCancelledError)):
+            error = e
+        elif isinstance(e, PyPodResponseError):
+            error = PyPodResponseError(f"PyPodResponseError: {e}")
+        else:
+            error = Exception(f"Unknown error: {e}")
+        for future in futures:
+            future.set_exception(error)
+        raise error
+
+    def _resolve(self, futures: List[Future], reply: Dict[str, Any]) -> None:
+        """
+        Resolve the futures of the batch with the pod's per-call replies.
+
+        Args:
+            futures (List[Future]): The futures of the batch.
+            reply (Dict[str, Any]): The pod's reply, holding either a "batch" or an "error" key.
+        """
+        if "error" in reply:
+            self._fail(futures, PyPodResponseError(reply["error"]))
+        for future, item in zip(futures, reply["batch"]):
+            if "error" in item:
+                future.set_exception(PyPodResponseError(f"PyPodResponseError: {item['error']}"))
+            elif "handle" in item:
+                try:
+                    future.set_result(self._loader.make_handle(item))
+                except PyPodResponseError as e:
+                    # Pools refuse remote objects, which only fails this call of the batch.
+                    future.set_exception(PyPodResponseError(f"PyPodResponseError: {e}"))
+            else:
+                future.set_result(self._shm.attach(item["response"]))
 
 
 class PodListener:
@@ -190,7 +1094,21 @@ class PodListener:
     """
 
     def __init__(self) -> None:
-        pass
+        # Pod-side timings of the request read by read_stdin, if the client asked for them.
+        self.trace: Optional[Dict[str, float]] = None
+        self.decoded = 0.0
+        # Serializes reply frames when requests are handled concurrently by serve().
+        self.write_lock = threading.Lock()
+        # IDs of the multiplexed requests in flight, and of those whose client stopped
+        # reading their replies.
+        self.active: Set[int] = set()
+        self.cancelled: Set[int] = set()
+        # True in the forked child of a zygote, whose objects die with it.
+        self.forked = False
+        # Profiles the call read by read_stdin, if the client asked for it.
+        self.profiler: Optional[CallProfiler] = None
+        # Runs async def pod functions, and the multiplexed requests of serve().
+        self.runtime: Optional[PodRuntime] = None
 
     def read_stdin(self) -> Optional[Dict[str, Any]]:
         """
@@ -202,27 +1120,695 @@ class PodListener:
         func_param = None
         try:
             data = sys.stdin.buffer.read()
+            received, start = time.time(), time.perf_counter()
             func_param = loads(data)
+            self.decoded = time.perf_counter()
+            if isinstance(func_param, dict) and func_param.get("trace"):
+                self.trace = {"received": received, "pod_decode": self.decoded - start}
             if not isinstance(func_param, dict) or not {
                 "name",
                 "args",
                 "kwargs",
             }.issubset(func_param):
                 raise Exception("Corrupt pod input!")
+            if func_param.get("profile"):
+                self.profiler = CallProfiler(func_param["profile"])
+                self.profiler.start()
         except Exception as e:
             func_param = None
             self.write_stderr(str(e))
         return func_param
 
+    def dispatch(self, namespace: Dict[str, Any], msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a function call request against the pod module's namespace.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            msg (Dict[str, Any]): The request holding the function name, args and kwargs.
+
+        Returns:
+            Dict[str, Any]: A reply holding either a "response" or an "error" key.
+        """
+        if isinstance(msg, dict) and "release" in msg:
+            OBJECTS.release(msg["release"])
+            if "name" not in msg and "handle" not in msg:
+                return {"response": None}
+        if isinstance(msg, dict) and "handle" in msg:
+            return self.dispatch_handle(msg)
+        if not isinstance(msg, dict) or not {"name", "args", "kwargs"}.issubset(msg):
+            return {"error": "Corrupt pod input!"}
+        function_name, args, kwargs = msg["name"], msg["args"], msg["kwargs"]
+        if function_name not in namespace:
+            return {"error": f"Function {function_name} does not exist in pod"}
+        # Large payloads are exchanged through shared memory segments when the client asks for it.
+        shm, mappings = msg.get("shm"), []
+        profiler = self.call_profiler(msg, namespace[function_name])
+        try:
+            if shm:
+                args = attach_value(args, mappings)
+                kwargs = attach_value(kwargs, mappings)
+            with profiler:
+                function_output = self.resolve(namespace[function_name](*args, **kwargs))
+            reply = self.function_reply(function_output, shm)
+        except Exception as e:
+            reply = {"error": str(e)}
+        finally:
+            release_mappings(mappings)
+        return profiler.attach(reply)
+
+    def call_profiler(self, msg: Dict[str, Any], function: Any = None) -> CallProfiler:
+        """
+        The profiler of a call, which does nothing unless the client asked for a profile.
+        The sampling profiler also records the pod's event loop for async def functions.
+
+        Args:
+            msg (Dict[str, Any]): The request, holding the "profile" settings if any.
+            function (Any): The pod function.
+
+        Returns:
+            CallProfiler: The profiler, to enter around the call.
+        """
+        settings = msg.get("profile")
+        threads = [threading.get_ident()]
+        if settings and is_async(function):
+            threads.append(self.get_runtime().loop_thread_id())
+        return CallProfiler(settings, threads)
+
+    async def dispatch_async(self, namespace: Dict[str, Any], msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The counterpart of dispatch() for async def pod functions, awaited on the pod's
+        event loop so that the calls waiting on I/O do not hold a thread.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            msg (Dict[str, Any]): The request holding the function name, args and kwargs.
+
+        Returns:
+            Dict[str, Any]: A reply holding either a "response" or an "error" key.
+        """
+        if "release" in msg:
+            OBJECTS.release(msg["release"])
+        function_name, args, kwargs = msg["name"], msg["args"], msg["kwargs"]
+        shm, mappings = msg.get("shm"), []
+        try:
+            if shm:
+                args = attach_value(args, mappings)
+                kwargs = attach_value(kwargs, mappings)
+            function_output = namespace[function_name](*args, **kwargs)
+            if inspect.isawaitable(function_output):
+                function_output = await function_output
+            return self.function_reply(function_output, shm)
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            release_mappings(mappings)
+
+    def function_reply(self, output: Any, shm: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the reply of a pod function call from its return value.
+
+        Args:
+            output (Any): The return value of the pod function.
+            shm (Optional[Dict[str, Any]]): The shared memory settings of the request.
+
+        Returns:
+            Dict[str, Any]: A reply holding a "response", or the "handle" of a pod object.
+        """
+        if isinstance(output, PodObject):
+            return self.export_object(output)
+        if shm and not (inspect.isgenerator(output) or inspect.isasyncgen(output)):
+            output = export_value(output, shm["prefix"], shm["threshold"], [])
+        return {"response": output}
+
+    def resolve(self, output: Any) -> Any:
+        """
+        Run the coroutine returned by an async def pod function to completion on the pod's
+        event loop, or turn the async generator of an async generator function into a
+        generator, so that requests handled on a thread can serve them.
+
+        Args:
+            output (Any): The return value of the pod function.
+
+        Returns:
+            Any: The result of the coroutine, a generator, or output as is.
+        """
+        if not (inspect.iscoroutine(output) or inspect.isasyncgen(output)):
+            return output
+        if inspect.isasyncgen(output):
+            return self.get_runtime().iterate(output)
+        return self.get_runtime().run(output)
+
+    def get_runtime(self) -> PodRuntime:
+        """
+        The runtime of the pod process, started on first use outside of serve().
+
+        Returns:
+            PodRuntime: The runtime.
+        """
+        if self.runtime is None:
+            self.runtime = PodRuntime()
+        return self.runtime
+
+    def dispatch_handle(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a method call or an attribute read on an object of the pod's object table.
+
+        Args:
+            msg (Dict[str, Any]): The request holding the "handle" of the object and either the
+                "method", args and kwargs of a call or the "attr" to read.
+
+        Returns:
+            Dict[str, Any]: A reply holding a "response", a "handle", an "error", or "method"
+            if the attribute read is a method.
+        """
+        profiler = self.call_profiler(msg)
+        try:
+            obj = OBJECTS.get(msg["handle"])
+            if "attr" in msg:
+                output = getattr(obj, msg["attr"])
+                if callable(output):
+                    return {"method": True}
+            else:
+                with profiler:
+                    output = self.resolve(getattr(obj, msg["method"])(*msg["args"], **msg["kwargs"]))
+            if isinstance(output, PodObject):
+                return self.export_object(output)
+            return profiler.attach({"response": output})
+        except Exception as e:
+            return profiler.attach({"error": str(e)})
+
+    def export_object(self, output: PodObject) -> Dict[str, Any]:
+        """
+        Keep an object returned by reference in the pod's object table.
+
+        Args:
+            output (PodObject): The object, wrapped by pypods.handles.handle().
+
+        Returns:
+            Dict[str, Any]: A reply holding the "handle" and "type" of the object.
+        """
+        if self.forked:
+            return {"error": "Remote objects require worker or daemon mode, a zygote's child exits after the call"}
+        return {"handle": OBJECTS.put(output.obj), "type": type(output.obj).__name__}
+
+    def dispatch_batch(
+        self,
+        namespace: Dict[str, Any],
+        calls: List[Dict[str, Any]],
+        codec: Codec = BsonCodec(),
+        trace: Optional[Dict[str, float]] = None,
+        request_id: Optional[int] = None,
+    ) -> List[Buffer]:
+        """
+        Execute a batch of function call requests and serialize their replies.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            calls (List[Dict[str, Any]]): The function call requests.
+            codec (Codec): The wire codec.
+            trace (Optional[Dict[str, float]]): Pod-side timings to complete with the
+                execution time and send back, if the client asked for them.
+            request_id (Optional[int]): The ID of the batch request, if it is multiplexed.
+
+        Returns:
+            List[Buffer]: The serialized reply holding one reply per call under "batch".
+        """
+        start = time.perf_counter()
+        replies = [self.dispatch(namespace, msg) for msg in calls]
+        for i, reply in enumerate(replies):
+            if inspect.isgenerator(reply.get("response")):
+                replies[i] = {"error": "Generator functions cannot be called in a batch"}
+        envelope: Dict[str, Any] = {"batch": replies}
+        if request_id is not None:
+            envelope["id"] = request_id
+        if trace is not None:
+            envelope["trace"] = dict(trace, execute=time.perf_counter() - start)
+        try:
+            return codec.dump_buffers(envelope)
+        except Exception:
+            # Only report the replies that cannot be serialized as errors.
+            for i, reply in enumerate(replies):
+                try:
+                    codec.dumps(reply)
+                except Exception as e:
+                    replies[i] = {"error": str(e)}
+            return codec.dump_buffers(envelope)
+
+    def serve(
+        self,
+        namespace: Dict[str, Any],
+        stdin: BinaryIO,
+        stdout: BinaryIO,
+        codec: Codec = BsonCodec(),
+        fork: bool = False,
+        concurrency: int = 1,
+        runtime: Optional[PodRuntime] = None,
+    ) -> None:
+        """
+        Serve length-prefixed requests until the pod client closes stdin.
+        A request is either a single function call or a "batch" of them.
+
+        Requests that carry an "id" are multiplexed: they are handled by a PodRuntime, and
+        every reply frame carries the ID of its request so that replies can come back out
+        of order. Calls of async def functions overlap on the pod's event loop, calls of
+        functions marked with threadsafe overlap on concurrency threads, and the other
+        requests run one at a time. A {"cancel": id} request stops the reply stream of an
+        in-flight request.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            stdin (BinaryIO): The stream requests are read from.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+            fork (bool): Handle every request in a forked child of this process, so that
+                state changed by one call never leaks into the next one.
+            concurrency (int): Calls of threadsafe functions handled at once, 1 handles
+                every request in order.
+            runtime (Optional[PodRuntime]): A runtime shared with other streams of the
+                process, e.g. the connections of a daemon. Requests are still handled in
+                order, but calls of functions that are neither threadsafe nor async def run
+                on its single thread, one at a time across all the streams.
+        """
+        multiplexed = concurrency > 1
+        shared = runtime is not None
+        if shared:
+            self.runtime = runtime
+        elif multiplexed:
+            self.runtime = PodRuntime(concurrency)
+        try:
+            while True:
+                data = read_frame(stdin)
+                if data is None:
+                    break
+                if fork:
+                    self.handle_forked(namespace, data, stdout, codec)
+                elif multiplexed:
+                    self.schedule(namespace, data, stdout, codec)
+                elif shared:
+                    self.handle_shared(namespace, data, stdout, codec)
+                else:
+                    self.handle(namespace, data, stdout, codec)
+        finally:
+            if self.runtime is not None and not shared:
+                self.runtime.shutdown()
+            self.runtime = None
+
+    def serve_stage(self, function: Callable[[Any], Any], stdin: BinaryIO, stdout: BinaryIO, codec: Codec) -> None:
+        """
+        Serve one stage of a pod pipeline until the upstream stage closes stdin.
+
+        Every {"item": ...} frame read from stdin is passed to function and its result is
+        written to stdout as an {"item": ...} frame for the next stage, or every item it
+        yields if it is a generator function. Any other frame, e.g. the end of a run or an
+        error of an upstream stage, is forwarded as is.
+
+        Args:
+            function (Callable[[Any], Any]): The pod function of the stage.
+            stdin (BinaryIO): The stream items are read from.
+            stdout (BinaryIO): The stream results are written to.
+            codec (Codec): The wire codec of the pipeline.
+        """
+        while True:
+            data = read_frame(stdin)
+            if data is None:
+                break
+            try:
+                msg = codec.loads(data)
+            except Exception:
+                # The start probe of the pipeline is BSON, whatever the pipeline's codec.
+                msg = None
+            if not isinstance(msg, dict) or "item" not in msg:
+                write_frame(stdout, data)
+                continue
+            try:
+                result = self.resolve(function(msg["item"]))
+                if inspect.isgenerator(result):
+                    for item in result:
+                        write_frame(stdout, codec.dump_buffers({"item": item}))
+                else:
+                    write_frame(stdout, codec.dump_buffers({"item": result}))
+            except BrokenPipeError:
+                raise
+            except Exception as e:
+                write_frame(stdout, codec.dump_buffers({"error": str(e)}))
+
+    def handle(self, namespace: Dict[str, Any], data: bytes, stdout: BinaryIO, codec: Codec) -> None:
+        """
+        Execute one serialized request and write its replies.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            data (bytes): The serialized request.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        try:
+            request = self.receive(data, codec)
+        except Exception as e:
+            self.write_reply(stdout, self.dump_reply({"error": str(e)}, codec))
+            return
+        if request is not None:
+            self.execute(namespace, *request, stdout, codec)
+
+    def schedule(self, namespace: Dict[str, Any], data: bytes, stdout: BinaryIO, codec: Codec) -> None:
+        """
+        Decode one serialized multiplexed request and hand it to the runtime without
+        waiting for it, on the event loop if it calls an async def function, on the
+        thread pool if it calls a threadsafe function, or else on the single thread.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            data (bytes): The serialized request.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        try:
+            request = self.receive(data, codec)
+        except Exception as e:
+            self.write_reply(stdout, self.dump_reply({"error": str(e)}, codec))
+            return
+        if request is None:
+            return
+        msg = request[0]
+        function = self.requested_function(namespace, msg)
+        # Profiled calls run on a thread, where CallProfiler can record them.
+        if is_async(function) and {"args", "kwargs"}.issubset(msg) and not msg.get("profile"):
+            self.runtime.spawn(self.execute_async(namespace, *request, stdout, codec))
+        else:
+            self.runtime.submit(is_threadsafe(function), self.execute, namespace, *request, stdout, codec)
+
+    def handle_shared(self, namespace: Dict[str, Any], data: bytes, stdout: BinaryIO, codec: Codec) -> None:
+        """
+        Execute one serialized request of a stream that shares the runtime with others and
+        write its replies. Calls of threadsafe and async def functions run on the stream's
+        own thread, any other request waits for its turn on the runtime's single thread.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            data (bytes): The serialized request.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        try:
+            request = self.receive(data, codec)
+        except Exception as e:
+            self.write_reply(stdout, self.dump_reply({"error": str(e)}, codec))
+            return
+        if request is None:
+            return
+        function = self.requested_function(namespace, request[0])
+        if is_threadsafe(function) or is_async(function):
+            self.execute(namespace, *request, stdout, codec)
+        else:
+            self.runtime.submit(False, self.execute, namespace, *request, stdout, codec).result()
+
+    def requested_function(self, namespace: Dict[str, Any], msg: Any) -> Any:
+        """
+        The pod function a request calls.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            msg (Any): The decoded request.
+
+        Returns:
+            Any: The function, or None for a batch, a call on a pod object or a corrupt request.
+        """
+        if isinstance(msg, dict) and "batch" not in msg and "handle" not in msg and isinstance(msg.get("name"), str):
+            return namespace.get(msg["name"])
+        return None
+
+    def receive(self, data: bytes, codec: Codec) -> Optional[Tuple[Any, Optional[Dict[str, float]], float]]:
+        """
+        Decode one serialized request and register it if it is multiplexed.
+        A {"cancel": id} request is applied right away.
+
+        Args:
+            data (bytes): The serialized request.
+            codec (Codec): The wire codec negotiated with the pod client.
+
+        Returns:
+            Optional[Tuple[Any, Optional[Dict[str, float]], float]]: The request, its
+            pod-side timings if the client asked for them and the time it was decoded,
+            or None for a cancel request.
+        """
+        received, start = time.time(), time.perf_counter()
+        msg = codec.loads(data)
+        decoded = time.perf_counter()
+        if isinstance(msg, dict):
+            if "cancel" in msg:
+                with self.write_lock:
+                    if msg["cancel"] in self.active:
+                        self.cancelled.add(msg["cancel"])
+                return None
+            request_id = msg.get("id")
+            if request_id is not None:
+                with self.write_lock:
+                    self.active.add(request_id)
+        trace = None
+        if isinstance(msg, dict) and msg.get("trace"):
+            trace = {"received": received, "pod_decode": decoded - start}
+        return msg, trace, decoded
+
+    def execute(
+        self,
+        namespace: Dict[str, Any],
+        msg: Any,
+        trace: Optional[Dict[str, float]],
+        decoded: float,
+        stdout: BinaryIO,
+        codec: Codec,
+    ) -> None:
+        """
+        Execute one decoded request and write its replies.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            msg (Any): The request.
+            trace (Optional[Dict[str, float]]): Pod-side timings of the request, if the
+                client asked for them.
+            decoded (float): When the request was decoded.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        request_id = msg.get("id") if isinstance(msg, dict) else None
+        try:
+            if "batch" in msg:
+                bdata = self.dispatch_batch(namespace, msg["batch"], codec, trace, request_id)
+            else:
+                reply = self.dispatch(namespace, msg)
+                if inspect.isgenerator(reply.get("response")):
+                    self.write_stream(reply["response"], stdout, codec, request_id)
+                    return
+                if trace is not None:
+                    reply["trace"] = dict(trace, execute=time.perf_counter() - decoded)
+                bdata = self.dump_reply(reply, codec, request_id)
+        except Exception as e:
+            bdata = self.dump_reply({"error": str(e)}, codec, request_id)
+        try:
+            self.write_reply(stdout, bdata, request_id)
+        finally:
+            self.release(request_id)
+
+    async def execute_async(
+        self,
+        namespace: Dict[str, Any],
+        msg: Dict[str, Any],
+        trace: Optional[Dict[str, float]],
+        decoded: float,
+        stdout: BinaryIO,
+        codec: Codec,
+    ) -> None:
+        """
+        The counterpart of execute() for a call of an async def function, run on the pod's
+        event loop.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            msg (Dict[str, Any]): The request.
+            trace (Optional[Dict[str, float]]): Pod-side timings of the request, if the
+                client asked for them.
+            decoded (float): When the request was decoded.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        request_id = msg.get("id")
+        try:
+            reply = await self.dispatch_async(namespace, msg)
+            if inspect.isasyncgen(reply.get("response")):
+                await self.write_stream_async(reply["response"], stdout, codec, request_id)
+                return
+            if trace is not None:
+                reply["trace"] = dict(trace, execute=time.perf_counter() - decoded)
+            bdata = self.dump_reply(reply, codec, request_id)
+        except Exception as e:
+            bdata = self.dump_reply({"error": str(e)}, codec, request_id)
+        try:
+            self.write_reply(stdout, bdata, request_id)
+        finally:
+            self.release(request_id)
+
+    def release(self, request_id: Optional[int]) -> None:
+        """
+        Forget a multiplexed request once its last reply is written or dropped.
+
+        Args:
+            request_id (Optional[int]): The ID of the request.
+        """
+        if request_id is not None:
+            with self.write_lock:
+                self.active.discard(request_id)
+                self.cancelled.discard(request_id)
+
+    def dump_reply(self, reply: Dict[str, Any], codec: Codec, request_id: Optional[int] = None) -> List[Buffer]:
+        """
+        Serialize a reply, tagging it with the ID of its request if it is multiplexed.
+
+        Args:
+            reply (Dict[str, Any]): The reply.
+            codec (Codec): The wire codec negotiated with the pod client.
+            request_id (Optional[int]): The ID of the request.
+
+        Returns:
+            List[Buffer]: The serialized reply.
+        """
+        if request_id is not None:
+            reply["id"] = request_id
+        return codec.dump_buffers(reply)
+
+    def write_reply(self, stdout: BinaryIO, data: List[Buffer], request_id: Optional[int] = None) -> bool:
+        """
+        Write a serialized reply frame, unless its request was cancelled.
+
+        Args:
+            stdout (BinaryIO): The stream replies are written to.
+            data (List[Buffer]): The serialized reply.
+            request_id (Optional[int]): The ID of the request.
+
+        Returns:
+            bool: False if the request was cancelled and the frame dropped.
+        """
+        with self.write_lock:
+            if request_id is not None and request_id in self.cancelled:
+                return False
+            write_frame(stdout, data)
+        return True
+
+    def handle_forked(self, namespace: Dict[str, Any], data: bytes, stdout: BinaryIO, codec: Codec) -> None:
+        """
+        Execute one serialized request in a forked child and wait for it. The child starts
+        from the already imported pod module and exits once its replies are written.
+        If it dies without replying, an error reply is written on its behalf.
+
+        Args:
+            namespace (Dict[str, Any]): The pod module's global namespace.
+            data (bytes): The serialized request.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+        """
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            self.forked = True
+            try:
+                self.handle(namespace, data, stdout, codec)
+                status = 0
+            finally:
+                sys.stderr.flush()
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        if status != 0:
+            if os.WIFSIGNALED(status):
+                reason = f"was killed by signal {os.WTERMSIG(status)}"
+            else:
+                reason = f"exited with code {os.WEXITSTATUS(status)}"
+            write_frame(stdout, codec.dump_buffers({"error": f"Pod process handling the call {reason}"}))
+
+    def write_stream(
+        self,
+        generator: Iterator[Any],
+        stdout: BinaryIO,
+        codec: Codec = BsonCodec(),
+        request_id: Optional[int] = None,
+    ) -> None:
+        """
+        Stream the items of a generator pod function back as chunk frames.
+        The generator is closed early if its multiplexed request is cancelled.
+
+        Args:
+            generator (Iterator[Any]): The generator returned by the pod function.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+            request_id (Optional[int]): The ID of the request, if it is multiplexed.
+        """
+        try:
+            if not self.write_reply(stdout, self.dump_reply({"stream": True}, codec, request_id), request_id):
+                return
+            try:
+                for item in generator:
+                    chunk = self.dump_reply({"chunk": item}, codec, request_id)
+                    if not self.write_reply(stdout, chunk, request_id):
+                        return
+            except Exception as e:
+                self.write_reply(stdout, self.dump_reply({"error": str(e)}, codec, request_id), request_id)
+                return
+            self.write_reply(stdout, self.dump_reply({"end": True}, codec, request_id), request_id)
+        finally:
+            generator.close()
+            self.release(request_id)
+
+    async def write_stream_async(
+        self,
+        generator: AsyncIterator[Any],
+        stdout: BinaryIO,
+        codec: Codec = BsonCodec(),
+        request_id: Optional[int] = None,
+    ) -> None:
+        """
+        The counterpart of write_stream() for an async generator pod function.
+
+        Args:
+            generator (AsyncIterator[Any]): The async generator returned by the pod function.
+            stdout (BinaryIO): The stream replies are written to.
+            codec (Codec): The wire codec negotiated with the pod client.
+            request_id (Optional[int]): The ID of the request, if it is multiplexed.
+        """
+        try:
+            if not self.write_reply(stdout, self.dump_reply({"stream": True}, codec, request_id), request_id):
+                return
+            try:
+                async for item in generator:
+                    chunk = self.dump_reply({"chunk": item}, codec, request_id)
+                    if not self.write_reply(stdout, chunk, request_id):
+                        return
+            except Exception as e:
+                self.write_reply(stdout, self.dump_reply({"error": str(e)}, codec, request_id), request_id)
+                return
+            self.write_reply(stdout, self.dump_reply({"end": True}, codec, request_id), request_id)
+        finally:
+            await generator.aclose()
+            self.release(request_id)
+
     def write_stdout(self, data: Any) -> None:
         """
-        Serialize and write data to standard output.
+        Serialize and write data to standard output. The coroutine returned by an async
+        def pod function is run to completion first.
 
         Args:
             data (Any): Data to be serialized and written.
         """
+        if inspect.iscoroutine(data):
+            try:
+                data = asyncio.run(data)
+            except Exception as e:
+                self.write_stderr(str(e))
+                return
+        if isinstance(data, PodObject):
+            self.write_stderr("Remote objects require worker or daemon mode, a spawned pod exits after the call")
+            return
         try:
-            bdata = dumps({"response": data})
+            bdata = dumps(self.envelope({"response": data}))
             sys.stdout.buffer.write(bdata)
             sys.stdout.buffer.flush()
         except Exception as e:
@@ -237,5 +1823,22 @@ class PodListener:
         """
         if not isinstance(error, str):
             raise TypeError("Error message should be of type string.")
-        sys.stderr.buffer.write(dumps({"error": error}))
+        sys.stderr.buffer.write(dumps(self.envelope({"error": error})))
         sys.stderr.buffer.flush()
+
+    def envelope(self, reply: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add the pod-side timings and the profile of the request read by read_stdin to its reply.
+
+        Args:
+            reply (Dict[str, Any]): The reply.
+
+        Returns:
+            Dict[str, Any]: The reply, with a "trace" and a "profile" if the client asked for them.
+        """
+        if self.trace is not None:
+            reply["trace"] = dict(self.trace, execute=time.perf_counter() - self.decoded)
+        if self.profiler is not None:
+            reply["profile"] = self.profiler.stop()
+            self.profiler = None
+        return reply
@@ -0,0 +1,309 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import contextvars
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Set
+
+from pypods.deadline import Deadline
+from pypods.errors import PyPodError, PyPodNotStartedError, PyPodResponseError, PyPodTimeoutError
+from pypods.handles import returned_objects
+from pypods.metrics import CallTrace
+from pypods.pods import POOL_MODES, PodLoader
+from pypods.worker import PodWorker
+
+# Chunks of a map submitted ahead per pod worker, so that workers do not wait for the next
+# chunk while the items are read lazily.
+CHUNKS_PER_WORKER = 2
+
+
+def chunked(iterable: Iterable[Any], chunksize: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of at most chunksize items.
+
+    Args:
+        iterable (Iterable[Any]): The items to split.
+        chunksize (int): The maximum number of items per chunk.
+
+    Returns:
+        Iterator[List[Any]]: The chunks in order.
+    """
+    if chunksize < 1:
+        raise ValueError("chunksize must be a positive integer")
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class PodPool(PodLoader):
+    """
+    A PodLoader that keeps several worker processes of the same pod running.
+
+    Concurrent callers are load-balanced across idle workers, and every pod function
+    gets map, starmap and imap_unordered helpers that spread work across the pool.
+    """
+
+    def __init__(self, pod_name: str, namespace: dict, size: Optional[int] = None, **kwargs) -> None:
+        """
+        Initialize the PodPool with the pod name, namespace and number of workers.
+
+        Args:
+            pod_name (str): The name of the pod associated with this pool.
+            namespace (dict): The namespace dictionary where pod functions are loaded.
+            size (Optional[int]): Number of pod workers, defaults to the number of CPUs.
+            **kwargs: Other PodLoader options, mode is "worker" (default) or "zygote".
+        """
+        kwargs.setdefault("mode", "worker")
+        if kwargs["mode"] not in POOL_MODES:
+            raise ValueError(f"mode: {kwargs['mode']} should be one of {POOL_MODES}")
+        if kwargs.get("concurrency", 1) != 1:
+            raise ValueError("concurrency is not supported by pod pools, size sets the calls run at once")
+        size = size or os.cpu_count() or 1
+        if size < 1:
+            raise ValueError("size must be a positive integer")
+        manager = kwargs.get("manager")
+        if manager is not None and size > manager.quota(pod_name):
+            raise ValueError(f"size: {size} exceeds the process quota of pod {pod_name}")
+        super().__init__(pod_name, namespace, **kwargs)
+        self.size = size
+        self.workers: List[PodWorker] = []
+        self.idle_workers: "queue.Queue[PodWorker]" = queue.Queue()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.local = threading.local()
+
+    def start_worker(self) -> None:
+        """
+        Start all pod workers of the pool concurrently.
+        """
+        fork = self.mode == "zygote"
+        workers = [
+            PodWorker(self.pod_interpreter, self.pod_module, self.codecs, fork, self.record_spawn, self.budget)
+            for _ in range(self.size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.size) as starter:
+            started = [starter.submit(worker.start) for worker in workers]
+        try:
+            for future in started:
+                future.result()
+        except Exception:
+            for worker in workers:
+                worker.stop()
+            raise
+        self.workers = workers
+        for worker in workers:
+            self.idle_workers.put(worker)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.size, thread_name_prefix=f"pypods-{self.pod_name}"
+        )
+
+    def stop_worker(self) -> None:
+        """
+        Stop all pod workers of the pool.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        self.idle_workers = queue.Queue()
+
+    def acquire_worker(self, deadline: Optional[Deadline] = None) -> PodWorker:
+        """
+        Wait for an idle pod worker and reserve it for the calling thread.
+
+        Args:
+            deadline (Optional[Deadline]): Time limit of the wait.
+
+        Returns:
+            PodWorker: The reserved worker.
+        """
+        if not self.workers:
+            raise PyPodNotStartedError("Pod pool is not running, call load_pod() first!")
+        if deadline is None:
+            return self.idle_workers.get()
+        deadline.check()
+        try:
+            return self.idle_workers.get(timeout=deadline.remaining())
+        except queue.Empty:
+            raise PyPodTimeoutError("Pod call exceeded its deadline while waiting for a pod worker")
+
+    def release_worker(self, worker: PodWorker) -> None:
+        """
+        Give a reserved pod worker back to the pool.
+
+        Args:
+            worker (PodWorker): The worker returned by acquire_worker.
+        """
+        self.idle_workers.put(worker)
+
+    def request_worker(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Send a request to an idle pod worker of the pool and yield its replies.
+        The worker goes back to the pool once every reply was read.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request, covering
+                the wait for an idle worker.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The replies.
+        """
+        pinned = getattr(self.local, "worker", None)
+        worker = pinned if pinned is not None else self.acquire_worker(deadline)
+        objects: List[str] = []
+        try:
+            for reply in worker.request(message, trace, deadline):
+                objects.extend(returned_objects(reply))
+                yield reply
+        finally:
+            if objects:
+                self.release_objects(worker, objects)
+            if pinned is None:
+                self.release_worker(worker)
+
+    def release_objects(self, worker: PodWorker, objects: List[str]) -> None:
+        """
+        Free the pod objects a worker returned by reference, which make_handle refuses.
+        Only the worker that stored them can free them, so it does before going back to the pool.
+
+        Args:
+            worker (PodWorker): The worker that returned the objects.
+            objects (List[str]): The IDs of the objects.
+        """
+        if not worker.is_alive():
+            return
+        try:
+            worker.call({"release": objects})
+        except PyPodError:
+            # The pod process is gone and its objects with it.
+            pass
+
+    def run_chunk(self, func_name: str, chunk: List[Any], star: bool) -> List[Any]:
+        """
+        Run a pod function over a chunk of items as one batch on a single pod worker.
+        The function's deadline also bounds the wait for an idle worker.
+
+        Args:
+            func_name (str): The name of the pod function.
+            chunk (List[Any]): The items of the chunk.
+            star (bool): Unpack each item into positional arguments.
+
+        Returns:
+            List[Any]: The function outputs in order.
+        """
+        worker = self.acquire_worker(self.call_deadline(func_name))
+        self.local.worker = worker
+        try:
+            with self.batch() as b:
+                function = getattr(b, func_name)
+                futures = [function(*item) if star else function(item) for item in chunk]
+        finally:
+            self.local.worker = None
+            self.release_worker(worker)
+        return [future.result() for future in futures]
+
+    def submit_chunks(
+        self, func_name: str, iterable: Iterable[Any], chunksize: int, star: bool, ordered: bool = True
+    ) -> Iterator[Future]:
+        """
+        Submit chunks of items to the pool's executor as earlier ones complete. Items are
+        read as they are needed, and at most CHUNKS_PER_WORKER chunks per pod worker are
+        in flight, so that a long or endless iterable is never read up front.
+
+        Args:
+            func_name (str): The name of the pod function.
+            iterable (Iterable[Any]): The items to process.
+            chunksize (int): Number of items sent to a worker at a time.
+            star (bool): Unpack each item into positional arguments.
+            ordered (bool): Yield the futures in the order of their chunks, rather than as
+                they complete.
+
+        Returns:
+            Iterator[Future]: One future per chunk. The chunks that were not started yet are
+            cancelled if the iterator is closed early.
+        """
+        if self.executor is None:
+            raise PyPodNotStartedError("Pod pool is not running, call load_pod() first!")
+        chunks = chunked(iterable, chunksize)
+        # Chunks inherit the caller's deadline() block.
+        context = contextvars.copy_context()
+        in_flight: Set[Future] = set()
+        order: Deque[Future] = deque()
+        try:
+            while True:
+                while len(in_flight) < self.size * CHUNKS_PER_WORKER:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    future = self.executor.submit(context.copy().run, self.run_chunk, func_name, chunk, star)
+                    in_flight.add(future)
+                    if ordered:
+                        order.append(future)
+                if not in_flight:
+                    return
+                if ordered:
+                    done = [order.popleft()]
+                else:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future
+                    in_flight.discard(future)
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def make_handle(self, reply: Dict[str, Any]) -> Any:
+        """
+        Pod objects cannot be returned by reference from a pool, since the calls on their
+        handle could go to any worker. request_worker already freed the object in the pod.
+        """
+        raise PyPodResponseError("Remote objects are not supported by pod pools, use a PodLoader in worker mode")
+
+    def create_a_function(self, func_name, *args, **kwargs) -> None:
+        """
+        Create the proxy function and attach map, starmap and imap_unordered helpers to it.
+
+        Args:
+            func_name: The name of the function to be created.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+        """
+        super().create_a_function(func_name, *args, **kwargs)
+        function = getattr(self.namespace[self.pod_name], func_name)
+
+        def map(iterable: Iterable[Any], chunksize: int = 1) -> List[Any]:
+            """Call the pod function on every item across the pool and return outputs in order."""
+            futures = self.submit_chunks(func_name, iterable, chunksize, star=False)
+            return [output for future in futures for output in future.result()]
+
+        def starmap(iterable: Iterable[Any], chunksize: int = 1) -> List[Any]:
+            """Like map, but each item is unpacked into positional arguments."""
+            futures = self.submit_chunks(func_name, iterable, chunksize, star=True)
+            return [output for future in futures for output in future.result()]
+
+        def imap_unordered(iterable: Iterable[Any], chunksize: int = 1) -> Iterator[Any]:
+            """Like map, but yield outputs as soon as their chunk completes."""
+            for future in self.submit_chunks(func_name, iterable, chunksize, star=False, ordered=False):
+                yield from future.result()
+
+        function.map = map
+        function.starmap = starmap
+        function.imap_unordered = imap_unordered
@@ -0,0 +1,378 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import collections
+import cProfile
+import inspect
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Counter, Dict, Iterator, Optional, Sequence, Tuple
+
+PROFILERS = ("cprofile", "sampling")
+DEFAULT_PROFILER = "cprofile"
+# Seconds between two stack samples of the sampling profiler.
+DEFAULT_INTERVAL = 0.005
+
+# A function in pstats terms: (filename, first line, name).
+Function = Tuple[str, int, str]
+# The statistics of a function in pstats terms: (primitive calls, calls, own time,
+# cumulative time, and the same four numbers per caller).
+FunctionStats = Tuple[int, int, float, float, Dict[Function, Tuple[int, int, float, float]]]
+
+# cProfile cannot profile two calls of the same pod process at once.
+PROFILE_LOCK = threading.Lock()
+
+
+def check_settings(profiler: str, interval: float) -> None:
+    """
+    Validate the settings of a profile.
+
+    Args:
+        profiler (str): One of PROFILERS.
+        interval (float): Seconds between two stack samples of the sampling profiler.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"profiler: {profiler} should be one of {PROFILERS}")
+    if not isinstance(interval, (int, float)) or interval <= 0:
+        raise ValueError("interval must be a positive number of seconds")
+
+
+class CallProfiler:
+    """
+    Profiles one pod function call in the pod process, if the client asked for it.
+
+    "cprofile" runs the call under cProfile, which records the thread that starts the
+    profiler. "sampling" records the stacks of the given threads every interval seconds
+    from a background thread, so it also sees the pod's event loop running an async def
+    function and its overhead does not depend on the number of function calls.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]], threads: Sequence[int] = ()) -> None:
+        """
+        Initialize the profiler of a call.
+
+        Args:
+            settings (Optional[Dict[str, Any]]): The "profile" of the request, holding the
+                "profiler" and its "interval". None leaves the call unprofiled.
+            threads (Sequence[int]): Identifiers of the threads the sampling profiler records,
+                defaults to the thread that starts the profiler.
+        """
+        self.settings = settings
+        self.threads = list(threads)
+        self.profile: Optional[cProfile.Profile] = None
+        self.sampler: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.samples: Counter[Tuple[Function, ...]] = collections.Counter()
+        # Seconds sampled per stack. Samples are often late, e.g. while the profiled thread
+        # holds the GIL, so each one weighs the time elapsed since the previous one.
+        self.seconds: Counter[Tuple[Function, ...]] = collections.Counter()
+        self.result: Optional[Dict[str, Any]] = None
+
+    def __enter__(self) -> "CallProfiler":
+        if self.settings:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self.profile is not None or self.sampler is not None:
+            self.result = self.stop()
+
+    def start(self) -> None:
+        """
+        Start profiling.
+        """
+        profiler = self.settings.get("profiler", DEFAULT_PROFILER)
+        interval = self.settings.get("interval", DEFAULT_INTERVAL)
+        check_settings(profiler, interval)
+        if profiler == "cprofile":
+            PROFILE_LOCK.acquire()
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+            except BaseException:
+                PROFILE_LOCK.release()
+                raise
+            self.profile = profile
+            return
+        if not self.threads:
+            self.threads = [threading.get_ident()]
+        self.sampler = threading.Thread(target=self.sample, args=(interval,), name="pypods-sampler", daemon=True)
+        self.sampler.start()
+
+    def sample(self, interval: float) -> None:
+        """
+        Record the stacks of the profiled threads until the profiler stops.
+        """
+        last = time.perf_counter()
+        while not self.stopped.wait(interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for thread in self.threads:
+                frame = frames.get(thread)
+                if frame is not None:
+                    stack = frame_stack(frame)
+                    self.samples[stack] += 1
+                    self.seconds[stack] += now - last
+            last = now
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        Stop profiling.
+
+        Returns:
+            Dict[str, Any]: The profile sent back in the reply, see PodProfile.add().
+        """
+        if self.profile is not None:
+            try:
+                self.profile.disable()
+                self.profile.create_stats()
+            finally:
+                PROFILE_LOCK.release()
+            stats = [
+                [*function, cc, nc, tt, ct, [[*caller, *numbers] for caller, numbers in callers.items()]]
+                for function, (cc, nc, tt, ct, callers) in self.profile.stats.items()
+            ]
+            self.profile = None
+            return {"profiler": "cprofile", "stats": stats}
+        self.stopped.set()
+        self.sampler.join()
+        self.sampler = None
+        samples = [
+            [[list(function) for function in stack], count, self.seconds[stack]] for stack, count in self.samples.items()
+        ]
+        return {"profiler": "sampling", "samples": samples}
+
+    def attach(self, reply: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add the profile of the call to its reply. Streams are not profiled, their items are
+        produced after the reply.
+
+        Args:
+            reply (Dict[str, Any]): The reply.
+
+        Returns:
+            Dict[str, Any]: The reply, with a "profile" if the client asked for one.
+        """
+        if self.result is not None and not inspect.isgenerator(reply.get("response")):
+            reply["profile"] = self.result
+        return reply
+
+
+def frame_stack(frame: Any) -> Tuple[Function, ...]:
+    """
+    The functions of a stack, from the outermost one to the running one.
+
+    Args:
+        frame (Any): The running frame.
+
+    Returns:
+        Tuple[Function, ...]: The functions in pstats terms.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+class StatsSource:
+    """
+    Hands a copy of the statistics of a PodProfile to pstats.Stats, which empties its source.
+    """
+
+    def __init__(self, stats: Dict[Function, FunctionStats]) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class PodProfile:
+    """
+    The profiles of pod function calls, aggregated on the client.
+
+    Every call made with the profile active sends its profiler settings with the request,
+    and the pod sends the profile of the call back in its reply. The aggregated profile is
+    available as a pstats.Stats object, as a file for pstats and profile viewers, and for
+    the sampling profiler as collapsed stacks for flame graph tools.
+    """
+
+    def __init__(self, profiler: str = DEFAULT_PROFILER, interval: float = DEFAULT_INTERVAL) -> None:
+        """
+        Initialize an empty profile.
+
+        Args:
+            profiler (str): "cprofile" profiles every function call of the pod function,
+                "sampling" samples its stack every interval seconds.
+            interval (float): Seconds between two stack samples of the sampling profiler.
+        """
+        check_settings(profiler, interval)
+        self.profiler = profiler
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.functions: Dict[Function, FunctionStats] = {}
+        self.samples: Counter[Tuple[Function, ...]] = collections.Counter()
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """
+        The profiler settings sent with every profiled request.
+        """
+        return {"profiler": self.profiler, "interval": self.interval}
+
+    def collect(self, reply: Dict[str, Any]) -> None:
+        """
+        Take the profile out of a pod reply and add it.
+
+        Args:
+            reply (Dict[str, Any]): The reply.
+        """
+        if "profile" in reply:
+            self.add(reply.pop("profile"))
+
+    def add(self, profile: Dict[str, Any]) -> None:
+        """
+        Add the profile of one pod function call.
+
+        Args:
+            profile (Dict[str, Any]): The profile built by CallProfiler.stop().
+        """
+        with self.lock:
+            self.calls += 1
+            if profile.get("profiler") == "cprofile":
+                for *function, cc, nc, tt, ct, callers in profile["stats"]:
+                    self.add_function(
+                        tuple(function), cc, nc, tt, ct, {tuple(c[:3]): tuple(c[3:]) for c in callers}
+                    )
+                return
+            for stack, count, seconds in profile.get("samples", []):
+                stack = tuple(tuple(function) for function in stack)
+                self.samples[stack] += count
+                self.add_samples(stack, seconds, count)
+
+    def add_function(
+        self,
+        function: Function,
+        cc: int,
+        nc: int,
+        tt: float,
+        ct: float,
+        callers: Dict[Function, Tuple[int, int, float, float]],
+    ) -> None:
+        """
+        Add the statistics of a function, as pstats.Stats.add() does.
+        """
+        old_cc, old_nc, old_tt, old_ct, old_callers = self.functions.get(function, (0, 0, 0.0, 0.0, {}))
+        merged = dict(old_callers)
+        for caller, numbers in callers.items():
+            previous = merged.get(caller, (0, 0, 0.0, 0.0))
+            merged[caller] = tuple(a + b for a, b in zip(previous, numbers))
+        self.functions[function] = (old_cc + cc, old_nc + nc, old_tt + tt, old_ct + ct, merged)
+
+    def add_samples(self, stack: Tuple[Function, ...], seconds: float, count: int) -> None:
+        """
+        Add the statistics of a sampled stack. Every sample counts as one call of each
+        function of the stack, the running function gets its time as own time.
+        """
+        seen = set()
+        for depth, function in enumerate(stack):
+            caller = stack[depth - 1] if depth > 0 else None
+            own = seconds if depth == len(stack) - 1 else 0.0
+            # A recursive function only counts the time of a stack once.
+            total = seconds if function not in seen else 0.0
+            seen.add(function)
+            callers = {caller: (count, count, own, total)} if caller is not None else {}
+            self.add_function(function, count, count, own, total, callers)
+
+    def stats(self) -> pstats.Stats:
+        """
+        The aggregated profile as pstats statistics:
+
+            profile.stats().sort_stats("cumulative").print_stats(20)
+
+        Returns:
+            pstats.Stats: The statistics.
+        """
+        with self.lock:
+            functions = dict(self.functions)
+        if not functions:
+            raise ValueError("No pod call was profiled")
+        return pstats.Stats(StatsSource(functions))
+
+    def dump(self, path: str) -> None:
+        """
+        Write the aggregated profile to a file in the format of cProfile's dump_stats(),
+        which pstats.Stats(path) and profile viewers such as snakeviz read.
+
+        Args:
+            path (str): Path of the file.
+        """
+        stats = self.stats().stats
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, mode="wb") as f:
+            marshal.dump(stats, f)
+
+    def collapsed(self) -> str:
+        """
+        The aggregated stack samples in the collapsed format of flame graph tools, e.g.
+        flamegraph.pl or speedscope: one "outer;...;running count" line per stack.
+
+        Returns:
+            str: The collapsed stacks.
+        """
+        if self.profiler != "sampling":
+            raise ValueError("Collapsed stacks require the sampling profiler")
+        with self.lock:
+            samples = list(self.samples.items())
+        lines = [";".join(frame_label(function) for function in stack) + f" {count}" for stack, count in samples]
+        return "\n".join(sorted(lines)) + ("\n" if lines else "")
+
+
+def frame_label(function: Function) -> str:
+    """
+    The label of a function in collapsed stacks, e.g. "predict (model.py:12)".
+
+    Args:
+        function (Function): The function in pstats terms.
+
+    Returns:
+        str: The label.
+    """
+    filename, line, name = function
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+
+
+CURRENT_PROFILE: ContextVar[Optional[PodProfile]] = ContextVar("pypods_profile", default=None)
+
+
+@contextmanager
+def profile(profiler: str = DEFAULT_PROFILER, interval: float = DEFAULT_INTERVAL) -> Iterator[PodProfile]:
+    """
+    Profile every pod call made in the block, from this thread or asyncio task, in the pod
+    processes running them:
+
+        with profile() as p:
+            hello_world_pod.foo()
+        p.stats().sort_stats("cumulative").print_stats(20)
+
+    Args:
+        profiler (str): "cprofile" or "sampling", see PodProfile.
+        interval (float): Seconds between two stack samples of the sampling profiler.
+    """
+    scope = CURRENT_PROFILE.set(PodProfile(profiler, interval))
+    try:
+        yield CURRENT_PROFILE.get()
+    finally:
+        CURRENT_PROFILE.reset(scope)
@@ -0,0 +1,68 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import struct
+from typing import BinaryIO, Optional, Sequence, Union
+
+# Every message exchanged with a long-lived pod is prefixed by its length
+# as an unsigned 32-bit little endian integer.
+FRAME_HEADER = struct.Struct("<I")
+
+
+def write_frame(stream: BinaryIO, payload: Union[bytes, Sequence[bytes]]) -> None:
+    """
+    Write a single length-prefixed frame to a binary stream.
+
+    Args:
+        stream (BinaryIO): The stream to write the frame to.
+        payload (Union[bytes, Sequence[bytes]]): The serialized message, or a list of
+            bytes-like buffers that are written back to back without being joined.
+    """
+    buffers = [payload] if isinstance(payload, (bytes, bytearray, memoryview)) else payload
+    stream.write(FRAME_HEADER.pack(sum(memoryview(b).nbytes for b in buffers)))
+    for buffer in buffers:
+        stream.write(buffer)
+    stream.flush()
+
+
+def read_exactly(stream: BinaryIO, size: int) -> Optional[bytes]:
+    """
+    Read exactly size bytes from a binary stream.
+
+    Args:
+        stream (BinaryIO): The stream to read from.
+        size (int): The number of bytes to read.
+
+    Returns:
+        Optional[bytes]: The bytes read, or None if the stream ended first.
+    """
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    """
+    Read a single length-prefixed frame from a binary stream.
+
+    Args:
+        stream (BinaryIO): The stream to read the frame from.
+
+    Returns:
+        Optional[bytes]: The frame payload, or None if the stream is closed.
+    """
+    header = read_exactly(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    payload = read_exactly(stream, size)
+    if payload is None:
+        raise EOFError("Stream closed in the middle of a frame")
+    return payload
@@ -0,0 +1,583 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import venv
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists, isdir, join
+from subprocess import PIPE, run
+from typing import Dict, List, Optional, Sequence
+
+from pypods.errors import PyPodNotFound, PyPodProvisionError
+from pypods.ns import PODS_CONFIG, PODS_DIRECTORY, PODS_STATE
+
+VENV_BIN = "Scripts" if os.name == 'nt' else "bin"
+# Records the requirements a pod's venv was provisioned from.
+STAMP_FILE = "requirements.sha256"
+# Wheels shared by every pod of the project.
+WHEELHOUSE_DIRECTORY = join(PODS_DIRECTORY, PODS_STATE, "wheelhouse")
+# Installed wheels shared by the pods provisioned in layered mode, one directory per wheel.
+LAYERS_DIRECTORY = join(PODS_DIRECTORY, PODS_STATE, "layers")
+# Adds a layered pod's layers to the sys.path of its venv.
+LAYERS_PTH = "pypods_layers.pth"
+# Records the packages installed for the pod's requirements, see sync_pod().
+LOCK_FILE = "requirements.lock"
+# Packages of a bare venv, never removed by sync_pod().
+VENV_PACKAGES = ("pip", "setuptools", "wheel")
+# Run by the pod's interpreter: prints the installed packages as {name: version}, only those
+# the requirement strings in argv depend on if any. Markers are evaluated with pip's vendored
+# packaging, which every pod venv has. Exits with 1 if a requirement is not installed.
+PACKAGES_SCRIPT = """
+import json, sys
+from importlib import metadata
+from pip._vendor.packaging.requirements import Requirement
+from pip._vendor.packaging.utils import canonicalize_name
+
+installed = {}
+for dist in metadata.distributions():
+    installed.setdefault(canonicalize_name(dist.metadata["Name"]), dist)
+if len(sys.argv) == 1:
+    names = set(installed)
+else:
+    names, pending = set(), [(Requirement(r), "") for r in sys.argv[1:]]
+    while pending:
+        requirement, extra = pending.pop()
+        if requirement.marker is not None and not requirement.marker.evaluate({"extra": extra}):
+            continue
+        name = canonicalize_name(requirement.name)
+        if name not in installed:
+            sys.exit(1)
+        if name in names and not requirement.extras:
+            continue
+        names.add(name)
+        for line in installed[name].requires or []:
+            pending += [(Requirement(line), e) for e in [""] + sorted(requirement.extras)]
+print(json.dumps({name: installed[name].version for name in sorted(names)}))
+"""
+
+
+def pod_path(pod_name: str) -> str:
+    """
+    Directory of a pod.
+    """
+    return join(PODS_DIRECTORY, pod_name)
+
+
+def pod_pip(pod_name: str) -> str:
+    """
+    Path to pip inside the pod's virtual environment.
+    """
+    return join(pod_path(pod_name), "venv", VENV_BIN, "pip")
+
+
+def pod_python(pod_name: str) -> str:
+    """
+    Path to the python interpreter inside the pod's virtual environment.
+    """
+    return join(pod_path(pod_name), "venv", VENV_BIN, "python")
+
+
+def venv_site_packages(pod_name: str) -> str:
+    """
+    Path to the site-packages directory of the pod's virtual environment.
+    """
+    if os.name == "nt":
+        return join(pod_path(pod_name), "venv", "Lib", "site-packages")
+    python = f"python{sys.version_info.major}.{sys.version_info.minor}"
+    return join(pod_path(pod_name), "venv", "lib", python, "site-packages")
+
+
+def layers_pth(pod_name: str) -> str:
+    """
+    Path of the .pth file listing the layers of a layered pod.
+    """
+    return join(venv_site_packages(pod_name), LAYERS_PTH)
+
+
+def is_layered(pod_name: str) -> bool:
+    """
+    Check if the pod's venv was provisioned in layered mode.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        bool: True if the pod's packages are installed in shared layers.
+    """
+    return exists(layers_pth(pod_name))
+
+
+def list_pods() -> List[str]:
+    """
+    Find every pod of the project.
+
+    Returns:
+        List[str]: The names of the directories of PODS_DIRECTORY holding a pod.py, sorted.
+    """
+    if not isdir(PODS_DIRECTORY):
+        return []
+    return sorted(
+        name for name in os.listdir(PODS_DIRECTORY)
+        if name.isidentifier() and exists(join(PODS_DIRECTORY, name, f"{PODS_CONFIG}.py"))
+    )
+
+
+def requirements_fingerprint(pod_name: str) -> str:
+    """
+    Fingerprint of what a pod's venv is built from: its requirements.txt and the
+    version of the interpreter the venv is created with.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+    req_file = join(pod_path(pod_name), "requirements.txt")
+    if not exists(req_file):
+        raise PyPodNotFound(f"Pod {pod_name} has no requirements.txt")
+    digest = hashlib.sha256(sys.version.encode())
+    with open(req_file, mode="rb") as r:
+        digest.update(r.read())
+    return digest.hexdigest()
+
+
+def stamp_path(pod_name: str) -> str:
+    """
+    Path of the pod's requirements stamp.
+    """
+    return join(pod_path(pod_name), PODS_STATE, STAMP_FILE)
+
+
+def write_stamp(pod_name: str) -> None:
+    """
+    Record that the pod's venv matches its current requirements.txt.
+
+    Args:
+        pod_name (str): The name of the pod.
+    """
+    path = stamp_path(pod_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as s:
+        s.write(requirements_fingerprint(pod_name))
+
+
+def is_provisioned(pod_name: str) -> bool:
+    """
+    Check if the pod's venv exists and was provisioned from its current requirements.txt.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        bool: True if the pod does not need to be provisioned again.
+    """
+    if not exists(pod_pip(pod_name)) or not exists(stamp_path(pod_name)):
+        return False
+    with open(stamp_path(pod_name)) as s:
+        return s.read().strip() == requirements_fingerprint(pod_name)
+
+
+def run_pip(pod_name: str, args: List[str]) -> None:
+    """
+    Run the pod's pip, raising PyPodProvisionError with its output if it fails.
+
+    Args:
+        pod_name (str): The name of the pod.
+        args (List[str]): The pip arguments.
+    """
+    result = run(
+        [pod_pip(pod_name), "--disable-pip-version-check", *args], stdout=PIPE, stderr=PIPE
+    )
+    if result.returncode != 0:
+        output = (result.stderr or result.stdout).decode(errors="replace").strip()
+        raise PyPodProvisionError(f"pip {args[0]} failed for pod {pod_name}: {output}")
+
+
+def create_venv(pod_name: str, layered: bool = False) -> None:
+    """
+    Create the pod's venv if it does not exist yet.
+
+    Args:
+        pod_name (str): The name of the pod.
+        layered (bool): The venv is about to be provisioned in layered mode. A venv that
+            holds a regular install is recreated, so its packages do not shadow the layers.
+    """
+    if layered and exists(pod_pip(pod_name)) and not is_layered(pod_name):
+        shutil.rmtree(join(pod_path(pod_name), "venv"))
+    if not exists(pod_pip(pod_name)):
+        venv.create(join(pod_path(pod_name), "venv"), with_pip=True)
+
+
+def build_wheels(pod_name: str, wheelhouse: str) -> None:
+    """
+    Download or build the wheels of the pod's requirements into the wheelhouse.
+    Wheels that are already in the wheelhouse are reused.
+
+    Args:
+        pod_name (str): The name of the pod.
+        wheelhouse (str): The shared wheel directory.
+    """
+    req_file = join(pod_path(pod_name), "requirements.txt")
+    run_pip(pod_name, ["wheel", "-q", "--find-links", wheelhouse, "-w", wheelhouse, "-r", req_file])
+
+
+def install_requirements(
+    pod_name: str, wheelhouse: Optional[str] = None, layered: Optional[bool] = None
+) -> None:
+    """
+    Install the pod's requirements into its venv and stamp it.
+
+    Args:
+        pod_name (str): The name of the pod.
+        wheelhouse (Optional[str]): Install only from this wheel directory, without using
+            a package index. None installs from the index.
+        layered (Optional[bool]): Install the requirements into layers shared with other pods,
+            see install_layers(). None keeps the mode the pod was provisioned in.
+    """
+    if layered is None:
+        layered = is_layered(pod_name)
+    if layered:
+        install_layers(pod_name, wheelhouse)
+        # Layers are shared, so sync_pod() must never uninstall from them.
+        if exists(lock_path(pod_name)):
+            os.remove(lock_path(pod_name))
+    else:
+        if is_layered(pod_name):
+            os.remove(layers_pth(pod_name))
+        req_file = join(pod_path(pod_name), "requirements.txt")
+        sources = ["--no-index", "--find-links", wheelhouse] if wheelhouse else []
+        run_pip(pod_name, ["install", "-q", *sources, "-r", req_file])
+        write_lock(pod_name)
+    write_stamp(pod_name)
+
+
+def lock_path(pod_name: str) -> str:
+    """
+    Path of the pod's requirements lock.
+    """
+    return join(pod_path(pod_name), PODS_STATE, LOCK_FILE)
+
+
+def read_requirements(pod_name: str) -> Optional[List[str]]:
+    """
+    Read the requirement strings of the pod's requirements.txt.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        Optional[List[str]]: The requirements, None if some lines are not plain requirements
+        (options, includes, URLs or paths), whose packages cannot be told from the file.
+    """
+    requirements = []
+    with open(join(pod_path(pod_name), "requirements.txt")) as r:
+        for line in r:
+            line = line.split(" #", 1)[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("-") or "://" in line or "/" in line.split(";", 1)[0] or " @ " in line:
+                return None
+            requirements.append(line)
+    return requirements
+
+
+def installed_packages(pod_name: str, requirements: Optional[List[str]] = None) -> Optional[Dict[str, str]]:
+    """
+    List the packages installed in the pod's venv.
+
+    Args:
+        pod_name (str): The name of the pod.
+        requirements (Optional[List[str]]): Only list these requirements and their dependencies.
+
+    Returns:
+        Optional[Dict[str, str]]: The version of every package by normalized name, None if
+        a requirement is not installed.
+    """
+    result = run([pod_python(pod_name), "-c", PACKAGES_SCRIPT, *(requirements or [])], stdout=PIPE, stderr=PIPE)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout)
+
+
+def write_lock(pod_name: str) -> None:
+    """
+    Record the packages installed for the pod's requirements, or forget them if they
+    cannot be determined, so that sync_pod() never removes packages it did not install.
+
+    Args:
+        pod_name (str): The name of the pod.
+    """
+    requirements = read_requirements(pod_name)
+    packages: Optional[Dict[str, str]] = {}
+    if requirements != []:
+        packages = installed_packages(pod_name, requirements) if requirements else None
+    path = lock_path(pod_name)
+    if packages is None:
+        if exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as lock:
+        lock.writelines(f"{name}=={version}\n" for name, version in packages.items())
+
+
+def read_lock(pod_name: str) -> Optional[Dict[str, str]]:
+    """
+    Read the packages recorded by write_lock().
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        Optional[Dict[str, str]]: The version of every package by normalized name, None if
+        there is no lock.
+    """
+    if not exists(lock_path(pod_name)):
+        return None
+    with open(lock_path(pod_name)) as lock:
+        return dict(line.strip().split("==", 1) for line in lock if "==" in line)
+
+
+def sync_pod(
+    pod_name: str, wheelhouse: Optional[str] = None, layered: Optional[bool] = None, force: bool = False
+) -> Dict[str, List[str]]:
+    """
+    Bring the pod's venv in line with its requirements.txt, changing only what changed.
+
+    When the requirements match the pod's stamp nothing is run at all, which only costs
+    hashing requirements.txt. Otherwise pip installs the requirements, which skips the
+    packages that are already satisfied, and the packages recorded in the pod's lock that
+    the new requirements no longer need are uninstalled. Packages installed by hand, or
+    before the pod had a lock, are never removed.
+
+    Args:
+        pod_name (str): The name of the pod.
+        wheelhouse (Optional[str]): Install only from this wheel directory, without using
+            a package index. None installs from the index.
+        layered (Optional[bool]): Install the requirements into layers shared with other pods,
+            see install_layers(). None keeps the mode the pod was provisioned in.
+        force (bool): Sync the pod even if its stamp is up to date.
+
+    Returns:
+        Dict[str, List[str]]: The packages that were "installed" (as name==version, including
+        upgrades and downgrades) and "removed", both empty if the pod was up to date.
+    """
+    changes: Dict[str, List[str]] = {"installed": [], "removed": []}
+    if not force and is_provisioned(pod_name) and layered in (None, is_layered(pod_name)):
+        return changes
+    create_venv(pod_name, bool(layered))
+    before = installed_packages(pod_name) or {}
+    locked = read_lock(pod_name) or {}
+    install_requirements(pod_name, wheelhouse, layered)
+    required = read_lock(pod_name)
+    if required is not None and not is_layered(pod_name):
+        unused = sorted(name for name in locked if name not in required and name in before)
+        unused = [name for name in unused if name not in VENV_PACKAGES]
+        if unused:
+            try:
+                run_pip(pod_name, ["uninstall", "-y", "-q", *unused])
+            except PyPodProvisionError:
+                # Try again on the next sync.
+                os.remove(stamp_path(pod_name))
+                raise
+    after = installed_packages(pod_name) or {}
+    changes["installed"] = [f"{name}=={version}" for name, version in after.items() if before.get(name) != version]
+    changes["removed"] = sorted(name for name in before if name not in after)
+    return changes
+
+
+def install_layers(pod_name: str, wheelhouse: Optional[str] = None, layers: str = LAYERS_DIRECTORY) -> None:
+    """
+    Install the pod's requirements as layers shared with other pods.
+
+    The pod's requirements are resolved on their own, as for a regular install, into a
+    set of wheels. Every wheel is installed once into a layer directory named after the
+    hash of its content, and the pod's venv gets a .pth file adding its layers to sys.path.
+    Pods that pin the same version of a package share one copy of it on disk and in the
+    page cache, while pods that need other versions get other layers.
+
+    Args:
+        pod_name (str): The name of the pod.
+        wheelhouse (Optional[str]): Resolve only from this wheel directory, without using
+            a package index. None resolves from the index.
+        layers (str): The shared layer directory.
+    """
+    req_file = join(pod_path(pod_name), "requirements.txt")
+    sources = ["--no-index", "--find-links", wheelhouse] if wheelhouse else []
+    os.makedirs(layers, exist_ok=True)
+    with tempfile.TemporaryDirectory() as wheels:
+        run_pip(pod_name, ["wheel", "-q", *sources, "-w", wheels, "-r", req_file])
+        paths = [
+            install_layer(pod_name, join(wheels, name), layers)
+            for name in sorted(os.listdir(wheels))
+            if name.endswith(".whl")
+        ]
+    # site.addsitedir also processes the .pth files that packages ship in their layer.
+    with open(layers_pth(pod_name), mode="w") as pth:
+        for path in paths:
+            pth.write(f"import site; site.addsitedir({os.path.abspath(path)!r})\n")
+
+
+def read_layers(pod_name: str) -> List[str]:
+    """
+    List the layers of a pod provisioned in layered mode.
+
+    Args:
+        pod_name (str): The name of the pod.
+
+    Returns:
+        List[str]: The layer directories, empty if the pod is not layered.
+    """
+    if not is_layered(pod_name):
+        return []
+    with open(layers_pth(pod_name)) as pth:
+        return [
+            ast.literal_eval(line.partition("addsitedir(")[2].rpartition(")")[0])
+            for line in pth
+            if "addsitedir(" in line
+        ]
+
+
+def install_layer(pod_name: str, wheel: str, layers: str) -> str:
+    """
+    Install a wheel into its layer unless the layer already exists.
+
+    Args:
+        pod_name (str): The name of the pod whose pip installs the wheel.
+        wheel (str): Path to the wheel.
+        layers (str): The shared layer directory.
+
+    Returns:
+        str: The layer directory.
+    """
+    digest = hashlib.sha256()
+    with open(wheel, mode="rb") as w:
+        for chunk in iter(lambda: w.read(1 << 20), b""):
+            digest.update(chunk)
+    layer = join(layers, f"{os.path.basename(wheel)[:-len('.whl')]}-{digest.hexdigest()[:16]}")
+    if isdir(layer):
+        return layer
+    # Layers are installed aside and renamed into place, so a layer is either complete or absent.
+    staging = f"{layer}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        run_pip(pod_name, ["install", "-q", "--no-deps", "--no-index", "--target", staging, wheel])
+        os.rename(staging, layer)
+    except OSError:
+        # Another pod installed the same layer concurrently.
+        if not isdir(layer):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return layer
+
+
+def remove_unused_layers(layers: str = LAYERS_DIRECTORY) -> List[str]:
+    """
+    Delete the layers that no pod of the project uses anymore.
+
+    Args:
+        layers (str): The shared layer directory.
+
+    Returns:
+        List[str]: The names of the deleted layers.
+    """
+    if not isdir(layers):
+        return []
+    used = {os.path.basename(path) for pod_name in list_pods() for path in read_layers(pod_name)}
+    removed = []
+    for name in sorted(os.listdir(layers)):
+        if name not in used and ".tmp-" not in name:
+            shutil.rmtree(join(layers, name))
+            removed.append(name)
+    return removed
+
+
+def provision_pods(
+    pod_names: Sequence[str],
+    jobs: int = 4,
+    wheelhouse: str = WHEELHOUSE_DIRECTORY,
+    offline: bool = False,
+    force: bool = False,
+    layered: Optional[bool] = None,
+) -> Dict[str, str]:
+    """
+    Provision the venvs of many pods at once.
+
+    Pods whose venv was provisioned from their current requirements.txt are skipped.
+    The others are provisioned in three steps:
+        1. Their venvs are created concurrently.
+        2. The wheels of every distinct requirements.txt are downloaded or built into one
+           wheelhouse shared by all pods, so nothing is fetched or built twice. This step
+           is skipped when offline.
+        3. Their requirements are synced concurrently from the wheelhouse only, see sync_pod().
+
+    Args:
+        pod_names (Sequence[str]): The pods to provision.
+        jobs (int): Number of pods provisioned concurrently.
+        wheelhouse (str): The shared wheel directory.
+        offline (bool): Never contact a package index, install from the wheelhouse only.
+        force (bool): Provision pods even if their stamp is up to date.
+        layered (Optional[bool]): Install the pods' packages into layers shared between
+            pods (True) or into each venv (False), see install_layers(). Pods provisioned
+            in another mode are provisioned again. None keeps the mode of every pod.
+
+    Returns:
+        Dict[str, str]: The outcome of every pod: "skipped", "provisioned" or the error message.
+    """
+    if jobs < 1:
+        raise ValueError("jobs must be a positive integer")
+    if offline and not isdir(wheelhouse):
+        raise PyPodProvisionError(f"Wheelhouse {wheelhouse} does not exist, cannot provision offline")
+    results = {}
+    stale = []
+    for pod_name in pod_names:
+        if not exists(join(pod_path(pod_name), f"{PODS_CONFIG}.py")):
+            results[pod_name] = f"Pod {pod_name} does not exist"
+        elif not force and is_provisioned(pod_name) and layered in (None, is_layered(pod_name)):
+            results[pod_name] = "skipped"
+        else:
+            stale.append(pod_name)
+    os.makedirs(wheelhouse, exist_ok=True)
+
+    def failed(pod_name: str, e: Exception) -> None:
+        results[pod_name] = str(e)
+        stale.remove(pod_name)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for pod_name, future in [(p, executor.submit(create_venv, p, bool(layered))) for p in stale]:
+            try:
+                future.result()
+            except Exception as e:
+                failed(pod_name, e)
+
+        if not offline:
+            built = set()
+            for pod_name in list(stale):
+                fingerprint = requirements_fingerprint(pod_name)
+                if fingerprint in built:
+                    continue
+                try:
+                    build_wheels(pod_name, wheelhouse)
+                    built.add(fingerprint)
+                except Exception as e:
+                    failed(pod_name, e)
+
+        for pod_name, future in [
+            (p, executor.submit(sync_pod, p, wheelhouse, layered, True)) for p in stale
+        ]:
+            try:
+                future.result()
+                results[pod_name] = "provisioned"
+            except Exception as e:
+                failed(pod_name, e)
+    return {pod_name: results[pod_name] for pod_name in pod_names}
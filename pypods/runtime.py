@@ -0,0 +1,224 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Iterator, List, Optional, Set
+
+# Set on the pod functions that may run on several threads at once.
+THREADSAFE_ATTRIBUTE = "__pypods_threadsafe__"
+
+
+def threadsafe(function: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Mark a pod function as safe to run on several threads at once. When the client
+    multiplexes calls over a worker, the calls of such a function overlap on the
+    worker's threads, while other functions run one call at a time:
+
+        @threadsafe
+        def fetch(url):
+            return requests.get(url).text
+
+    Args:
+        function (Callable[..., Any]): The pod function.
+
+    Returns:
+        Callable[..., Any]: The same function.
+    """
+    setattr(function, THREADSAFE_ATTRIBUTE, True)
+    return function
+
+
+def is_threadsafe(function: Any) -> bool:
+    """
+    Check if a pod function was marked with threadsafe.
+
+    Args:
+        function (Any): The pod function.
+
+    Returns:
+        bool: True if the function may run on several threads at once.
+    """
+    return getattr(function, THREADSAFE_ATTRIBUTE, False) is True
+
+
+def is_async(function: Any) -> bool:
+    """
+    Check if a pod function is an async def function or an async generator function.
+
+    Args:
+        function (Any): The pod function.
+
+    Returns:
+        bool: True if calling the function returns a coroutine or an async generator.
+    """
+    return inspect.iscoroutinefunction(function) or inspect.isasyncgenfunction(function)
+
+
+def overlapping_functions(namespace: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    The names of the pod functions whose calls do not run on the single thread of a
+    PodRuntime, so that a client can tell which of its calls would hold up the others.
+
+    Args:
+        namespace (Dict[str, Any]): The pod module's global namespace.
+
+    Returns:
+        Dict[str, List[str]]: The names of the functions marked with threadsafe under
+        "threadsafe", and of the async def functions under "async".
+    """
+    return {
+        "threadsafe": sorted(name for name, value in namespace.items() if is_threadsafe(value)),
+        "async": sorted(name for name, value in namespace.items() if is_async(value)),
+    }
+
+
+class PodRuntime:
+    """
+    Runs the calls of a pod process.
+
+    async def functions run on an event loop of the pod, so any number of them can wait
+    on I/O at once without holding a thread. Functions marked with threadsafe run on a
+    pool of threads, and every other function runs on a single thread, one call at a
+    time and in order, as it would in a worker that serves one call at a time. The event
+    loop and the threads are started on first use.
+    """
+
+    def __init__(self, threads: int = 1) -> None:
+        """
+        Initialize the runtime.
+
+        Args:
+            threads (int): Threads running the calls of threadsafe functions at once.
+        """
+        if threads < 1:
+            raise ValueError("threads must be a positive integer")
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[threading.Thread] = None
+        self.pool: Optional[ThreadPoolExecutor] = None
+        self.serial: Optional[ThreadPoolExecutor] = None
+        # The async calls scheduled on the event loop that did not finish yet.
+        self.tasks: Set[Future] = set()
+
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The event loop of the pod, running on its own thread.
+
+        Returns:
+            asyncio.AbstractEventLoop: The event loop.
+        """
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="pypods-event-loop", daemon=True)
+                thread.start()
+                self.loop, self.loop_thread = loop, thread
+            return self.loop
+
+    def loop_thread_id(self) -> int:
+        """
+        The identifier of the event loop's thread, e.g. for a profiler to sample it.
+
+        Returns:
+            int: The thread identifier.
+        """
+        self.event_loop()
+        return self.loop_thread.ident
+
+    def run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """
+        Run a coroutine on the event loop and wait for its result. It must not be called
+        from the event loop's thread.
+
+        Args:
+            coroutine (Coroutine[Any, Any, Any]): The coroutine, e.g. returned by an async
+                def pod function.
+
+        Returns:
+            Any: The result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.event_loop()).result()
+
+    def iterate(self, generator: AsyncIterator[Any]) -> Iterator[Any]:
+        """
+        Iterate over an async generator from a thread other than the event loop's.
+
+        Args:
+            generator (AsyncIterator[Any]): The async generator, e.g. returned by an async
+                generator pod function.
+
+        Returns:
+            Iterator[Any]: A generator yielding the items of the async generator.
+        """
+        try:
+            while True:
+                try:
+                    yield self.run(generator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(generator.aclose())
+
+    def spawn(self, coroutine: Coroutine[Any, Any, Any]) -> None:
+        """
+        Schedule a coroutine on the event loop without waiting for it.
+
+        Args:
+            coroutine (Coroutine[Any, Any, Any]): The coroutine.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.event_loop())
+        with self.lock:
+            self.tasks.add(future)
+        future.add_done_callback(self.forget)
+
+    def forget(self, future: Future) -> None:
+        """
+        Drop a finished async call.
+        """
+        with self.lock:
+            self.tasks.discard(future)
+
+    def submit(self, threadsafe: bool, function: Callable[..., Any], *args: Any) -> Future:
+        """
+        Run a call on the thread pool, or on the single thread of the other calls.
+
+        Args:
+            threadsafe (bool): Whether the call may overlap with other calls.
+            function (Callable[..., Any]): The call.
+            *args (Any): Its arguments.
+
+        Returns:
+            Future: The future of the call.
+        """
+        with self.lock:
+            if threadsafe:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="pypods-threadsafe")
+                executor = self.pool
+            else:
+                if self.serial is None:
+                    self.serial = ThreadPoolExecutor(1, thread_name_prefix="pypods-serial")
+                executor = self.serial
+        return executor.submit(function, *args)
+
+    def shutdown(self) -> None:
+        """
+        Wait for the calls in flight, then stop the threads and the event loop.
+        """
+        for executor in (self.pool, self.serial):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        with self.lock:
+            tasks = list(self.tasks)
+        wait(tasks)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = self.loop_thread = None
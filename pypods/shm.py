@@ -0,0 +1,261 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import glob
+import mmap
+import os
+import tempfile
+import uuid
+from typing import Any, List, Optional
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, only needed to share arrays.
+    numpy = None
+
+# Large payloads are replaced in the BSON message by a descriptor under this key.
+SHM_KEY = "__pypods_shm__"
+
+
+def shm_directory() -> str:
+    """
+    Directory holding the memory-mapped segments. On Linux this is the /dev/shm
+    tmpfs, so segments never touch the disk.
+
+    Returns:
+        str: The segment directory.
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def segment_size(value: Any) -> Optional[int]:
+    """
+    Size in bytes of a value that can be placed in a segment.
+
+    Args:
+        value (Any): The value to inspect.
+
+    Returns:
+        Optional[int]: The size, or None if the value cannot be shared.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, memoryview):
+        return value.nbytes
+    if numpy is not None and isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+        return value.nbytes
+    return None
+
+
+def write_segment(path: str, value: Any) -> dict:
+    """
+    Write a bytes-like value or NumPy array to a new segment.
+
+    Args:
+        path (str): Path of the segment file to create.
+        value (Any): The value to write.
+
+    Returns:
+        dict: The descriptor the other side uses to map the segment.
+    """
+    descriptor = {"name": path, "offset": 0}
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        value = numpy.ascontiguousarray(value)
+        descriptor.update(kind="ndarray", dtype=value.dtype.str, shape=list(value.shape))
+        data = memoryview(value).cast("B")
+    else:
+        descriptor.update(kind="bytes")
+        data = memoryview(value).cast("B")
+    descriptor["size"] = data.nbytes
+    with open(path, "xb") as f:
+        f.write(data)
+    return {SHM_KEY: descriptor}
+
+
+def map_segment(descriptor: dict, mappings: List[mmap.mmap]) -> Any:
+    """
+    Map a segment read-only without copying it.
+
+    Args:
+        descriptor (dict): The descriptor written by write_segment.
+        mappings (List[mmap.mmap]): Receives the mapping so the caller can release it.
+
+    Returns:
+        Any: A read-only memoryview, or a read-only NumPy array for "ndarray" segments.
+    """
+    with open(descriptor["name"], "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mappings.append(mapping)
+    offset, size = descriptor["offset"], descriptor["size"]
+    if descriptor["kind"] == "ndarray":
+        if numpy is None:
+            raise ImportError("numpy is required to receive shared NumPy arrays")
+        count = size // numpy.dtype(descriptor["dtype"]).itemsize
+        array = numpy.frombuffer(mapping, dtype=descriptor["dtype"], count=count, offset=offset)
+        return array.reshape(descriptor["shape"])
+    return memoryview(mapping)[offset:offset + size]
+
+
+def remove_segment(path: str) -> None:
+    """
+    Remove a segment file. Existing mappings stay valid until they are released.
+
+    Args:
+        path (str): Path of the segment file.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def export_value(value: Any, prefix: str, threshold: int, paths: List[str]) -> Any:
+    """
+    Recursively move every payload of at least threshold bytes into a segment.
+
+    Args:
+        value (Any): The value to export.
+        prefix (str): Path prefix of the created segments.
+        threshold (int): Minimum payload size in bytes.
+        paths (List[str]): Receives the paths of the created segments.
+
+    Returns:
+        Any: The value with large payloads replaced by descriptors.
+    """
+    size = segment_size(value)
+    if size is not None:
+        if size < threshold:
+            return value
+        path = f"{prefix}-{len(paths)}-{uuid.uuid4().hex[:8]}"
+        paths.append(path)
+        return write_segment(path, value)
+    if isinstance(value, dict):
+        return {k: export_value(v, prefix, threshold, paths) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [export_value(v, prefix, threshold, paths) for v in value]
+    return value
+
+
+def attach_value(value: Any, mappings: List[mmap.mmap], unlink: bool = False) -> Any:
+    """
+    Recursively replace segment descriptors by zero-copy views of the segments.
+
+    Args:
+        value (Any): The value holding descriptors.
+        mappings (List[mmap.mmap]): Receives the mappings that were opened.
+        unlink (bool): Remove each segment file once it is mapped.
+
+    Returns:
+        Any: The value with descriptors replaced by views.
+    """
+    if isinstance(value, dict):
+        if SHM_KEY in value:
+            view = map_segment(value[SHM_KEY], mappings)
+            if unlink:
+                remove_segment(value[SHM_KEY]["name"])
+            return view
+        return {k: attach_value(v, mappings, unlink) for k, v in value.items()}
+    if isinstance(value, list):
+        return [attach_value(v, mappings, unlink) for v in value]
+    return value
+
+
+def release_mappings(mappings: List[mmap.mmap]) -> None:
+    """
+    Close mappings that are no longer referenced. Mappings still exported to a live
+    view are left to the garbage collector.
+
+    Args:
+        mappings (List[mmap.mmap]): The mappings to close.
+    """
+    for mapping in mappings:
+        try:
+            mapping.close()
+        except BufferError:
+            pass
+    mappings.clear()
+
+
+def segment_prefix(directory: str) -> str:
+    """
+    Build a unique segment prefix for the current process.
+
+    Args:
+        directory (str): The segment directory.
+
+    Returns:
+        str: The prefix.
+    """
+    return os.path.join(directory, f"pypods-{os.getpid()}-{uuid.uuid4().hex}")
+
+
+class SharedMemorySession:
+    """
+    Client side bookkeeping of the segments used by a single pod call or batch.
+
+    Arguments of at least threshold bytes are written to segments before the request is
+    sent, and the request tells the pod to do the same with large results. Every segment
+    is named after the session's prefix, so cleanup() can remove all of them even if the
+    pod crashed halfway through the call.
+    """
+
+    def __init__(self, threshold: Optional[int], directory: Optional[str] = None) -> None:
+        """
+        Initialize the session.
+
+        Args:
+            threshold (Optional[int]): Minimum payload size in bytes, None disables shared memory.
+            directory (Optional[str]): Segment directory, defaults to shm_directory().
+        """
+        self.threshold = threshold
+        self.prefix = segment_prefix(directory or shm_directory())
+        self.paths: List[str] = []
+
+    def export_call(self, function_dict: dict) -> dict:
+        """
+        Move the large arguments of a function call request to segments.
+
+        Args:
+            function_dict (dict): The request holding the function name, args and kwargs.
+
+        Returns:
+            dict: The request to send to the pod.
+        """
+        if self.threshold is None:
+            return function_dict
+        return dict(
+            function_dict,
+            args=export_value(function_dict["args"], self.prefix, self.threshold, self.paths),
+            kwargs=export_value(function_dict["kwargs"], self.prefix, self.threshold, self.paths),
+            shm={"prefix": f"{self.prefix}-r", "threshold": self.threshold},
+        )
+
+    def attach(self, value: Any) -> Any:
+        """
+        Map the segments of a pod result. The result segments are unlinked right away,
+        the returned views keep the memory alive for as long as they are referenced.
+
+        Args:
+            value (Any): The pod result.
+
+        Returns:
+            Any: The result with descriptors replaced by views.
+        """
+        if self.threshold is None:
+            return value
+        return attach_value(value, [], unlink=True)
+
+    def cleanup(self) -> None:
+        """
+        Remove every segment of the session, including result segments the pod left behind.
+        """
+        if self.threshold is None:
+            return
+        for path in self.paths + glob.glob(f"{glob.escape(self.prefix)}-*"):
+            remove_segment(path)
+        self.paths = []
+
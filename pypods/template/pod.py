@@ -15,6 +15,27 @@ class A:
 def function_x(x):
     a = A(5)
     return a.get_x()
+
+In worker and daemon modes an object, e.g. a loaded model, can stay in the pod
+between calls. Return it by reference and call its methods from the client.
+
+from pypods.handles import handle
+
+def load_a(x):
+    return handle(A(x))  # The client gets a handle, a.get_x() runs in the pod.
+
+Functions may be async def. When the client multiplexes calls over a worker
+(concurrency > 1), async functions overlap on the pod's event loop and functions
+marked threadsafe overlap on its threads. Other functions run one call at a time.
+
+from pypods.runtime import threadsafe
+
+async def fetch(url):
+    ...
+
+@threadsafe
+def lookup(key):
+    ...
 """
 
 # Don't change anything here!
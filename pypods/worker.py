@@ -0,0 +1,733 @@
+"""
+PyPods
+Rohan Deshpande
+"""
+
+import argparse
+import itertools
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from functools import partial
+from subprocess import PIPE, Popen, TimeoutExpired
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from bson import dumps, loads
+
+from pypods.codec import DEFAULT_CODEC, BsonCodec, Codec, get_codec, negotiate_codec
+from pypods.deadline import Deadline
+from pypods.errors import PyPodNotStartedError, PyPodTimeoutError, PyPodWorkerError
+from pypods.metrics import CallTrace
+from pypods.protocol import read_frame, write_frame
+from pypods.runtime import overlapping_functions
+
+if TYPE_CHECKING:
+    from pypods.manager import PodBudget
+
+WORKER_MODULE = "pypods.worker"
+WORKER_STOP_TIMEOUT = 5
+# Requests a multiplexed worker process runs at once unless told otherwise.
+DEFAULT_CONCURRENCY = 8
+
+
+class PodWorker:
+    """
+    A long-lived pod process that serves length-prefixed frames over its stdin/stdout.
+
+    The pod module is imported once when the worker starts, so each call only costs a
+    pipe round-trip. If the process dies it is restarted transparently on the next call.
+    The wire codec is negotiated at startup: the worker picks the first codec of the
+    client's preference list that is available in the pod's interpreter.
+
+    With fork set the worker is a zygote: it only imports the pod module and forks a
+    fresh child of itself for every request.
+    """
+
+    def __init__(
+        self,
+        interpreter: str,
+        module: str,
+        codecs: Sequence[str] = (DEFAULT_CODEC,),
+        fork: bool = False,
+        on_spawn: Optional[Callable[[], None]] = None,
+        budget: Optional["PodBudget"] = None,
+    ) -> None:
+        """
+        Initialize the worker for a pod module.
+
+        Args:
+            interpreter (str): Path to the pod's python interpreter.
+            module (str): Dotted name of the pod module to serve, e.g. pods.hello_world_pod.pod
+            codecs (Sequence[str]): Wire codec names in order of preference.
+            fork (bool): Handle every request in a forked child of the worker process.
+            on_spawn (Optional[Callable[[], None]]): Called every time the worker process is started.
+            budget (Optional[PodBudget]): Process budget of the PodManager owning the worker, see
+                pypods.manager. The worker process takes one of its slots while it runs.
+        """
+        self.interpreter = interpreter
+        self.module = module
+        self.codecs = list(codecs)
+        self.fork = fork
+        self.on_spawn = on_spawn
+        self.budget = budget
+        self.codec: Codec = BsonCodec()
+        self.process: Optional[Popen] = None
+        self.lock = threading.Lock()
+        # The ready frame of the last worker process started.
+        self.ready: Dict[str, Any] = {}
+
+    def command(self) -> List[str]:
+        """
+        Build the command line that starts the worker process.
+
+        Returns:
+            List[str]: The command line.
+        """
+        return worker_command(self.interpreter, self.module, self.codecs, self.fork)
+
+    def is_alive(self) -> bool:
+        """
+        Check if the worker process is running.
+
+        Returns:
+            bool: True if the worker process is running.
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        """
+        Start the worker process and wait until the pod module is imported.
+        """
+        with self.lock:
+            self._start()
+
+    def _start(self, deadline: Optional[Deadline] = None) -> None:
+        """
+        Start the worker process, the caller must hold the worker's lock.
+
+        Args:
+            deadline (Optional[Deadline]): Time limit of the wait for a slot of the worker's budget.
+        """
+        if self.is_alive():
+            return
+        if not os.path.exists(self.interpreter):
+            raise PyPodNotStartedError("Pod interpreter is missing!")
+        if self.budget is not None:
+            self.budget.acquire(self, deadline)
+        try:
+            # The pod's stderr is inherited so that pod logs reach the client's terminal.
+            # A zygote leads its own process group, which its forked children join.
+            self.process = Popen(self.command(), stdin=PIPE, stdout=PIPE, start_new_session=self.fork)
+        except BaseException:
+            if self.budget is not None:
+                self.budget.release(self)
+            raise
+        if self.on_spawn is not None:
+            self.on_spawn()
+        ready = read_frame(self.process.stdout)
+        if ready is None:
+            self._reap()
+            raise PyPodWorkerError(f"Pod worker {self.module} exited during startup")
+        ready = loads(ready)
+        if "error" in ready:
+            self._reap()
+            raise PyPodWorkerError(ready["error"])
+        try:
+            self.codec = get_codec(ready["codec"])
+        except BaseException:
+            self._stop()
+            raise
+        self.ready = ready
+
+    def stop(self) -> None:
+        """
+        Ask the worker process to exit by closing its stdin, killing it if it does not comply.
+        """
+        with self.lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        """
+        Stop the worker process, the caller must hold the worker's lock.
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=WORKER_STOP_TIMEOUT)
+        except TimeoutExpired:
+            self.process.kill()
+        self._reap()
+
+    def _reap(self) -> None:
+        """
+        Release the resources of a dead or dying worker process.
+        """
+        if self.process is None:
+            return
+        if self.fork or self.process.poll() is None:
+            # The child forked for a call may outlive its zygote.
+            kill_process(self.process, self.fork)
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process = None
+        if self.budget is not None:
+            self.budget.release(self)
+
+    def _recycle(self, process: Popen) -> None:
+        """
+        Stop a worker process that its budget asked to recycle, unless it was already replaced.
+        The next request starts a fresh one.
+        """
+        with self.lock:
+            if self.process is process:
+                self._stop()
+                self.budget.recycled()
+
+    def _send(
+        self, message: Dict[str, Any], trace: Optional[CallTrace] = None, deadline: Optional[Deadline] = None
+    ) -> None:
+        """
+        Write a request frame, restarting the worker if it is not running.
+        """
+        if not self.is_alive():
+            self._reap()
+            self._start(deadline)
+        start = time.perf_counter()
+        data = self.codec.dump_buffers(message)
+        if trace is not None:
+            trace.add_phase("encode", time.perf_counter() - start)
+            trace.request_bytes += sum(memoryview(buffer).nbytes for buffer in data)
+        try:
+            write_frame(self.process.stdin, data)
+        except OSError:
+            # The worker died before reading the request, so it is safe to resend it,
+            # unless it was killed because the call was interrupted.
+            self._reap()
+            if deadline is not None:
+                deadline.check()
+            self._start(deadline)
+            write_frame(self.process.stdin, data)
+
+    def _receive(self, trace: Optional[CallTrace] = None) -> Dict[str, Any]:
+        """
+        Read and decode a reply frame, failing if the worker exits before sending it.
+        """
+        try:
+            response = read_frame(self.process.stdout)
+        except EOFError:
+            response = None
+        if response is None:
+            self._reap()
+            raise PyPodWorkerError(f"Pod worker {self.module} exited while handling a request")
+        if trace is None:
+            return self.codec.loads(response)
+        start = time.perf_counter()
+        reply = self.codec.loads(response)
+        trace.add_phase("decode", time.perf_counter() - start)
+        trace.response_bytes += len(response)
+        return reply
+
+    def request(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Send one request to the worker and yield its replies.
+
+        A plain reply is a single frame. A generator pod function replies with a
+        {"stream": True} frame, followed by {"chunk": ...} frames and a final
+        {"end": True} or {"error": ...} frame. The worker stays reserved until the
+        iterator is exhausted or closed. Closing it before the stream ends restarts
+        the worker, since the rest of the stream can no longer be read back.
+
+        If the deadline passes or the call is cancelled, the worker process is killed and
+        PyPodTimeoutError or PyPodCancelledError is raised. The next call restarts it.
+        A worker with a budget reports the request to it, and stops its process afterwards
+        if the budget asks for it to be recycled.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request, which
+                also asks the pod to report its own timings.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request, covering
+                the wait for the worker and the whole reply stream.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The replies.
+        """
+        if trace is not None:
+            message = dict(message, trace=True)
+        if deadline is None:
+            deadline = Deadline()
+        deadline.check()
+        if self.budget is not None:
+            self.budget.busy(self)
+        process = None
+        try:
+            remaining = deadline.remaining()
+            if not self.lock.acquire(timeout=-1 if remaining is None else remaining):
+                raise PyPodTimeoutError("Pod call exceeded its deadline while waiting for the pod worker")
+            try:
+                finished = False
+                try:
+                    with deadline.watch(self._interrupt):
+                        try:
+                            self._send(message, trace, deadline)
+                        except (PyPodWorkerError, OSError):
+                            # The worker was killed while it was being (re)started.
+                            deadline.check()
+                            raise
+                        process = self.process
+                        if deadline.reason is not None:
+                            # Interrupted while the worker was being (re)started.
+                            deadline.check()
+                        sent = time.perf_counter()
+                        while not finished:
+                            try:
+                                reply = self._receive(trace)
+                            except PyPodWorkerError:
+                                deadline.check()
+                                raise
+                            if deadline.reason is not None:
+                                # Replied as it was interrupted, the reply stream can no longer be trusted.
+                                deadline.check()
+                            if trace is not None and sent is not None:
+                                # Only the first reply tells how long the round-trip took.
+                                roundtrip = time.perf_counter() - sent - trace.phases.get("decode", 0.0)
+                                trace.add_pod_timings(reply.pop("trace", {}), roundtrip)
+                                sent = None
+                            finished = not {"stream", "chunk"}.intersection(reply)
+                            yield reply
+                finally:
+                    if not finished:
+                        self._reap()
+            finally:
+                self.lock.release()
+        finally:
+            if self.budget is not None and self.budget.done(self, process is not None):
+                self._recycle(process)
+
+    def _interrupt(self) -> None:
+        """
+        Kill the worker process from another thread, aborting the request in flight.
+        The process is reaped by the thread that holds the worker's lock.
+        """
+        process = self.process
+        if process is not None:
+            kill_process(process, self.fork)
+
+    def call(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send one request to the worker and wait for its reply.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Dict[str, Any]: The reply.
+        """
+        replies = self.request(message, trace, deadline)
+        try:
+            return next(replies)
+        finally:
+            replies.close()
+
+
+class MultiplexedPodWorker(PodWorker):
+    """
+    A pod worker whose single channel carries many requests at once.
+
+    Every request is tagged with an ID and the worker process replies to each one as soon
+    as it is done. A reader thread routes the reply frames back to their callers by ID, so
+    a slow call no longer holds up the calls sent after it and the worker's lock is only
+    held while a request frame is written. Inside the pod, async def functions overlap on
+    its event loop, functions marked with pypods.runtime.threadsafe overlap on concurrency
+    threads, and other functions run one call at a time, see pypods.runtime.PodRuntime.
+    """
+
+    def __init__(
+        self,
+        interpreter: str,
+        module: str,
+        codecs: Sequence[str] = (DEFAULT_CODEC,),
+        concurrency: int = DEFAULT_CONCURRENCY,
+        on_spawn: Optional[Callable[[], None]] = None,
+        budget: Optional["PodBudget"] = None,
+    ) -> None:
+        """
+        Initialize the worker for a pod module.
+
+        Args:
+            interpreter (str): Path to the pod's python interpreter.
+            module (str): Dotted name of the pod module to serve, e.g. pods.hello_world_pod.pod
+            codecs (Sequence[str]): Wire codec names in order of preference.
+            concurrency (int): Requests the worker process runs at once.
+            on_spawn (Optional[Callable[[], None]]): Called every time the worker process is started.
+            budget (Optional[PodBudget]): Process budget of the PodManager owning the worker.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be a positive integer")
+        super().__init__(interpreter, module, codecs, on_spawn=on_spawn, budget=budget)
+        self.concurrency = concurrency
+        self.ids = itertools.count(1)
+        # Reply queues of the requests in flight on the current worker process, by ID.
+        self.pending: Dict[int, "queue.SimpleQueue[Any]"] = {}
+        self.pending_lock = threading.Lock()
+        # Set by the reader once the current worker process closed its end of the channel.
+        self.closed = threading.Event()
+
+    def command(self) -> List[str]:
+        """
+        Build the command line that starts the worker process.
+
+        Returns:
+            List[str]: The command line.
+        """
+        return worker_command(self.interpreter, self.module, self.codecs, False, self.concurrency)
+
+    def _start(self, deadline: Optional[Deadline] = None) -> None:
+        """
+        Start the worker process and its reply reader, the caller must hold the worker's lock.
+
+        Args:
+            deadline (Optional[Deadline]): Time limit of the wait for a slot of the worker's budget.
+        """
+        if self.is_alive():
+            return
+        super()._start(deadline)
+        self.pending = {}
+        self.closed = threading.Event()
+        reader = threading.Thread(
+            target=self._read_replies,
+            args=(self.process, self.codec, self.pending, self.closed),
+            name=f"pypods-reader-{self.module}",
+            daemon=True,
+        )
+        reader.start()
+
+    def _read_replies(
+        self,
+        process: Popen,
+        codec: Codec,
+        pending: Dict[int, "queue.SimpleQueue[Any]"],
+        closed: threading.Event,
+    ) -> None:
+        """
+        Route the reply frames of a worker process to the queues of their requests until
+        it exits, then fail the requests still waiting for it.
+
+        Args:
+            process (Popen): The worker process.
+            codec (Codec): The codec negotiated with the worker process.
+            pending (Dict[int, queue.SimpleQueue]): Reply queues of the process's requests, by ID.
+            closed (threading.Event): Set once no more replies can be read from the process.
+        """
+        error = f"Pod worker {self.module} exited while handling a request"
+        while True:
+            try:
+                data = read_frame(process.stdout)
+            except (EOFError, OSError, ValueError):
+                data = None
+            if data is None:
+                break
+            start = time.perf_counter()
+            try:
+                reply = codec.loads(data)
+            except Exception as e:
+                reply = {"error": str(e)}
+            decode = time.perf_counter() - start
+            if "id" not in reply:
+                # A request the worker could not even decode, the channel cannot be trusted.
+                error = reply.get("error", error)
+                process.kill()
+                continue
+            with self.pending_lock:
+                replies = pending.get(reply.pop("id"))
+            if replies is not None:
+                replies.put((reply, decode, len(data)))
+        with self.pending_lock:
+            closed.set()
+            waiting = list(pending.values())
+            pending.clear()
+        for replies in waiting:
+            replies.put(PyPodWorkerError(error))
+
+    def _submit(
+        self,
+        request_id: int,
+        message: Dict[str, Any],
+        replies: "queue.SimpleQueue[Any]",
+        trace: Optional[CallTrace],
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[int, "queue.SimpleQueue[Any]"]:
+        """
+        Register a request and write its frame, restarting the worker if it is not running.
+        The caller must hold the worker's lock.
+
+        Returns:
+            Dict[int, queue.SimpleQueue]: The pending requests of the worker process it was sent to.
+        """
+        for attempt in range(2):
+            if not self.is_alive() or self.closed.is_set():
+                # The reader may see the channel close before the process can be reaped.
+                self._reap()
+                self._start(deadline)
+            start = time.perf_counter()
+            data = self.codec.dump_buffers(dict(message, id=request_id))
+            if trace is not None and attempt == 0:
+                trace.add_phase("encode", time.perf_counter() - start)
+                trace.request_bytes += sum(memoryview(buffer).nbytes for buffer in data)
+            pending = self.pending
+            with self.pending_lock:
+                if self.closed.is_set():
+                    continue
+                pending[request_id] = replies
+            try:
+                write_frame(self.process.stdin, data)
+                return pending
+            except OSError:
+                # The worker died before reading the request, so it is safe to resend it.
+                with self.pending_lock:
+                    pending.pop(request_id, None)
+                self._reap()
+        raise PyPodWorkerError(f"Pod worker {self.module} exited while receiving a request")
+
+    def request(
+        self,
+        message: Dict[str, Any],
+        trace: Optional[CallTrace] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Send one request to the worker and yield its replies, which may arrive while
+        other requests are in flight on the same channel.
+
+        Closing the iterator before a stream ends, or hitting the deadline, asks the worker to
+        drop the request's remaining replies instead of killing the process that the other
+        requests share. A pod function that is already running is left to finish in the background,
+        unless it runs on the single thread of the worker process: it would hold up every later
+        call of a function that is not threadsafe, so the process is killed when its deadline
+        passes, failing the other requests in flight on it.
+
+        Args:
+            message (Dict[str, Any]): The request.
+            trace (Optional[CallTrace]): Receives the timings and sizes of the request, which
+                also asks the pod to report its own timings.
+            deadline (Optional[Deadline]): Time limit and cancel token of the request.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The replies.
+        """
+        if trace is not None:
+            message = dict(message, trace=True)
+        if deadline is None:
+            deadline = Deadline()
+        deadline.check()
+        request_id = next(self.ids)
+        replies: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        if self.budget is not None:
+            self.budget.busy(self)
+        process = None
+        try:
+            remaining = deadline.remaining()
+            if not self.lock.acquire(timeout=-1 if remaining is None else remaining):
+                raise PyPodTimeoutError("Pod call exceeded its deadline while waiting for the pod worker")
+            try:
+                pending = self._submit(request_id, message, replies, trace, deadline)
+                process = self.process
+            finally:
+                self.lock.release()
+            finished = False
+            try:
+                with deadline.watch(partial(replies.put, PyPodWorkerError("Pod call was interrupted"))):
+                    sent: Optional[float] = time.perf_counter()
+                    while not finished:
+                        item = replies.get()
+                        deadline.check()
+                        if isinstance(item, Exception):
+                            raise item
+                        reply, decode, size = item
+                        if trace is not None:
+                            trace.add_phase("decode", decode)
+                            trace.response_bytes += size
+                            if sent is not None:
+                                roundtrip = time.perf_counter() - sent - decode
+                                trace.add_pod_timings(reply.pop("trace", {}), roundtrip)
+                                sent = None
+                        finished = not {"stream", "chunk"}.intersection(reply)
+                        yield reply
+            finally:
+                with self.pending_lock:
+                    abandoned = pending.pop(request_id, None) is not None and not finished
+                if abandoned and deadline.reason is not None and self.runs_serially(message):
+                    # Waited for, so that the next request starts a fresh process.
+                    kill_process(process)
+                    process.wait()
+                elif abandoned:
+                    self._cancel(request_id)
+        finally:
+            if self.budget is not None and self.budget.done(self, process is not None):
+                self._recycle(process)
+
+    def runs_serially(self, message: Dict[str, Any]) -> bool:
+        """
+        Check if a request runs on the single thread of the worker process, behind the other
+        requests that do, see pypods.pods.PodListener.schedule.
+
+        Args:
+            message (Dict[str, Any]): The request.
+
+        Returns:
+            bool: False for calls of threadsafe functions, and of async def functions unless
+            they are profiled.
+        """
+        name = message.get("name")
+        if "batch" in message or "handle" in message or not isinstance(name, str):
+            return True
+        if name in self.ready.get("threadsafe", ()):
+            return False
+        return name not in self.ready.get("async", ()) or bool(message.get("profile"))
+
+    def _recycle(self, process: Popen) -> None:
+        """
+        Stop a worker process that its budget asked to recycle once no request is in flight
+        on it, unless it was already replaced. Otherwise the last of them recycles it.
+        """
+        with self.lock:
+            with self.pending_lock:
+                if self.pending:
+                    return
+            if self.process is process:
+                self._stop()
+                self.budget.recycled()
+
+    def _cancel(self, request_id: int) -> None:
+        """
+        Ask the worker to drop the remaining replies of an abandoned request.
+        """
+        with self.lock:
+            if not self.is_alive():
+                return
+            try:
+                write_frame(self.process.stdin, self.codec.dump_buffers({"cancel": request_id}))
+            except OSError:
+                pass
+
+
+def kill_process(process: Any, group: bool = False) -> None:
+    """
+    Kill a worker process. A zygote leads a process group that also holds the child it
+    forked for the call in flight, which would otherwise keep running and hold the pipes.
+
+    Args:
+        process (Any): The subprocess.Popen or asyncio process.
+        group (bool): Kill the process group the process leads.
+    """
+    if group and hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            pass
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+
+def worker_command(
+    interpreter: str, module: str, codecs: Sequence[str], fork: bool, concurrency: int = 1
+) -> List[str]:
+    """
+    Build the command line that starts a worker process.
+
+    Args:
+        interpreter (str): Path to the pod's python interpreter.
+        module (str): Dotted name of the pod module to serve.
+        codecs (Sequence[str]): Wire codec names in order of preference.
+        fork (bool): Handle every request in a forked child of the worker process.
+        concurrency (int): Multiplexed requests the worker process handles at once.
+
+    Returns:
+        List[str]: The command line.
+    """
+    command = [interpreter, "-m", WORKER_MODULE, module, "--codecs", ",".join(codecs)]
+    if fork:
+        command.append("--fork")
+    if concurrency > 1:
+        command += ["--concurrency", str(concurrency)]
+    return command
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """
+    Entry point of the worker process that runs inside the pod's interpreter.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments, defaults to sys.argv[1:].
+    """
+    parser = argparse.ArgumentParser(prog=f"python -m {WORKER_MODULE}")
+    parser.add_argument("module", help="Dotted name of the pod module to serve")
+    parser.add_argument(
+        "--codecs", default=DEFAULT_CODEC, help="Comma separated wire codecs in order of preference"
+    )
+    parser.add_argument(
+        "--fork", action="store_true", help="Fork a fresh child of the worker for every request"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Multiplexed requests to handle at once on threads"
+    )
+    args = parser.parse_args(argv)
+
+    # Frames are written to the original stdout. Anything the pod prints is sent to
+    # stderr instead so that it cannot corrupt the protocol stream.
+    channel_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    from pypods.ns import get_module_namespace
+    from pypods.pods import PodListener
+
+    # Tell the client whether the pod module could be imported and which codec was picked.
+    try:
+        if args.fork and not hasattr(os, "fork"):
+            raise PyPodWorkerError("Forking pod workers requires os.fork, which this platform lacks")
+        if args.fork and args.concurrency > 1:
+            raise PyPodWorkerError("Forking pod workers cannot handle multiplexed requests")
+        codec = negotiate_codec(args.codecs.split(","))
+        namespace = get_module_namespace(args.module)
+    except Exception as e:
+        write_frame(channel_out, dumps({"error": str(e)}))
+        sys.exit(1)
+    ready = {"ready": True, "codec": codec.name}
+    if args.concurrency > 1:
+        ready.update(overlapping_functions(namespace))
+    write_frame(channel_out, dumps(ready))
+
+    PodListener().serve(
+        namespace, sys.stdin.buffer, channel_out, codec, fork=args.fork, concurrency=args.concurrency
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ setup(
     version=__version__,
     packages=["pypods", "pypods.template"],
     install_requires=read_requirements(),
+    entry_points={
+        'console_scripts': ['pypods=pypods.cli:main'],
+    },
     author='Rohan Deshpande',
     author_email='rohandeshpande832@gmail.com',
     description='A lightweight solution to execute Python dependencies in an isolated fashion.',
@@ -0,0 +1,41 @@
+# Pod fixture whose functions are marked threadsafe, used by the tests of overlapping calls.
+import os
+import time
+
+from pypods.runtime import threadsafe
+
+
+@threadsafe
+def add(x, y):
+    return x + y
+
+
+@threadsafe
+def pid():
+    return os.getpid()
+
+
+@threadsafe
+def count(n):
+    for i in range(n):
+        yield i
+
+
+@threadsafe
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+calls = 0
+
+
+def slow_bump(seconds):
+    global calls
+    time.sleep(seconds)
+    calls += 1
+    return calls
+
+
+def crash(*args):
+    os._exit(1)
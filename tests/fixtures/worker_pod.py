@@ -0,0 +1,128 @@
+# Pod fixture used by the persistent worker tests.
+import asyncio
+import os
+import time
+
+from pypods.handles import OBJECTS, handle
+
+
+def add(x, y):
+    return x + y
+
+
+def echo(value):
+    return value
+
+
+def double(x):
+    return 2 * x
+
+
+def pid():
+    return os.getpid()
+
+
+def noisy(x):
+    print("pods may print without breaking the protocol")
+    return x
+
+
+def count(n):
+    for i in range(n):
+        yield i
+
+
+def count_then_fail(n):
+    yield from range(n)
+    raise ValueError("stream broke")
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+async def async_sleep(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+async def async_count(n):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+
+async def async_fail(message):
+    await asyncio.sleep(0)
+    raise ValueError(message)
+
+
+def reverse(data):
+    return bytes(data)[::-1]
+
+
+def nbytes(data):
+    return memoryview(data).nbytes
+
+
+calls = 0
+
+
+def bump():
+    global calls
+    calls += 1
+    return calls
+
+
+def slow_bump(seconds):
+    time.sleep(seconds)
+    return bump()
+
+
+class Counter:
+    def __init__(self, value):
+        self.value = value
+
+    def increment(self, by=1):
+        self.value += by
+        return self.value
+
+    def count_up(self, n):
+        for _ in range(n):
+            yield self.increment()
+
+    def copy(self):
+        return handle(Counter(self.value))
+
+
+def make_counter(value):
+    return handle(Counter(value))
+
+
+def live_objects():
+    return len(OBJECTS)
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def crash(*args):
+    os._exit(1)
+
+
+# Lets the spawn mode tests run this module as a pod, like the template pod.py.
+if __name__ == "__main__":
+    from pypods.pods import PodListener
+    pl = PodListener()
+    msg = pl.read_stdin()
+    if msg:
+        function_name, args, kwargs = msg["name"], msg["args"], msg["kwargs"]
+        try:
+            if function_name in globals():
+                pl.write_stdout(globals()[function_name](*args, **kwargs))
+            else:
+                pl.write_stderr(f"Function {function_name} does not exist in pod")
+        except Exception as e:
+            pl.write_stderr(str(e))
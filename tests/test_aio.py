@@ -0,0 +1,122 @@
+import asyncio
+import sys
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.aio import AsyncPodLoader, AsyncPodWorker
+from pypods.errors import PyPodNotStartedError, PyPodResponseError, PyPodWorkerError
+from pypods.metrics import PodMetrics
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {
+    "add": (["x", "y"], {}),
+    "pid": ([], {}),
+    "fail": (["message"], {}),
+    "crash": ([], {}),
+    "count": (["n"], {}),
+    "make_counter": (["value"], {}),
+    "live_objects": ([], {}),
+}
+
+
+@patch("pypods.aio.AsyncPodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.aio.AsyncPodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.aio.get_pod_namespace", return_value=FIXTURE_NS)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestAsyncPodLoader(unittest.IsolatedAsyncioTestCase):
+    async def test_calls(self, *mocks):
+        pl = AsyncPodLoader("worker_pod", {}, size=4)
+        await pl.load_pod()
+        pod = pl.namespace["worker_pod"]
+        self.assertTrue(asyncio.iscoroutinefunction(pod.add))
+        results = await asyncio.gather(*(pod.add(i, 1) for i in range(200)))
+        self.assertEqual(results, [i + 1 for i in range(200)])
+        pids = await asyncio.gather(*(pod.pid() for _ in range(50)))
+        self.assertLessEqual(len(set(pids)), 4)
+
+        async with pl.batch() as b:
+            futures = [b.add(i, i) for i in range(10)]
+        self.assertEqual([f.result() for f in futures], [2 * i for i in range(10)])
+
+        items = await pod.count(3)
+        self.assertEqual([item async for item in items], [0, 1, 2])
+
+        with self.assertRaises(PyPodResponseError):
+            await pod.fail("boom")
+        with self.assertRaises(Exception):
+            await pod.crash()
+        self.assertEqual(await pod.add(1, 2), 3)
+
+        await pl.unload_pod()
+        self.assertNotIn("worker_pod", pl.namespace)
+        with self.assertRaises(PyPodNotStartedError):
+            await pl.call_worker({})
+
+    async def test_lazy(self, mock_create_pod, mock_get_pod_namespace, *mocks):
+        pl = AsyncPodLoader("worker_pod", {})
+        await pl.load_pod(lazy=True)
+        pod = pl.namespace["worker_pod"]
+        mock_create_pod.assert_not_called()
+        self.assertEqual(await asyncio.gather(pod.add(1, 2), pod.add(2, 2)), [3, 4])
+        mock_get_pod_namespace.assert_called_once()
+        self.assertTrue(asyncio.iscoroutinefunction(pod.add))
+        with self.assertRaises(AttributeError):
+            pod.missing
+        await pl.unload_pod()
+
+        await pl.load_pod(lazy=True, prewarm=True)
+        await pl.prewarm_task
+        self.assertEqual(len(pl.workers), 1)
+        self.assertEqual(await pl.namespace["worker_pod"].pid(), await pl.namespace["worker_pod"].pid())
+        await pl.unload_pod()
+
+
+    async def test_stream_finishes_its_trace(self, *mocks):
+        traces = []
+        metrics = PodMetrics()
+        metrics.add_hook(traces.append)
+        pl = AsyncPodLoader("worker_pod", {}, metrics=metrics)
+        await pl.load_pod()
+        try:
+            items = await pl.namespace["worker_pod"].count(3)
+            self.assertEqual(traces, [])
+            self.assertEqual([item async for item in items], [0, 1, 2])
+            self.assertEqual(len(traces), 1)
+            self.assertIsNone(traces[0].error)
+        finally:
+            await pl.unload_pod()
+
+    async def test_refused_objects_are_released(self, *mocks):
+        pl = AsyncPodLoader("worker_pod", {})
+        await pl.load_pod()
+        self.addAsyncCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        with self.assertRaises(Exception):
+            await pod.make_counter(1)
+        self.assertEqual(await pod.live_objects(), 0)
+
+    async def test_rejects_concurrency(self, *mocks):
+        with self.assertRaises(ValueError):
+            AsyncPodLoader("worker_pod", {}, concurrency=4)
+
+
+class TestAsyncPodWorker(unittest.IsolatedAsyncioTestCase):
+    async def test_cancel_kills_worker(self):
+        worker = AsyncPodWorker(sys.executable, "tests.fixtures.worker_pod")
+        await worker.start()
+        process = worker.process
+        task = asyncio.ensure_future(worker.call({"name": "sleep", "args": [30], "kwargs": {}}))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertIsNone(worker.process)
+        await process.wait()
+
+    async def test_start_failure(self):
+        with self.assertRaises(PyPodWorkerError):
+            await AsyncPodWorker(sys.executable, "tests.fixtures.missing_pod").start()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from unittest.mock import patch
+
+from pypods.bench import bench_codecs, compare_results, percentiles
+
+
+class TestBench(unittest.TestCase):
+    @patch("pypods.bench.codec_payloads", return_value={"small": {"response": [1, 2, 3]}})
+    def test_bench_codecs(self, mock_payloads):
+        results = bench_codecs(["bson", "pickle"], repeat=1)
+        self.assertEqual([r["codec"] for r in results], ["bson", "pickle"])
+        for result in results:
+            self.assertEqual(result["payload"], "small")
+            self.assertGreater(result["size"], 0)
+            self.assertGreaterEqual(result["encode"], 0)
+            self.assertGreaterEqual(result["decode"], 0)
+
+    def test_percentiles(self):
+        summary = percentiles([i / 100 for i in range(100, 0, -1)])
+        self.assertAlmostEqual(summary["mean"], 0.505)
+        self.assertEqual(summary["p50"], 0.51)
+        self.assertEqual(summary["p90"], 0.91)
+        self.assertEqual(summary["p99"], 1.0)
+
+    def test_compare_results(self):
+        baseline = {"metrics": {
+            "latency.worker.p50.seconds": 1.0,
+            "payload.pipe.1MB.seconds": 1.0,
+            "throughput.pool_4.callers_8.calls_per_second": 100.0,
+            "cold.create_pod.seconds": 1.0,
+        }}
+        current = {"metrics": {
+            "latency.worker.p50.seconds": 1.5,
+            "payload.pipe.1MB.seconds": 0.5,
+            "throughput.pool_4.callers_8.calls_per_second": 80.0,
+        }}
+        comparison = {entry["metric"]: entry for entry in compare_results(baseline, current, 0.1)}
+        self.assertEqual(len(comparison), 3)
+        self.assertTrue(comparison["latency.worker.p50.seconds"]["regression"])
+        self.assertFalse(comparison["payload.pipe.1MB.seconds"]["regression"])
+        self.assertTrue(comparison["throughput.pool_4.callers_8.calls_per_second"]["regression"])
+        self.assertAlmostEqual(comparison["payload.pipe.1MB.seconds"]["change"], -0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
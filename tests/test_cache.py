@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from os.path import join
+from unittest.mock import PropertyMock, patch
+
+from pypods.aio import AsyncPodLoader
+from pypods.cache import MISSING, ResultCache, canonical_key
+from pypods.pods import PodLoader
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {"pid": ([], {}), "add": (["x", "y"], {}), "count": (["n"], {})}
+
+
+class TestCanonicalKey(unittest.TestCase):
+    def test_equal_calls(self):
+        self.assertEqual(
+            canonical_key("f", (1, {"a": 1, "b": [2]}), {"x": {3, 4}, "y": None}),
+            canonical_key("f", (1, {"b": [2], "a": 1}), {"y": None, "x": {4, 3}}),
+        )
+
+    def test_distinct_calls(self):
+        keys = {
+            canonical_key("f", (1,), {}),
+            canonical_key("f", (1.0,), {}),
+            canonical_key("f", (True,), {}),
+            canonical_key("f", ("1",), {}),
+            canonical_key("f", ((1,),), {}),
+            canonical_key("f", ([1],), {}),
+            canonical_key("f", (b"1",), {}),
+            canonical_key("g", (1,), {}),
+            canonical_key("f", (), {"x": 1}),
+        }
+        self.assertEqual(len(keys), 9)
+
+    def test_unsupported_argument(self):
+        with self.assertRaises(TypeError):
+            canonical_key("f", (object(),), {})
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = join(tmp.name, "pod.py")
+        with open(self.source, mode="w") as f:
+            f.write("def foo():\n    pass\n")
+        self.directory = join(tmp.name, "cache")
+
+    def test_lru(self):
+        cache = ResultCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", None)
+        self.assertIsNone(cache.get("c"))
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "disk_hits": 0, "size": 2, "maxsize": 2})
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertIs(cache.get("a"), MISSING)
+
+    def test_disk_tier(self):
+        ResultCache(directory=self.directory, sources=[self.source]).set("a", [1, 2])
+        cache = ResultCache(directory=self.directory, sources=[self.source])
+        self.assertEqual(cache.get("a"), [1, 2])
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        cache.clear()
+        self.assertIs(ResultCache(directory=self.directory).get("a"), MISSING)
+
+    def test_source_change_invalidates(self):
+        cache = ResultCache(directory=self.directory, sources=[self.source])
+        cache.set("a", 1)
+        with open(self.source, mode="a") as f:
+            f.write("# changed\n")
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertIs(ResultCache(directory=self.directory, sources=[self.source]).get("a"), MISSING)
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestMemoize(unittest.TestCase):
+    @patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_memoize(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker")
+        pl.memoize("add")
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        pl.memoize("pid", maxsize=4)
+        first = pod.pid()
+        pl.stop_worker()
+        pl.start_worker()
+        self.assertEqual(pod.pid(), first)
+        self.assertEqual(pod.add(1, 2), 3)
+        self.assertEqual(pod.add(1, 2), 3)
+        self.assertEqual(pod.add.cache.stats()["hits"], 1)
+        self.assertEqual(pod.pid.cache.stats()["maxsize"], 4)
+
+        pl.memoize("count")
+        self.assertEqual(list(pod.count(2)), [0, 1])
+        self.assertEqual(list(pod.count(2)), [0, 1])
+        self.assertEqual(pod.count.cache.stats()["size"], 0)
+
+    @patch("pypods.aio.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_memoize_async(self, *mocks):
+        async def run():
+            pl = AsyncPodLoader("worker_pod", {})
+            pl.memoize("pid")
+            await pl.load_pod()
+            pod = pl.namespace["worker_pod"]
+            first = await pod.pid()
+            await pl.stop_worker()
+            await pl.start_worker()
+            self.assertEqual(await pod.pid(), first)
+            self.assertEqual(pod.pid.cache.stats()["hits"], 1)
+            await pl.unload_pod()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import pickle
+import unittest
+
+from pypods.codec import CODECS, BsonCodec, PickleCodec, get_codec, negotiate_codec
+from pypods.errors import PyPodError
+from pypods.protocol import read_frame, write_frame
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestCodecs(unittest.TestCase):
+    def test_bson(self):
+        codec = BsonCodec()
+        message = {"name": "foo", "args": [1, "a", [2.5]], "kwargs": {"b": None}}
+        self.assertEqual(codec.loads(codec.dumps(message)), message)
+        self.assertEqual(codec.loads(b"".join(codec.dump_buffers(message))), message)
+
+    def test_pickle(self):
+        codec = PickleCodec()
+        message = {"response": (1, {2, 3}, frozenset([4]), {5: b"x"})}
+        self.assertEqual(codec.loads(codec.dumps(message)), message)
+
+    def test_pickle_out_of_band(self):
+        codec = PickleCodec()
+        payload = pickle.PickleBuffer(bytearray(b"y" * 4096))
+        buffers = codec.dump_buffers({"response": payload})
+        # The payload is not copied into the pickle stream.
+        self.assertEqual(len(buffers), 3)
+        self.assertLess(len(buffers[1]), 4096)
+
+        stream = _Pipe()
+        write_frame(stream, buffers)
+        reply = codec.loads(read_frame(stream))
+        self.assertEqual(bytes(reply["response"]), b"y" * 4096)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_pickle_ndarray(self):
+        codec = PickleCodec()
+        array = numpy.arange(100000, dtype="float64")
+        reply = codec.loads(codec.dumps({"response": array}))
+        self.assertTrue(numpy.array_equal(reply["response"], array))
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        codec = get_codec("msgpack")
+        message = {"response": [(1, 2), {3}, frozenset([4]), {5: b"x"}, ((6,),)]}
+        self.assertEqual(codec.loads(codec.dumps(message)), message)
+
+    def test_get_codec(self):
+        self.assertEqual(set(CODECS), {"bson", "msgpack", "pickle"})
+        self.assertIsInstance(get_codec("pickle"), PickleCodec)
+        with self.assertRaises(ValueError):
+            get_codec("json")
+
+    def test_negotiate_codec(self):
+        self.assertEqual(negotiate_codec(["json", "bson"]).name, "bson")
+        self.assertEqual(negotiate_codec(["pickle", "bson"]).name, "pickle")
+        with self.assertRaises(PyPodError):
+            negotiate_codec(["json"])
+
+
+class _Pipe:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+    def read(self, size):
+        chunk, self.data = bytes(self.data[:size]), self.data[size:]
+        return chunk
+
+
+if __name__ == "__main__":
+    unittest.main()
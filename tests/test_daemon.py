@@ -0,0 +1,223 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from pypods.daemon import (
+    DAEMON_INFO,
+    DaemonClient,
+    DaemonConnection,
+    daemon_file,
+    ensure_daemon,
+    read_daemon_info,
+    stop_daemon,
+)
+from pypods.deadline import CancelToken, Deadline
+from pypods.errors import PyPodCancelledError, PyPodTimeoutError, PyPodWorkerError
+from pypods.pods import PodLoader
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {
+    "add": (["x", "y"], {}),
+    "pid": ([], {}),
+    "sleep": (["seconds"], {}),
+    "count": (["n"], {}),
+    "slow_bump": (["seconds"], {}),
+    "async_sleep": (["seconds"], {}),
+}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestPodDaemon(unittest.TestCase):
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp.name)
+        # The daemon runs from the temporary directory and imports the fixture from the repo.
+        environ = patch.dict(os.environ, {"PYTHONPATH": ROOT})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.addCleanup(stop_daemon, "worker_pod")
+
+    def test_shared_daemon(self, *mocks):
+        first = PodLoader("worker_pod", {}, mode="daemon")
+        second = PodLoader("worker_pod", {}, mode="daemon", timeout=0.3)
+        first.load_pod()
+        second.load_pod()
+        self.addCleanup(first.unload_pod)
+        self.addCleanup(second.unload_pod)
+        info = read_daemon_info("worker_pod")
+        self.assertTrue(exists(info["address"]))
+
+        first_pod, second_pod = first.namespace["worker_pod"], second.namespace["worker_pod"]
+        self.assertEqual(first_pod.pid(), info["pid"])
+        self.assertEqual(second_pod.pid(), info["pid"])
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: first_pod.add(i, 1), range(100)))
+        self.assertEqual(results, [i + 1 for i in range(100)])
+        self.assertLessEqual(len(first.worker.idle), 8)
+        self.assertEqual(list(first_pod.count(3)), [0, 1, 2])
+        with first.batch() as b:
+            futures = [b.add(i, i) for i in range(10)]
+        self.assertEqual([f.result() for f in futures], [2 * i for i in range(10)])
+
+        with self.assertRaises(PyPodTimeoutError):
+            second_pod.sleep(1)
+        # The shared daemon is not killed, later calls wait for sleep to return.
+        self.assertEqual(first_pod.add(1, 2), 3)
+        self.assertEqual(second_pod.add(1, 2), 3)
+
+        # Clients start a new daemon when theirs went away.
+        self.assertTrue(stop_daemon("worker_pod"))
+        self.assertFalse(exists(info["address"]))
+        self.assertIsNone(read_daemon_info("worker_pod"))
+        self.assertNotEqual(first_pod.pid(), info["pid"])
+
+    def test_serializes_functions_not_threadsafe(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="daemon")
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        pod.pid()
+        # Every call comes on a connection of its own, slow_bump still runs one call at a time.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            start = time.monotonic()
+            counts = list(executor.map(lambda _: pod.slow_bump(0.3), range(4)))
+            elapsed = time.monotonic() - start
+        self.assertEqual(sorted(counts), [1, 2, 3, 4])
+        self.assertGreaterEqual(elapsed, 1.2)
+        # async def functions still overlap.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            start = time.monotonic()
+            list(executor.map(lambda _: pod.async_sleep(0.3), range(4)))
+            elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.0)
+
+    def start_tcp_daemon(self, info_path, *options):
+        process = subprocess.Popen(
+            [sys.executable, "-m", "pypods.daemon", FIXTURE_MODULE, "--port", "0", "--info", info_path, *options]
+        )
+        self.addCleanup(process.wait)
+        self.addCleanup(process.terminate)
+        while not exists(info_path):
+            self.assertIsNone(process.poll())
+            time.sleep(0.01)
+        return process, tuple(read_json(info_path)["address"])
+
+    def test_tcp(self, *mocks):
+        info_path = os.path.abspath("daemon.json")
+        process, address = self.start_tcp_daemon(info_path, "--workers", "2", "--allow-pickle")
+
+        pl = PodLoader("worker_pod", {}, mode="daemon", address=address, codec=["pickle", "bson"])
+        pl.load_pod()
+        pod = pl.namespace["worker_pod"]
+        self.assertEqual(pl.worker.codec.name, "pickle")
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pids = set(executor.map(lambda _: pod.pid(), range(50)))
+        self.assertLessEqual(len(pids), 2)
+
+        # A graceful shutdown lets the call in flight finish.
+        slow = ThreadPoolExecutor(max_workers=1).submit(pod.sleep, 0.5)
+        time.sleep(0.2)
+        process.terminate()
+        self.assertEqual(slow.result(), 0.5)
+        self.assertEqual(process.wait(timeout=10), 0)
+        self.assertFalse(exists(info_path))
+        pl.unload_pod()
+        with self.assertRaises(PyPodWorkerError):
+            DaemonClient(address).start()
+
+    def test_workers_issue_distinct_handles(self, *mocks):
+        _, address = self.start_tcp_daemon(os.path.abspath("daemon.json"), "--workers", "2")
+        connections, handles = [], {}
+        # Connections are held open so that the accepting worker varies between them.
+        for _ in range(100):
+            connection = DaemonConnection(address, ["bson"])
+            connections.append(connection)
+            connection.send({"name": "pid", "args": [], "kwargs": {}})
+            pid = connection.receive()["response"]
+            connection.send({"name": "make_counter", "args": [1], "kwargs": {}})
+            handles.setdefault(pid, []).append(connection.receive()["handle"])
+            if len(handles) == 2:
+                break
+        for connection in connections:
+            connection.close()
+        self.assertEqual(len(handles), 2)
+        issued = [handle for pid_handles in handles.values() for handle in pid_handles]
+        self.assertEqual(len(set(issued)), len(issued))
+
+    def test_tcp_refuses_pickle(self, *mocks):
+        _, address = self.start_tcp_daemon(os.path.abspath("daemon.json"))
+        client = DaemonClient(address, codecs=["pickle", "bson"])
+        self.addCleanup(client.stop)
+        self.assertEqual(client.call({"name": "add", "args": [1, 2], "kwargs": {}}), {"response": 3})
+        self.assertEqual(client.codec.name, "bson")
+        with self.assertRaisesRegex(PyPodWorkerError, "--allow-pickle"):
+            DaemonClient(address, codecs=["pickle"]).start()
+
+    def test_startup_error(self, *mocks):
+        with self.assertRaises(PyPodWorkerError):
+            ensure_daemon("worker_pod", sys.executable, "tests.fixtures.missing_pod")
+        self.assertFalse(exists(daemon_file("worker_pod", DAEMON_INFO)))
+        with self.assertRaises(ValueError):
+            PodLoader("worker_pod", {}, mode="worker", address="daemon.sock")
+
+
+class TestDaemonClientRetry(unittest.TestCase):
+    def client(self, stale):
+        client = DaemonClient(address="daemon.sock")
+        client.acquire = MagicMock(return_value=stale)
+        client.connect = MagicMock()
+        return client
+
+    def test_no_resend_once_interrupted(self):
+        token = CancelToken()
+        stale = MagicMock()
+        # The send fails because the call is cancelled, not because the connection is stale.
+        stale.send.side_effect = self.cancel_then_fail(token)
+        client = self.client(stale)
+        with self.assertRaises(PyPodCancelledError):
+            client.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(cancel=token))
+        client.connect.assert_not_called()
+
+    def test_resend_is_watched_on_the_new_connection(self):
+        token = CancelToken()
+        stale, fresh = MagicMock(), MagicMock()
+        stale.send.side_effect = BrokenPipeError()
+        fresh.receive.side_effect = self.cancel_then_fail(token, PyPodWorkerError("closed"))
+        client = self.client(stale)
+        client.connect.return_value = fresh
+        with self.assertRaises(PyPodCancelledError):
+            client.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(cancel=token))
+        fresh.send.assert_called_once()
+        fresh.interrupt.assert_called_once()
+        stale.interrupt.assert_not_called()
+
+    @staticmethod
+    def cancel_then_fail(token, error=None):
+        def fail(*args):
+            token.cancel()
+            raise error if error is not None else BrokenPipeError()
+
+        return fail
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from contextlib import ExitStack
+from functools import partial
+from unittest.mock import PropertyMock, patch
+
+from pypods.aio import AsyncPodLoader, AsyncPodWorker
+from pypods.daemon import DaemonClient
+from pypods.deadline import CancelToken, Deadline, deadline
+from pypods.errors import PyPodCancelledError, PyPodTimeoutError
+from pypods.pods import PodLoader
+from pypods.worker import PodWorker
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {"add": (["x", "y"], {}), "pid": ([], {}), "sleep": (["seconds"], {})}
+
+
+class TestDeadline(unittest.TestCase):
+    def test_cancel_token(self):
+        token, called = CancelToken(), []
+        token.add_callback(lambda: called.append("first"))
+        removed = lambda: called.append("removed")
+        token.add_callback(removed)
+        token.remove_callback(removed)
+        token.cancel()
+        token.cancel()
+        token.add_callback(lambda: called.append("late"))
+        self.assertEqual(called, ["first", "late"])
+
+    def test_check(self):
+        Deadline().check()
+        token = CancelToken()
+        limited = Deadline(10, token)
+        limited.check()
+        token.cancel()
+        with self.assertRaises(PyPodCancelledError):
+            limited.check()
+        with self.assertRaises(PyPodTimeoutError):
+            Deadline(expires=time.monotonic() - 1).check()
+        with self.assertRaises(ValueError):
+            Deadline(0)
+
+    def test_shared_timer(self):
+        fired = []
+        # Deadlines are scheduled out of order, and most calls finish before theirs.
+        deadlines = [Deadline(timeout) for timeout in (0.3, 60, 0.1, 60, 0.2)]
+        with ExitStack() as stack:
+            for i, limited in enumerate(deadlines):
+                stack.enter_context(limited.watch(partial(fired.append, i)))
+            timers = [thread for thread in threading.enumerate() if thread.name == "pypods-deadlines"]
+            self.assertEqual(len(timers), 1)
+            time.sleep(0.5)
+            self.assertEqual(fired, [2, 4, 0])
+        self.assertEqual([limited.reason for limited in deadlines], ["timeout", None, "timeout", None, "timeout"])
+        with Deadline(0.1).watch(partial(fired.append, 5)):
+            pass
+        time.sleep(0.2)
+        self.assertEqual(fired, [2, 4, 0])
+        # Nested watches of one deadline, e.g. a worker waiting for its budget, all run their kill.
+        limited = Deadline(0.1)
+        with limited.watch(partial(fired.append, 6)), limited.watch(partial(fired.append, 7)):
+            time.sleep(0.3)
+        self.assertEqual(fired[3:], [6, 7])
+
+    def test_nested_scopes(self):
+        token = CancelToken()
+        with deadline(0.5, token) as outer:
+            with deadline(60) as inner:
+                self.assertEqual(inner.expires, outer.expires)
+                self.assertIs(inner.cancel, token)
+            pl = PodLoader("valid_pod", {}, timeout=60)
+            pl.set_timeout("foo", 0.1)
+            self.assertLess(pl.call_deadline("foo").expires, outer.expires)
+            self.assertEqual(pl.call_deadline("bar").expires, outer.expires)
+        self.assertIsNone(PodLoader("valid_pod", {}).call_deadline("foo"))
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestTimeouts(unittest.TestCase):
+    def assertFast(self, start):
+        self.assertLess(time.monotonic() - start, 3)
+
+    @patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_worker(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker", timeout=0.3)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        first = pod.pid()
+
+        start = time.monotonic()
+        with self.assertRaises(PyPodTimeoutError):
+            pod.sleep(10)
+        self.assertFast(start)
+        self.assertNotEqual(pod.pid(), first)
+
+        pl.set_timeout("sleep", None)
+        self.assertEqual(pod.sleep(0.5), 0.5)
+        with deadline(0.2):
+            with self.assertRaises(PyPodTimeoutError):
+                pod.sleep(10)
+            with self.assertRaises(PyPodTimeoutError):
+                with pl.batch() as b:
+                    b.sleep(10)
+
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.monotonic()
+        with deadline(cancel=token):
+            with self.assertRaises(PyPodCancelledError):
+                pod.sleep(10)
+        self.assertFast(start)
+        self.assertEqual(pod.add(1, 2), 3)
+
+    @patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_zygote(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="zygote", timeout=0.3)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        zygote = pl.worker.process.pid
+
+        start = time.monotonic()
+        with self.assertRaises(PyPodTimeoutError):
+            pod.sleep(10)
+        self.assertFast(start)
+        # The child forked for the call is killed along with its zygote.
+        self.assertFalse(group_running(zygote))
+        self.assertEqual(pod.add(1, 2), 3)
+
+        pl.set_timeout("sleep", None)
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        start = time.monotonic()
+        with deadline(cancel=token):
+            with self.assertRaises(PyPodCancelledError):
+                pod.sleep(10)
+        self.assertFast(start)
+        self.assertEqual(pod.add(1, 2), 3)
+
+    @patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_spawn(self, *mocks):
+        pl = PodLoader("worker_pod", {}, timeout=0.5)
+        pl.load_pod()
+        pod = pl.namespace["worker_pod"]
+        self.assertEqual(pod.add(1, 2), 3)
+        start = time.monotonic()
+        with self.assertRaises(PyPodTimeoutError):
+            pod.sleep(10)
+        self.assertFast(start)
+
+    @patch("pypods.aio.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_async(self, *mocks):
+        async def run():
+            pl = AsyncPodLoader("worker_pod", {}, timeout=0.3)
+            await pl.load_pod()
+            pod = pl.namespace["worker_pod"]
+            first = await pod.pid()
+            with self.assertRaises(PyPodTimeoutError):
+                await pod.sleep(10)
+
+            pl.set_timeout("sleep", None)
+            task = asyncio.ensure_future(pod.sleep(10))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertNotEqual(await pod.pid(), first)
+
+            token = CancelToken()
+            asyncio.get_running_loop().call_later(0.2, token.cancel)
+            with deadline(cancel=token):
+                with self.assertRaises(PyPodCancelledError):
+                    await pod.sleep(10)
+            self.assertEqual(await pod.add(1, 2), 3)
+            await pl.unload_pod()
+
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertFast(start)
+
+
+def group_running(pgid, timeout=1.0):
+    # Killed orphans can linger as zombies until init reaps them, they do not count.
+    limit = time.monotonic() + timeout
+    while True:
+        running = []
+        for pid in filter(str.isdigit, os.listdir("/proc")):
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[2]) == pgid and fields[0] != "Z":
+                running.append(pid)
+        if not running or time.monotonic() > limit:
+            return running
+        time.sleep(0.01)
+
+
+class TestCancelDuringStartup(unittest.TestCase):
+    def test_worker(self):
+        token = CancelToken()
+        # The token is cancelled once the process exists, before the pod module is imported.
+        worker = PodWorker(sys.executable, FIXTURE_MODULE, on_spawn=token.cancel)
+        self.addCleanup(worker.stop)
+        with self.assertRaises(PyPodCancelledError):
+            worker.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(cancel=token))
+        worker.on_spawn = None
+        self.assertEqual(worker.call({"name": "add", "args": [1, 2], "kwargs": {}}), {"response": 3})
+
+    def test_async_worker(self):
+        async def run():
+            token = CancelToken()
+            worker = AsyncPodWorker(sys.executable, FIXTURE_MODULE, on_spawn=token.cancel)
+            try:
+                with self.assertRaises(PyPodCancelledError):
+                    await worker.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(cancel=token))
+            finally:
+                await worker.stop()
+
+        asyncio.run(run())
+
+    def test_daemon_client(self):
+        token = CancelToken()
+
+        def resolve():
+            # Cancelled while the daemon is being started, which then cannot be reached.
+            token.cancel()
+            return "/nonexistent/daemon.sock"
+
+        client = DaemonClient(resolve=resolve)
+        with self.assertRaises(PyPodCancelledError):
+            client.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(cancel=token))
+
+
+if __name__ == "__main__":
+    unittest.main()
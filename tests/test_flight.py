@@ -0,0 +1,173 @@
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import PropertyMock, patch
+
+from pypods.aio import AsyncPodLoader
+from pypods.deadline import CancelToken, Deadline, deadline
+from pypods.errors import PyPodCancelledError, PyPodTimeoutError
+from pypods.flight import SingleFlight
+from pypods.metrics import PodMetrics
+from pypods.pods import PodLoader
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {"slow_bump": (["seconds"], {}), "add": (["x", "y"], {}), "count": (["n"], {})}
+
+
+def call_concurrently(function, calls, *args):
+    # The first call is in flight before the others start.
+    with ThreadPoolExecutor(max_workers=calls) as executor:
+        futures = [executor.submit(function, *args)]
+        time.sleep(0.1)
+        futures += [executor.submit(function, *args) for _ in range(calls - 1)]
+        return [future.result() for future in futures]
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_shared_result(self):
+        flight = SingleFlight()
+        executions = []
+
+        def execute():
+            executions.append(1)
+            time.sleep(0.3)
+            return len(executions)
+
+        results = call_concurrently(lambda: flight.call("key", execute), 4)
+        self.assertEqual(results, [1, 1, 1, 1])
+        self.assertEqual(flight.stats(), {"calls": 4, "executions": 1, "coalesced": 3, "in_flight": 0})
+        self.assertEqual(flight.call("key", execute), 2)
+
+    def test_shared_error(self):
+        flight = SingleFlight()
+
+        def execute():
+            time.sleep(0.3)
+            raise ValueError("boom")
+
+        def call():
+            with self.assertRaisesRegex(ValueError, "boom") as raised:
+                flight.call("key", execute)
+            return raised.exception
+
+        errors = call_concurrently(call, 3)
+        self.assertEqual(flight.stats()["executions"], 1)
+        # Every call raises its own exception object.
+        self.assertEqual(len({id(error) for error in errors}), 3)
+        self.assertIs(errors[1].__cause__, errors[0])
+
+    def test_iterators_are_not_shared(self):
+        flight = SingleFlight()
+
+        def execute():
+            time.sleep(0.3)
+            return iter([1, 2])
+
+        results = call_concurrently(lambda: list(flight.call("key", execute)), 3)
+        self.assertEqual(results, [[1, 2]] * 3)
+
+    def test_waiter_deadline(self):
+        flight = SingleFlight()
+        leader = threading.Thread(target=flight.call, args=("key", lambda: time.sleep(0.5)))
+        leader.start()
+        time.sleep(0.1)
+        with self.assertRaises(PyPodTimeoutError), deadline(0.1):
+            flight.call("key", lambda: None)
+        with self.assertRaises(PyPodTimeoutError):
+            flight.call("key", lambda: None, Deadline(0.1))
+        leader.join()
+
+    def test_waiter_cancel(self):
+        flight = SingleFlight()
+        leader = threading.Thread(target=flight.call, args=("key", lambda: time.sleep(0.5)))
+        leader.start()
+        time.sleep(0.1)
+        token = CancelToken()
+        threading.Timer(0.1, token.cancel).start()
+        start = time.monotonic()
+        with self.assertRaises(PyPodCancelledError):
+            flight.call("key", lambda: None, Deadline(cancel=token))
+        self.assertLess(time.monotonic() - start, 0.3)
+        leader.join()
+
+    def test_waiter_cancel_async(self):
+        flight = SingleFlight()
+
+        async def execute():
+            await asyncio.sleep(0.5)
+
+        async def run():
+            leader = asyncio.ensure_future(flight.call_async("key", execute))
+            await asyncio.sleep(0.1)
+            token = CancelToken()
+            asyncio.get_running_loop().call_later(0.1, token.cancel)
+            with self.assertRaises(PyPodCancelledError):
+                await flight.call_async("key", execute, Deadline(cancel=token))
+            with self.assertRaises(PyPodTimeoutError), deadline(0.1):
+                await flight.call_async("key", execute)
+            await leader
+
+        asyncio.run(run())
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestCoalescedCalls(unittest.TestCase):
+    @patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_single_flight(self, *mocks):
+        metrics = PodMetrics()
+        pl = PodLoader("worker_pod", {}, mode="worker", concurrency=4, metrics=metrics)
+        pl.memoize("add")
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        pl.single_flight("slow_bump")
+        pl.single_flight("add")
+
+        self.assertEqual(call_concurrently(pod.slow_bump, 4, 0.3), [1, 1, 1, 1])
+        self.assertEqual(pod.slow_bump.flight.stats()["coalesced"], 3)
+        self.assertEqual(sorted(call_concurrently(pod.slow_bump, 2, 0.0)), [2, 3])
+        self.assertEqual(pod.add(1, 2), 3)
+        self.assertEqual(pod.add(1, 2), 3)
+        self.assertEqual(pod.add.cache.stats()["hits"], 1)
+        self.assertEqual(pod.add.flight.stats()["executions"], 1)
+        self.assertIn(
+            'pypods_coalesced_calls_total{pod="worker_pod",function="slow_bump"} 3', metrics.to_prometheus()
+        )
+
+        # A coalesced call waits no longer than its own timeout, the leader's is unaffected.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            leader = executor.submit(pod.slow_bump, 0.6)
+            time.sleep(0.1)
+            pl.set_timeout("slow_bump", 0.2)
+            start = time.monotonic()
+            with self.assertRaises(PyPodTimeoutError):
+                pod.slow_bump(0.6)
+            self.assertLess(time.monotonic() - start, 0.45)
+            self.assertEqual(leader.result(), 4)
+
+    @patch("pypods.aio.get_pod_namespace", return_value=FIXTURE_NS)
+    def test_single_flight_async(self, *mocks):
+        async def run():
+            pl = AsyncPodLoader("worker_pod", {})
+            pl.single_flight("slow_bump")
+            await pl.load_pod()
+            pod = pl.namespace["worker_pod"]
+            try:
+                first = asyncio.ensure_future(pod.slow_bump(0.3))
+                await asyncio.sleep(0.1)
+                results = await asyncio.gather(first, pod.slow_bump(0.3), pod.slow_bump(0.3))
+                self.assertEqual(len(set(results)), 1)
+                self.assertEqual(pod.slow_bump.flight.stats()["coalesced"], 2)
+            finally:
+                await pl.unload_pod()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
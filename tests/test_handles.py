@@ -0,0 +1,96 @@
+import gc
+import sys
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.errors import PyPodResponseError
+from pypods.handles import ObjectTable, PodHandle, ReleaseQueue
+from pypods.pods import PodLoader
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {
+    "make_counter": (["value"], {}),
+    "live_objects": ([], {}),
+    "crash": ([], {}),
+}
+
+
+class TestObjectTable(unittest.TestCase):
+    def test_table(self):
+        table = ObjectTable()
+        first, second = table.put("a"), table.put("b")
+        self.assertNotEqual(first, second)
+        self.assertNotEqual(first.split("-")[0], ObjectTable().put("a").split("-")[0])
+        self.assertEqual(table.get(first), "a")
+        table.release([first, "unknown"])
+        self.assertEqual(len(table), 1)
+        with self.assertRaises(PyPodResponseError):
+            table.get(first)
+
+    def test_release_queue(self):
+        released = ReleaseQueue()
+        self.assertFalse(released)
+        released.put("1")
+        released.put("2")
+        self.assertEqual(released.drain(), ["1", "2"])
+        self.assertFalse(released)
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestPodHandles(unittest.TestCase):
+    def load(self, mode):
+        pl = PodLoader("worker_pod", {}, mode=mode)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        return pl.namespace["worker_pod"]
+
+    def test_methods_and_attributes(self, *mocks):
+        pod = self.load("worker")
+        counter = pod.make_counter(5)
+        self.assertIsInstance(counter, PodHandle)
+        self.assertIn("Counter", repr(counter))
+        self.assertEqual(counter.value, 5)
+        self.assertEqual(counter.increment(), 6)
+        self.assertEqual(counter.increment(by=2), 8)
+        self.assertEqual(counter.value, 8)
+        self.assertEqual(list(counter.count_up(2)), [9, 10])
+        with counter.copy() as copy:
+            self.assertEqual(copy.increment(), 11)
+            self.assertEqual(counter.value, 10)
+        with self.assertRaises(PyPodResponseError):
+            counter.missing
+
+    def test_release(self, *mocks):
+        pod = self.load("worker")
+        counter = pod.make_counter(1)
+        other = pod.make_counter(2)
+        self.assertEqual(pod.live_objects(), 2)
+        counter.close()
+        self.assertTrue(counter.closed)
+        self.assertEqual(pod.live_objects(), 1)
+        with self.assertRaises(PyPodResponseError):
+            counter.value
+        del other
+        gc.collect()
+        # Collected handles are released with the next request.
+        self.assertEqual(pod.live_objects(), 0)
+
+    def test_worker_restart(self, *mocks):
+        pod = self.load("worker")
+        counter = pod.make_counter(1)
+        with self.assertRaises(Exception):
+            pod.crash()
+        with self.assertRaisesRegex(PyPodResponseError, "does not exist"):
+            counter.increment()
+
+    def test_requires_long_lived_pod(self, *mocks):
+        for mode in ("spawn", "zygote"):
+            with self.assertRaisesRegex(PyPodResponseError, "worker or daemon mode"):
+                self.load(mode).make_counter(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
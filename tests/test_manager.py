@@ -0,0 +1,100 @@
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.deadline import deadline
+from pypods.errors import PyPodTimeoutError
+from pypods.manager import PodManager, process_rss
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {"pid": ([], {}), "sleep": (["seconds"], {})}
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestPodManager(unittest.TestCase):
+    def load(self, manager, pod_name, **kwargs):
+        namespace = {}
+        pl = manager.loader(pod_name, namespace, mode="worker", **kwargs)
+        pl.load_pod()
+        return namespace[pod_name]
+
+    def test_evicts_least_recently_used(self, *mocks):
+        with PodManager(max_processes=2) as manager:
+            a, b = self.load(manager, "a_pod"), self.load(manager, "b_pod")
+            first = a.pid()
+            b.pid()
+            c = self.load(manager, "c_pod")
+            stats = manager.stats()
+            self.assertEqual((stats["running"], stats["evicted"]), (2, 1))
+            self.assertNotIn("a_pod", stats["pods"])
+            self.assertNotEqual(a.pid(), first)
+            self.assertEqual(manager.stats()["pods"]["a_pod"]["running"], 1)
+            self.assertNotIn("b_pod", manager.stats()["pods"])
+            self.assertEqual(c.pid(), c.pid())
+            self.assertEqual(manager.stats()["evicted"], 2)
+        self.assertEqual(manager.stats()["running"], 0)
+
+    def test_queues_when_busy(self, *mocks):
+        with PodManager(max_processes=1) as manager:
+            a, b = self.load(manager, "a_pod"), self.load(manager, "b_pod")
+            busy = threading.Thread(target=a.sleep, args=(0.5,))
+            busy.start()
+            time.sleep(0.2)
+            self.assertEqual(manager.stats()["busy"], 1)
+            with self.assertRaises(PyPodTimeoutError), deadline(0.1):
+                b.pid()
+            b.pid()
+            busy.join()
+            stats = manager.stats()
+            self.assertEqual(stats["queued"], 2)
+            self.assertEqual(stats["waiting"], 0)
+            self.assertEqual(set(stats["pods"]), {"b_pod"})
+            self.assertEqual((stats["pods"]["b_pod"]["running"], stats["pods"]["b_pod"]["busy"]), (1, 0))
+
+    def test_quotas(self, *mocks):
+        with PodManager(max_processes=3, quotas={"a_pod": 1}) as manager:
+            with self.assertRaises(ValueError):
+                manager.pool("a_pod", {}, size=2)
+            with self.assertRaises(ValueError):
+                manager.loader("a_pod", {}, mode="daemon")
+            a = self.load(manager, "a_pod")
+            first = a.pid()
+            # The quota is full, so a second worker of the pod replaces the idle one.
+            other = self.load(manager, "a_pod")
+            self.assertEqual(manager.stats()["pods"]["a_pod"]["running"], 1)
+            self.assertNotEqual(other.pid(), first)
+            pool = manager.pool("b_pod", {}, size=2)
+            pool.load_pod()
+            self.assertEqual(manager.stats()["running"], 3)
+
+    def test_recycles_workers(self, *mocks):
+        with PodManager(max_processes=2, max_calls=2) as manager:
+            a = self.load(manager, "a_pod")
+            pids = [a.pid() for _ in range(5)]
+            self.assertEqual(pids[0], pids[1])
+            self.assertNotEqual(pids[1], pids[2])
+            self.assertEqual(manager.stats()["recycled"], 2)
+        if process_rss(1) is None:
+            self.skipTest("RSS is not available on this platform")
+        with PodManager(max_processes=2, max_rss=1) as manager:
+            a = self.load(manager, "a_pod")
+            self.assertNotEqual(a.pid(), a.pid())
+            self.assertEqual(manager.stats()["recycled"], 2)
+
+    def test_idle_timeout(self, *mocks):
+        with PodManager(max_processes=2, idle_timeout=0.2) as manager:
+            a = self.load(manager, "a_pod")
+            first = a.pid()
+            time.sleep(0.8)
+            stats = manager.stats()
+            self.assertEqual((stats["running"], stats["expired"]), (0, 1))
+            self.assertNotEqual(a.pid(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import sys
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from bson import dumps, loads
+
+from pypods.metrics import CallTrace, PodMetrics, format_labels
+from pypods.pods import PodLoader
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {"add": (["x", "y"], {}), "fail": (["message"], {})}
+
+
+class TestPodMetrics(unittest.TestCase):
+    def test_prometheus(self):
+        metrics = PodMetrics(buckets=(0.1, 1.0))
+        trace = CallTrace("nlp", "tokenize", "worker")
+        trace.add_phase("execute", 0.05)
+        trace.request_bytes, trace.response_bytes = 10, 20
+        trace.finish()
+        trace.duration = 0.5
+        metrics.record(trace)
+        failed = CallTrace("nlp", "tokenize", "worker")
+        failed.finish("boom")
+        metrics.record(failed)
+        metrics.record_spawn("nlp")
+
+        text = metrics.to_prometheus()
+        self.assertIn('pypods_calls_total{pod="nlp",function="tokenize"} 2', text)
+        self.assertIn('pypods_call_errors_total{pod="nlp",function="tokenize"} 1', text)
+        self.assertIn('pypods_request_bytes_total{pod="nlp",function="tokenize"} 10', text)
+        self.assertIn('pypods_process_spawns_total{pod="nlp"} 1', text)
+        self.assertIn('pypods_call_duration_seconds_bucket{pod="nlp",function="tokenize",le="0.1"} 1', text)
+        self.assertIn('pypods_call_duration_seconds_bucket{pod="nlp",function="tokenize",le="1"} 2', text)
+        self.assertIn('pypods_call_duration_seconds_count{pod="nlp",function="tokenize"} 2', text)
+        self.assertIn(
+            'pypods_call_phase_seconds_bucket{pod="nlp",function="tokenize",phase="execute",le="0.1"} 1', text
+        )
+
+        metrics.reset()
+        self.assertNotIn("nlp", metrics.to_prometheus())
+
+    def test_hooks(self):
+        metrics = PodMetrics()
+        traces = []
+
+        def broken(trace):
+            raise RuntimeError("hooks cannot break calls")
+
+        metrics.add_hook(broken)
+        metrics.add_hook(traces.append)
+        trace = CallTrace("pod", "foo", "spawn")
+        trace.finish()
+        metrics.record(trace)
+        metrics.remove_hook(traces.append)
+        metrics.record(trace)
+        self.assertEqual(traces, [trace])
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels(("a", "b"), ('x"y', "1\n")), '{a="x\\"y",b="1\\n"}')
+
+    def test_pod_timings(self):
+        trace = CallTrace("pod", "foo", "spawn")
+        trace.add_phase("spawn", 0.5)
+        trace.add_pod_timings({"pod_decode": 0.1, "execute": 0.2}, 1.0)
+        self.assertEqual(trace.phases["execute"], 0.2)
+        self.assertAlmostEqual(trace.phases["transport"], 0.2)
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestTracedCalls(unittest.TestCase):
+    def test_worker(self, *mocks):
+        metrics = PodMetrics()
+        traces = []
+        metrics.add_hook(traces.append)
+        pl = PodLoader("worker_pod", {}, mode="worker", metrics=metrics)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        self.assertEqual(pod.add(1, 2), 3)
+        with self.assertRaises(Exception):
+            pod.fail("boom")
+        with pl.batch() as b:
+            b.add(1, 1)
+
+        self.assertEqual([t.function for t in traces], ["add", "fail", "<batch>"])
+        add, fail, batch = traces
+        self.assertEqual(set(add.phases), {"encode", "pod_decode", "execute", "transport", "decode"})
+        self.assertGreater(add.request_bytes, 0)
+        self.assertGreater(add.response_bytes, 0)
+        self.assertIsNone(add.error)
+        self.assertEqual(fail.error, "boom")
+        self.assertIn("execute", batch.phases)
+        text = metrics.to_prometheus()
+        self.assertIn('pypods_process_spawns_total{pod="worker_pod"} 1', text)
+        self.assertIn('pypods_call_errors_total{pod="worker_pod",function="fail"} 1', text)
+
+    def test_spawn(self, *mocks):
+        metrics = PodMetrics()
+        traces = []
+        metrics.add_hook(traces.append)
+        pl = PodLoader("worker_pod", {}, metrics=metrics)
+
+        def send_data(data, deadline=None):
+            self.assertTrue(loads(data)["trace"])
+            return dumps({"response": 3, "trace": {"received": 0.0, "pod_decode": 0.1, "execute": 0.2}}), b""
+
+        with patch.object(pl, "send_data", side_effect=send_data):
+            pl.load_pod()
+            self.assertEqual(pl.namespace["worker_pod"].add(1, 2), 3)
+        self.assertEqual(traces[0].phases["execute"], 0.2)
+        self.assertIn("spawn", traces[0].phases)
+        self.assertIn('pypods_process_spawns_total{pod="worker_pod"} 1', metrics.to_prometheus())
+
+    def test_disabled(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker", metrics=None)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        self.assertEqual(pl.namespace["worker_pod"].add(1, 2), 3)
+        self.assertIsNone(pl.start_trace("add"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,53 @@
+import os
+import tempfile
+import textwrap
 import unittest
-from pypods.errors import PyPodNotFound
-from pypods.ns import get_pod_namespace, get_module_namespace, PODS_DIRECTORY, PODS_CONFIG
+from os.path import exists, join
+from unittest.mock import patch
+
+from pypods.errors import PyPodNamespaceWarning, PyPodNotFound
+from pypods.ns import get_pod_namespace, get_module_namespace, NonLiteralDefault, PODS_DIRECTORY, PODS_CONFIG, PODS_STATE, MANIFEST_FILE
+
+POD_SOURCE = """
+import json
+from pods.static_pod.helpers import helper, other as renamed
+from .nested import *
+
+HEAVY = json.loads("1")
+
+def foo(x, y, z=3, *args, flag=False, **kwargs):
+    return x
+
+async def bar(a, b=HEAVY):
+    return a
+
+class NotAFunction:
+    def method(self):
+        pass
+
+
+if __name__ == "__main__":
+    def hidden():
+        pass
+"""
+
+HELPERS_SOURCE = """
+import numpy_that_is_not_installed
+
+def helper(q):
+    return q
+
+def other():
+    return 1
+"""
+
+NESTED_SOURCE = """
+def nested_function(n=(1, 2)):
+    return n
+
+def _private():
+    pass
+"""
 class TestNamespace(unittest.TestCase):
     def test_get_pod_namespace(self):
         actual = get_pod_namespace("test-pod")
@@ -18,5 +65,64 @@ class TestNamespace(unittest.TestCase):
             module_name = f"{PODS_DIRECTORY}.test-asdfaspd.{PODS_CONFIG}"
             module_ns = get_module_namespace(module_name)
     
+
+class TestStaticNamespace(unittest.TestCase):
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp.name)
+        self.pod_dir = join(PODS_DIRECTORY, "static_pod")
+        os.makedirs(join(self.pod_dir, "nested"))
+        for path, source in (
+            (f"{PODS_CONFIG}.py", POD_SOURCE),
+            ("helpers.py", HELPERS_SOURCE),
+            (join("nested", "__init__.py"), NESTED_SOURCE),
+        ):
+            with open(join(self.pod_dir, path), mode="w") as f:
+                f.write(textwrap.dedent(source))
+
+    def test_static_namespace(self):
+        with self.assertWarnsRegex(PyPodNamespaceWarning, "HEAVY"):
+            actual = get_pod_namespace("static_pod")
+        expected = {
+            "helper": (["q"], {}),
+            "renamed": ([], {}),
+            "nested_function": ([], {"n": (1, 2)}),
+            "foo": (["x", "y", "args", "kwargs"], {"z": 3, "flag": False}),
+            "bar": (["a"], {"b": NonLiteralDefault("HEAVY")}),
+        }
+        self.assertDictEqual(actual, expected)
+        self.assertTrue(exists(join(self.pod_dir, PODS_STATE, MANIFEST_FILE)))
+        # Defaults JSON cannot represent survive the manifest.
+        self.assertEqual(get_pod_namespace("static_pod")["bar"], expected["bar"])
+
+    def test_manifest_is_reused_until_source_changes(self):
+        get_pod_namespace("static_pod")
+        with patch("pypods.ns.parse_pod_namespace") as mock_parse:
+            self.assertIn("foo", get_pod_namespace("static_pod"))
+            mock_parse.assert_not_called()
+
+        with open(join(self.pod_dir, "helpers.py"), mode="a") as f:
+            f.write("\ndef added():\n    pass\n")
+        with open(join(self.pod_dir, f"{PODS_CONFIG}.py"), mode="a") as f:
+            f.write("\nfrom pods.static_pod.helpers import added\n")
+        self.assertIn("added", get_pod_namespace("static_pod"))
+
+    def test_manifest_is_stale_once_a_missing_module_exists(self):
+        with open(join(self.pod_dir, f"{PODS_CONFIG}.py"), mode="a") as f:
+            f.write("\nfrom pods.static_pod.later import later_function\n")
+        self.assertNotIn("later_function", get_pod_namespace("static_pod"))
+
+        with open(join(self.pod_dir, "later.py"), mode="w") as f:
+            f.write("def later_function(x):\n    pass\n")
+        self.assertEqual(get_pod_namespace("static_pod")["later_function"], (["x"], {}))
+
+    def test_missing_pod(self):
+        with self.assertRaises(PyPodNotFound):
+            get_pod_namespace("missing_pod")
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
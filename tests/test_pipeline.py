@@ -0,0 +1,55 @@
+import sys
+import time
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.deadline import deadline
+from pypods.errors import PyPodResponseError, PyPodTimeoutError, PyPodWorkerError
+from pypods.pipeline import PodPipeline
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestPodPipeline(unittest.TestCase):
+    def test_stages(self, *mocks):
+        with PodPipeline(["worker_pod.count", "worker_pod.double", "worker_pod.echo"]) as pipeline:
+            self.assertEqual(pipeline.map([2, 3]), [0, 2, 0, 2, 4])
+            processes = list(pipeline.processes)
+            self.assertEqual(list(pipeline.imap(iter([1]))), [0])
+            self.assertEqual(pipeline.processes, processes)
+        self.assertEqual([p.returncode for p in processes], [0, 0, 0])
+
+    def test_stages_overlap(self, *mocks):
+        with PodPipeline(["worker_pod.sleep", "worker_pod.sleep"]) as pipeline:
+            start = time.perf_counter()
+            self.assertEqual(pipeline.map([0.2] * 5), [0.2] * 5)
+            # One after the other the two stages would take 2 seconds.
+            self.assertLess(time.perf_counter() - start, 1.7)
+
+    def test_errors(self, *mocks):
+        with PodPipeline(["worker_pod.double", "worker_pod.fail"]) as pipeline:
+            with self.assertRaises(PyPodResponseError):
+                pipeline.map(["boom"])
+            self.assertFalse(pipeline.processes)
+        with PodPipeline(["worker_pod.crash", "worker_pod.double"]) as pipeline:
+            with self.assertRaises(PyPodWorkerError):
+                pipeline.map([1])
+            self.assertFalse(pipeline.processes)
+        with self.assertRaises(PyPodWorkerError):
+            PodPipeline(["worker_pod.missing", "worker_pod.echo"]).start()
+        with self.assertRaises(ValueError):
+            PodPipeline(["worker_pod"])
+
+    def test_deadline(self, *mocks):
+        with PodPipeline(["worker_pod.echo", "worker_pod.sleep"]) as pipeline:
+            with self.assertRaises(PyPodTimeoutError):
+                with deadline(0.2):
+                    pipeline.map([2])
+            self.assertEqual(pipeline.map([0]), [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
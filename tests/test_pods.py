@@ -1,10 +1,12 @@
-from io import StringIO
+from io import BytesIO, StringIO
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, PropertyMock
 
 from bson import dumps, loads
 from pypods.pods import PodLoader, PodListener
+from pypods.protocol import read_frame, write_frame
 from pypods.errors import PyPodResponseError
+from pypods.metrics import PodMetrics
 import json
 import os
 from os.path import join, exists
@@ -33,6 +35,119 @@ class TestPodLoader(unittest.TestCase):
         # Check args of mocked function
         mock_create_a_function.assert_called_once_with("func1", *(), **{})
 
+    def test_mode(self):
+        with self.assertRaises(ValueError):
+            PodLoader("valid_pod", {}, mode="unknown")
+        pl = PodLoader("valid_pod", {}, mode="worker")
+        self.assertEqual(pl.pod_module, "pods.valid_pod.pod")
+        PodLoader("valid_pod", {}, mode="zygote", shm_threshold=1024)
+
+    def test_concurrency(self):
+        self.assertEqual(PodLoader("valid_pod", {}, mode="worker", concurrency=4).concurrency, 4)
+        with self.assertRaises(ValueError):
+            PodLoader("valid_pod", {}, mode="zygote", concurrency=4)
+        with self.assertRaises(ValueError):
+            PodLoader("valid_pod", {}, mode="worker", concurrency=0)
+
+    def test_codec(self):
+        self.assertEqual(PodLoader("valid_pod", {}).codecs, ["bson"])
+        pl = PodLoader("valid_pod", {}, mode="worker", codec=["pickle", "bson"])
+        self.assertEqual(pl.codecs, ["pickle", "bson"])
+        # A codec whose package is missing on the client is refused up front.
+        with patch.dict(sys.modules, {"msgpack": None}):
+            with self.assertRaises(ValueError):
+                PodLoader("valid_pod", {}, mode="worker", codec=["msgpack", "pickle"])
+        with self.assertRaises(ValueError):
+            PodLoader("valid_pod", {}, mode="worker", codec="json")
+        with self.assertRaises(ValueError):
+            PodLoader("valid_pod", {}, codec="pickle")
+
+    @patch("pypods.pods.PodLoader.create_pod")
+    @patch("pypods.pods.get_pod_namespace", return_value={"func1": ((), {})})
+    @patch("pypods.pods.PodWorker")
+    def test_load_pod_worker(self, mock_worker, mock_get_pod_namespace, mock_create_pod):
+        mock_worker.return_value.request.return_value = iter([{"response": 7}])
+        pl = PodLoader("valid_pod", {}, mode="worker")
+        pl.load_pod()
+        mock_worker.return_value.start.assert_called_once()
+        self.assertEqual(pl.namespace["valid_pod"].func1(), 7)
+
+        pl.unload_pod()
+        mock_worker.return_value.stop.assert_called_once()
+        self.assertIsNone(pl.worker)
+
+    @patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value="tests.fixtures.worker_pod")
+    @patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+    @patch("pypods.pods.PodLoader.create_pod")
+    @patch("pypods.pods.get_pod_namespace", return_value={"add": (["x", "y"], {}), "fail": (["message"], {})})
+    def test_batch(self, *mocks):
+        for mode in ("spawn", "worker"):
+            pl = PodLoader("worker_pod", {}, mode=mode)
+            pl.load_pod()
+            with pl.batch() as b:
+                futures = [b.add(i, i) for i in range(100)]
+                failed = b.fail("boom")
+            self.assertEqual([f.result() for f in futures], [2 * i for i in range(100)])
+            with self.assertRaises(PyPodResponseError):
+                failed.result()
+            with self.assertRaises(AttributeError):
+                pl.batch().unknown()
+            pl.unload_pod()
+
+    @patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value="tests.fixtures.worker_pod")
+    @patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+    @patch("pypods.pods.PodLoader.create_pod")
+    @patch("pypods.pods.get_pod_namespace", return_value={"count": (["n"], {}), "count_then_fail": (["n"], {})})
+    def test_stream(self, *mocks):
+        traces = []
+        metrics = PodMetrics()
+        metrics.add_hook(traces.append)
+        pl = PodLoader("worker_pod", {}, mode="worker", metrics=metrics)
+        pl.load_pod()
+        pod = pl.namespace["worker_pod"]
+        items = pod.count(5)
+        self.assertEqual(next(items), 0)
+        # The call is traced once its stream is consumed.
+        self.assertEqual(traces, [])
+        self.assertEqual(list(items), [1, 2, 3, 4])
+        self.assertEqual(len(traces), 1)
+
+        items = pod.count_then_fail(2)
+        self.assertEqual([next(items), next(items)], [0, 1])
+        with self.assertRaises(PyPodResponseError):
+            next(items)
+        self.assertIn("stream broke", traces[-1].error)
+        self.assertEqual(list(pod.count(2)), [0, 1])
+        pl.unload_pod()
+
+    @patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value="tests.fixtures.worker_pod")
+    @patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+    @patch("pypods.pods.PodLoader.create_pod")
+    @patch("pypods.pods.get_pod_namespace", return_value={"add": (["x", "y"], {})})
+    def test_lazy(self, mock_get_pod_namespace, mock_create_pod, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker")
+        pl.load_pod(lazy=True)
+        pl.memoize("add")
+        pod = pl.namespace["worker_pod"]
+        mock_create_pod.assert_not_called()
+        mock_get_pod_namespace.assert_not_called()
+        self.assertIsNone(pl.worker)
+
+        self.assertEqual(pod.add(1, 2), 3)
+        self.assertIs(pl.namespace["worker_pod"], pod)
+        self.assertTrue(hasattr(pod.add, "cache"))
+        with self.assertRaises(AttributeError):
+            pod.missing
+        mock_create_pod.assert_called_once()
+        pl.unload_pod()
+        self.assertIsNone(pl.worker)
+
+        pl.load_pod(lazy=True, prewarm=True)
+        pl.prewarm_thread.join()
+        self.assertIsNotNone(pl.worker)
+        self.assertEqual(pl.namespace["worker_pod"].add(2, 2), 4)
+        pl.unload_pod()
+
     def test_unload_pod(self):
         pl_good = PodLoader("123bad", {"123bad": None})
         pl_good.unload_pod()
@@ -106,6 +221,43 @@ class TestPodListener(unittest.TestCase):
         mock_buffer.buffer.read.return_value = dumps({"args": [], "kwargs": {}})
         result = pod_listener.read_stdin()
         self.assertEqual(result, None)
+    def test_serve(self):
+        pod_listener = PodListener()
+        namespace = {"add": lambda x, y: x + y}
+        stdin = BytesIO()
+        write_frame(stdin, dumps({"name": "add", "args": [1, 2], "kwargs": {}}))
+        write_frame(stdin, dumps({"name": "sub", "args": [], "kwargs": {}}))
+        write_frame(stdin, dumps({"args": [], "kwargs": {}}))
+        stdin.seek(0)
+        stdout = BytesIO()
+        pod_listener.serve(namespace, stdin, stdout)
+
+        stdout.seek(0)
+        self.assertEqual(loads(read_frame(stdout)), {"response": 3})
+        self.assertEqual(loads(read_frame(stdout)), {"error": "Function sub does not exist in pod"})
+        self.assertEqual(loads(read_frame(stdout)), {"error": "Corrupt pod input!"})
+        self.assertIsNone(read_frame(stdout))
+
+    def test_serve_batch(self):
+        pod_listener = PodListener()
+        namespace = {"add": lambda x, y: x + y, "blob": lambda: object()}
+        stdin = BytesIO()
+        calls = [
+            {"name": "add", "args": [1, 2], "kwargs": {}},
+            {"name": "blob", "args": [], "kwargs": {}},
+            {"args": [], "kwargs": {}},
+        ]
+        write_frame(stdin, dumps({"batch": calls}))
+        stdin.seek(0)
+        stdout = BytesIO()
+        pod_listener.serve(namespace, stdin, stdout)
+
+        stdout.seek(0)
+        replies = loads(read_frame(stdout))["batch"]
+        self.assertEqual(replies[0], {"response": 3})
+        self.assertIn("error", replies[1])
+        self.assertEqual(replies[2], {"error": "Corrupt pod input!"})
+
     @patch('sys.stdout.buffer.write')
     @patch('sys.stdout.buffer.flush')
     def test_write_stdout(self, mock_flush, mock_write):
@@ -0,0 +1,146 @@
+import itertools
+import sys
+import threading
+import time
+import unittest
+from itertools import islice
+from unittest.mock import PropertyMock, patch
+
+from pypods.deadline import deadline
+from pypods.errors import PyPodNotStartedError, PyPodResponseError, PyPodTimeoutError
+from pypods.pool import PodPool, chunked
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {
+    "add": (["x", "y"], {}),
+    "echo": (["value"], {}),
+    "pid": ([], {}),
+    "fail": (["message"], {}),
+    "count": (["n"], {}),
+    "bump": ([], {}),
+    "make_counter": (["value"], {}),
+    "live_objects": ([], {}),
+}
+
+
+@patch("pypods.pool.PodPool.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pool.PodPool.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+@patch("pypods.pods.PodLoader.create_pod")
+class TestPodPool(unittest.TestCase):
+    def load(self, size=3, **kwargs):
+        pool = PodPool("worker_pod", {}, size=size, **kwargs)
+        pool.load_pod()
+        self.addCleanup(pool.unload_pod)
+        return pool, pool.namespace["worker_pod"]
+
+    def test_workers(self, *mocks):
+        pool, pod = self.load()
+        self.assertEqual(len(pool.workers), 3)
+        pids = {worker.process.pid for worker in pool.workers}
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(pod.add(1, 2), 3)
+
+    def test_zygote(self, *mocks):
+        pool, pod = self.load(size=2, mode="zygote")
+        self.assertEqual(pod.bump.starmap([()] * 4), [1, 1, 1, 1])
+        with self.assertRaises(ValueError):
+            PodPool("worker_pod", {}, mode="spawn")
+        with self.assertRaises(ValueError):
+            PodPool("worker_pod", {}, concurrency=4)
+
+    def test_concurrent_callers(self, *mocks):
+        pool, pod = self.load()
+        results = {}
+
+        def caller(i):
+            results[i] = pod.add(i, i)
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: 2 * i for i in range(20)})
+
+    def test_map(self, *mocks):
+        pool, pod = self.load()
+        self.assertEqual(pod.echo.map(range(10)), list(range(10)))
+        self.assertEqual(pod.echo.map(range(10), chunksize=4), list(range(10)))
+        self.assertEqual(pod.add.starmap([(1, 2), (3, 4)]), [3, 7])
+        self.assertEqual(sorted(pod.echo.imap_unordered(range(10), chunksize=3)), list(range(10)))
+        self.assertGreater(len(set(pod.pid.starmap([()] * 30))), 1)
+
+        with self.assertRaises(PyPodResponseError):
+            pod.fail.map(["boom"])
+        with self.assertRaises(ValueError):
+            pod.echo.map(range(3), chunksize=0)
+
+    def test_chunks_are_read_lazily(self, *mocks):
+        pool, pod = self.load(size=2)
+        read = []
+
+        def items():
+            for i in itertools.count():
+                if i == 1000:
+                    raise AssertionError("the items were read up front")
+                read.append(i)
+                yield i
+
+        outputs = pod.echo.imap_unordered(items(), chunksize=2)
+        self.assertEqual(len({next(outputs) for _ in range(4)}), 4)
+        # The 2 chunks yielded, 2 chunks in flight per worker and the chunk being read.
+        self.assertLessEqual(len(read), 14)
+        outputs.close()
+        self.assertEqual(pod.echo.map(islice(items(), 20), chunksize=3), list(range(20)))
+
+    def test_map_deadline(self, *mocks):
+        pool, pod = self.load(size=1)
+        # The stream holds the only worker for 2 seconds.
+        items = pod.count(3)
+        next(items)
+        releaser = threading.Timer(2, items.close)
+        releaser.start()
+        self.addCleanup(releaser.join)
+        start = time.monotonic()
+        with self.assertRaises(PyPodTimeoutError):
+            with deadline(0.2):
+                pod.echo.map([1])
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_refused_objects_are_released(self, *mocks):
+        pool, pod = self.load(size=1)
+        with self.assertRaises(Exception):
+            pod.make_counter(1)
+        with pool.batch() as b:
+            future = b.make_counter(2)
+        with self.assertRaises(Exception):
+            future.result()
+        self.assertEqual(pod.live_objects(), 0)
+
+    def test_stream(self, *mocks):
+        pool, pod = self.load(size=1)
+        items = pod.count(3)
+        self.assertEqual(next(items), 0)
+        self.assertTrue(pool.idle_workers.empty())
+        self.assertEqual(list(items), [1, 2])
+        self.assertEqual(pool.idle_workers.qsize(), 1)
+
+    def test_unload(self, *mocks):
+        pool = PodPool("worker_pod", {}, size=2)
+        pool.load_pod()
+        function = pool.namespace["worker_pod"].echo
+        pool.unload_pod()
+        self.assertEqual(pool.workers, [])
+        with self.assertRaises(PyPodNotStartedError):
+            function.map([1])
+
+
+class TestChunked(unittest.TestCase):
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunked([], 2)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
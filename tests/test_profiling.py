@@ -0,0 +1,116 @@
+import os
+import pstats
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.pods import PodLoader
+from pypods.profiling import CallProfiler, PodProfile, profile
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+FIXTURE_NS = {
+    "add": (["x", "y"], {}),
+    "slow_bump": (["seconds"], {}),
+    "async_sleep": (["seconds"], {}),
+    "fail": (["message"], {}),
+}
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def function_names(stats):
+    return {name for _, _, name in stats.stats}
+
+
+class TestCallProfiler(unittest.TestCase):
+    def test_unprofiled(self):
+        with CallProfiler(None) as profiler:
+            busy(0.01)
+        self.assertEqual(profiler.attach({"response": 1}), {"response": 1})
+
+    def test_cprofile(self):
+        with CallProfiler({"profiler": "cprofile"}) as profiler:
+            busy(0.01)
+        reply = profiler.attach({"response": None})
+        profile = PodProfile()
+        profile.collect(reply)
+        self.assertNotIn("profile", reply)
+        self.assertEqual(profile.calls, 1)
+        self.assertIn("busy", function_names(profile.stats()))
+        with self.assertRaises(ValueError):
+            profile.collapsed()
+
+    def test_sampling(self):
+        with CallProfiler({"profiler": "sampling", "interval": 0.001}) as profiler:
+            busy(0.1)
+        profile = PodProfile("sampling", 0.001)
+        profile.add(profiler.result)
+        profile.add(profiler.result)
+        self.assertEqual(profile.calls, 2)
+        lines = [line for line in profile.collapsed().splitlines() if "busy (test_profiling.py" in line]
+        self.assertTrue(lines)
+        stats = profile.stats()
+        key = next(k for k in stats.stats if k[2] == "busy")
+        cc, nc, tt, ct, callers = stats.stats[key]
+        self.assertAlmostEqual(ct, 0.2, delta=0.1)
+        self.assertIn("test_sampling", {caller[2] for caller in callers})
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            with CallProfiler({"profiler": "perf"}):
+                pass
+        with self.assertRaises(ValueError):
+            PodProfile("sampling", interval=0)
+        with self.assertRaises(ValueError):
+            PodProfile().stats()
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value=FIXTURE_MODULE)
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestPodProfiling(unittest.TestCase):
+    def load(self, **kwargs):
+        pl = PodLoader("worker_pod", {}, **kwargs)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        return pl, pl.namespace["worker_pod"]
+
+    def test_modes(self, *mocks):
+        for kwargs in ({"mode": "spawn"}, {"mode": "worker"}, {"mode": "zygote"}):
+            with self.subTest(**kwargs):
+                pl, pod = self.load(**kwargs)
+                with profile() as p:
+                    self.assertEqual(pod.slow_bump(0.01), 1)
+                    with self.assertRaises(Exception):
+                        pod.fail("boom")
+                self.assertEqual(p.calls, 2)
+                self.assertTrue({"slow_bump", "fail"}.issubset(function_names(p.stats())))
+                # Calls outside of the block are not profiled.
+                self.assertEqual(pod.add(1, 2), 3)
+                self.assertEqual(p.calls, 2)
+                pl.unload_pod()
+
+    def test_start_profiling(self, *mocks):
+        pl, pod = self.load(mode="worker", concurrency=4)
+        p = pl.start_profiling("sampling", interval=0.001)
+        self.assertEqual(pod.async_sleep(0.05), 0.05)
+        self.assertEqual(pod.slow_bump(0.05), 1)
+        self.assertIs(pl.stop_profiling(), p)
+        pod.add(1, 2)
+        self.assertEqual(p.calls, 2)
+        self.assertIn("slow_bump (worker_pod.py", p.collapsed())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "worker_pod.prof")
+            p.dump(path)
+            self.assertIn("slow_bump", function_names(pstats.Stats(path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
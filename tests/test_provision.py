@@ -0,0 +1,165 @@
+import os
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from os.path import exists, join
+from unittest.mock import patch
+
+from pypods.errors import PyPodProvisionError
+from pypods.ns import PODS_CONFIG, PODS_DIRECTORY
+from pypods.provision import (
+    LAYERS_DIRECTORY,
+    is_layered,
+    is_provisioned,
+    list_pods,
+    pod_path,
+    provision_pods,
+    installed_packages,
+    read_layers,
+    read_lock,
+    remove_unused_layers,
+    requirements_fingerprint,
+    sync_pod,
+    venv_site_packages,
+    write_stamp,
+)
+
+VENV_BIN = "Scripts" if os.name == "nt" else "bin"
+
+
+def write_wheel(wheelhouse, name, version, requires=()):
+    # A minimal pure python wheel, so the tests can install packages without an index.
+    dist_info = f"{name}-{version}.dist-info"
+    requires_dist = "".join(f"Requires-Dist: {requirement}\n" for requirement in requires)
+    files = {
+        f"{name}.py": f"VERSION = {version!r}\n",
+        f"{dist_info}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n{requires_dist}",
+        f"{dist_info}/WHEEL": "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = "".join(f"{path},,\n" for path in files) + f"{dist_info}/RECORD,,\n"
+    with zipfile.ZipFile(join(wheelhouse, f"{name}-{version}-py3-none-any.whl"), "w") as whl:
+        for path, content in files.items():
+            whl.writestr(path, content)
+        whl.writestr(f"{dist_info}/RECORD", record)
+
+
+class TestProvision(unittest.TestCase):
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp.name)
+        self.wheelhouse = join(tmp.name, "wheelhouse")
+        os.makedirs(self.wheelhouse)
+        write_wheel(self.wheelhouse, "tinypkg", "1.0")
+        for pod_name in ("first_pod", "second_pod"):
+            self.write_pod(pod_name, "tinypkg\n")
+
+    def write_pod(self, pod_name, requirements):
+        os.makedirs(pod_path(pod_name), exist_ok=True)
+        with open(join(pod_path(pod_name), f"{PODS_CONFIG}.py"), mode="w") as f:
+            f.write("def foo():\n    pass\n")
+        with open(join(pod_path(pod_name), "requirements.txt"), mode="w") as f:
+            f.write(requirements)
+
+    def test_list_pods(self):
+        os.makedirs(join(PODS_DIRECTORY, "not-a-pod"))
+        os.makedirs(join(PODS_DIRECTORY, "empty_pod"))
+        self.assertEqual(list_pods(), ["first_pod", "second_pod"])
+
+    def test_stamp(self):
+        self.assertFalse(is_provisioned("first_pod"))
+        self.assertEqual(requirements_fingerprint("first_pod"), requirements_fingerprint("second_pod"))
+        with patch("pypods.provision.exists", return_value=True):
+            write_stamp("first_pod")
+            self.assertTrue(is_provisioned("first_pod"))
+            self.write_pod("first_pod", "tinypkg==1.0\n")
+            self.assertFalse(is_provisioned("first_pod"))
+
+    def test_provision_offline(self):
+        results = provision_pods(
+            ["first_pod", "second_pod", "missing_pod"], jobs=2, wheelhouse=self.wheelhouse, offline=True
+        )
+        self.assertEqual(results["first_pod"], "provisioned")
+        self.assertEqual(results["second_pod"], "provisioned")
+        self.assertIn("does not exist", results["missing_pod"])
+        python = join(pod_path("first_pod"), "venv", VENV_BIN, "python")
+        version = subprocess.run(
+            [python, "-c", "import tinypkg; print(tinypkg.VERSION)"], capture_output=True, text=True
+        )
+        self.assertEqual(version.stdout.strip(), "1.0")
+
+        results = provision_pods(["first_pod", "second_pod"], wheelhouse=self.wheelhouse, offline=True)
+        self.assertEqual(results, {"first_pod": "skipped", "second_pod": "skipped"})
+
+        self.write_pod("second_pod", "tinypkg\nmissingpkg\n")
+        results = provision_pods(["first_pod", "second_pod"], wheelhouse=self.wheelhouse, offline=True)
+        self.assertEqual(results["first_pod"], "skipped")
+        self.assertIn("missingpkg", results["second_pod"])
+        self.assertFalse(is_provisioned("second_pod"))
+
+    def test_provision_layered(self):
+        write_wheel(self.wheelhouse, "tinypkg", "2.0")
+        self.write_pod("second_pod", "tinypkg==1.0\n")
+        results = provision_pods(["first_pod", "second_pod"], wheelhouse=self.wheelhouse, offline=True, layered=True)
+        self.assertEqual(results, {"first_pod": "provisioned", "second_pod": "provisioned"})
+        self.assertTrue(is_layered("first_pod"))
+        # Each pod resolves its own requirements, identical wheels share a layer.
+        self.assertIn("tinypkg-2.0", read_layers("first_pod")[0])
+        self.assertIn("tinypkg-1.0", read_layers("second_pod")[0])
+        self.assertFalse(exists(join(venv_site_packages("first_pod"), "tinypkg.py")))
+        python = join(pod_path("first_pod"), "venv", VENV_BIN, "python")
+        version = subprocess.run(
+            [python, "-c", "import tinypkg; print(tinypkg.VERSION)"], capture_output=True, text=True
+        )
+        self.assertEqual(version.stdout.strip(), "2.0")
+
+        self.write_pod("second_pod", "tinypkg==2.0\n")
+        provision_pods(["second_pod"], wheelhouse=self.wheelhouse, offline=True)
+        self.assertTrue(is_layered("second_pod"))
+        self.assertEqual(read_layers("second_pod"), read_layers("first_pod"))
+        self.assertEqual(len(os.listdir(LAYERS_DIRECTORY)), 2)
+        self.assertEqual(len(remove_unused_layers()), 1)
+        self.assertEqual(os.listdir(LAYERS_DIRECTORY), [os.path.basename(read_layers("first_pod")[0])])
+
+    def test_sync(self):
+        write_wheel(self.wheelhouse, "tinypkg", "2.0")
+        write_wheel(self.wheelhouse, "basepkg", "1.0")
+        write_wheel(self.wheelhouse, "toppkg", "1.0", requires=["basepkg"])
+        write_wheel(self.wheelhouse, "extrapkg", "1.0")
+        self.write_pod("first_pod", "tinypkg==1.0\ntoppkg\n")
+        changes = sync_pod("first_pod", wheelhouse=self.wheelhouse)
+        self.assertEqual(sorted(changes["installed"]), ["basepkg==1.0", "tinypkg==1.0", "toppkg==1.0"])
+        self.assertEqual(read_lock("first_pod"), {"basepkg": "1.0", "tinypkg": "1.0", "toppkg": "1.0"})
+        self.assertEqual(sync_pod("first_pod", wheelhouse=self.wheelhouse), {"installed": [], "removed": []})
+
+        # Packages installed by hand are not in the lock and survive syncs.
+        subprocess.run(
+            [join(pod_path("first_pod"), "venv", VENV_BIN, "pip"), "install", "-q", "--no-index",
+             "--find-links", self.wheelhouse, "extrapkg"],
+            check=True,
+        )
+        self.write_pod("first_pod", "tinypkg==2.0\n")
+        changes = sync_pod("first_pod", wheelhouse=self.wheelhouse)
+        self.assertEqual(changes, {"installed": ["tinypkg==2.0"], "removed": ["basepkg", "toppkg"]})
+        self.assertEqual(read_lock("first_pod"), {"tinypkg": "2.0"})
+        packages = installed_packages("first_pod")
+        self.assertEqual(packages["tinypkg"], "2.0")
+        self.assertNotIn("toppkg", packages)
+        self.assertIn("extrapkg", packages)
+        self.assertIn("pip", packages)
+
+        self.write_pod("first_pod", "")
+        self.assertEqual(sync_pod("first_pod", wheelhouse=self.wheelhouse)["removed"], ["tinypkg"])
+        self.assertEqual(read_lock("first_pod"), {})
+
+    def test_offline_requires_wheelhouse(self):
+        with self.assertRaises(PyPodProvisionError):
+            provision_pods(["first_pod"], wheelhouse="missing", offline=True)
+        self.assertFalse(exists(join(pod_path("first_pod"), "venv")))
+
+
+if __name__ == "__main__":
+    unittest.main()
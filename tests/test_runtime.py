@@ -0,0 +1,149 @@
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import dumps, loads
+
+from pypods.runtime import PodRuntime, is_async, is_threadsafe, threadsafe
+from pypods.worker import MultiplexedPodWorker, PodWorker
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+THREADSAFE_MODULE = "tests.fixtures.threadsafe_pod"
+
+
+def call(worker, name, *args, **kwargs):
+    return worker.call({"name": name, "args": args, "kwargs": kwargs})
+
+
+def call_concurrently(worker, name, n, *args):
+    with ThreadPoolExecutor(n) as executor:
+        start = time.perf_counter()
+        replies = list(executor.map(lambda _: call(worker, name, *args), range(n)))
+        return replies, time.perf_counter() - start
+
+
+class TestPodRuntime(unittest.TestCase):
+    def setUp(self):
+        self.runtime = PodRuntime(threads=4)
+        self.addCleanup(self.runtime.shutdown)
+
+    def test_markers(self):
+        async def fetch():
+            pass
+
+        async def stream():
+            yield 1
+
+        @threadsafe
+        def lookup():
+            pass
+
+        self.assertTrue(is_async(fetch))
+        self.assertTrue(is_async(stream))
+        self.assertFalse(is_async(lookup))
+        self.assertTrue(is_threadsafe(lookup))
+        self.assertFalse(is_threadsafe(fetch))
+        self.assertFalse(is_threadsafe(None))
+        with self.assertRaises(ValueError):
+            PodRuntime(threads=0)
+
+    def test_run_and_iterate(self):
+        async def double(x):
+            await asyncio.sleep(0)
+            return 2 * x
+
+        async def count(n):
+            for i in range(n):
+                await asyncio.sleep(0)
+                yield i
+
+        self.assertEqual(self.runtime.run(double(2)), 4)
+        self.assertEqual(list(self.runtime.iterate(count(3))), [0, 1, 2])
+
+    def test_lanes(self):
+        threads, done = set(), []
+
+        def record(i):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            done.append(i)
+
+        for i in range(5):
+            self.runtime.submit(False, record, i)
+
+        async def wait(i):
+            await asyncio.sleep(0.2)
+            done.append(i)
+
+        for i in range(5, 15):
+            self.runtime.spawn(wait(i))
+        self.runtime.shutdown()
+        # Calls that are not threadsafe run on one thread, in order.
+        self.assertEqual(done[:5], [0, 1, 2, 3, 4])
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(sorted(done[5:]), list(range(5, 15)))
+        self.assertIsNone(self.runtime.loop)
+
+
+class TestAsyncPodFunctions(unittest.TestCase):
+    def setUp(self):
+        self.worker = MultiplexedPodWorker(sys.executable, FIXTURE_MODULE, concurrency=2)
+        self.worker.start()
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_async_calls_overlap(self):
+        # Far more calls than threads overlap on the pod's event loop.
+        replies, elapsed = call_concurrently(self.worker, "async_sleep", 16, 0.5)
+        self.assertEqual(replies, [{"response": 0.5}] * 16)
+        self.assertLess(elapsed, 1.5)
+
+    def test_lanes(self):
+        worker = MultiplexedPodWorker(sys.executable, THREADSAFE_MODULE, concurrency=2)
+        worker.start()
+        self.addCleanup(worker.stop)
+        replies, elapsed = call_concurrently(worker, "sleep", 2, 0.4)
+        self.assertEqual(replies, [{"response": 0.4}] * 2)
+        self.assertLess(elapsed, 0.75)
+        replies, elapsed = call_concurrently(worker, "slow_bump", 2, 0.4)
+        self.assertEqual(sorted(r["response"] for r in replies), [1, 2])
+        self.assertGreaterEqual(elapsed, 0.8)
+
+    def test_async_stream_and_errors(self):
+        replies = list(self.worker.request({"name": "async_count", "args": [2], "kwargs": {}}))
+        self.assertEqual(replies, [{"stream": True}, {"chunk": 0}, {"chunk": 1}, {"end": True}])
+        self.assertEqual(call(self.worker, "async_fail", "boom"), {"error": "boom"})
+        calls = [{"name": "async_sleep", "args": [0], "kwargs": {}}] * 2
+        self.assertEqual(self.worker.call({"batch": calls}), {"batch": [{"response": 0}, {"response": 0}]})
+
+
+class TestAsyncPodFunctionsInOrder(unittest.TestCase):
+    def test_worker(self):
+        worker = PodWorker(sys.executable, FIXTURE_MODULE)
+        worker.start()
+        self.addCleanup(worker.stop)
+        self.assertEqual(call(worker, "async_sleep", 0.1), {"response": 0.1})
+        self.assertEqual(call(worker, "async_fail", "boom"), {"error": "boom"})
+        replies = list(worker.request({"name": "async_count", "args": [2], "kwargs": {}}))
+        self.assertEqual(replies, [{"stream": True}, {"chunk": 0}, {"chunk": 1}, {"end": True}])
+
+    def test_spawn(self):
+        for name, args, expected in (("async_sleep", [0.1], {"response": 0.1}), ("async_fail", ["boom"], None)):
+            process = subprocess.run(
+                [sys.executable, "-m", FIXTURE_MODULE],
+                input=dumps({"name": name, "args": args, "kwargs": {}}),
+                capture_output=True,
+            )
+            if expected is not None:
+                self.assertEqual(loads(process.stdout), expected)
+            else:
+                self.assertEqual(loads(process.stderr), {"error": "boom"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import glob
+import os
+import sys
+import unittest
+from unittest.mock import PropertyMock, patch
+
+from pypods.pods import PodLoader
+from pypods.shm import SHM_KEY, SharedMemorySession, attach_value, export_value, release_mappings, shm_directory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FIXTURE_NS = {"reverse": (["data"], {}), "nbytes": (["data"], {}), "echo": (["value"], {}), "crash": ([], {})}
+
+
+def leftover_segments():
+    return glob.glob(os.path.join(shm_directory(), f"pypods-{os.getpid()}-*"))
+
+
+class TestSharedMemory(unittest.TestCase):
+    def test_round_trip(self):
+        session = SharedMemorySession(threshold=16)
+        payload = {"args": [b"x" * 32, b"small"], "kwargs": {"blob": bytearray(b"y" * 64)}}
+        request = session.export_call(dict(payload, name="f"))
+        self.assertIn(SHM_KEY, request["args"][0])
+        self.assertEqual(request["args"][1], b"small")
+        self.assertIn(SHM_KEY, request["kwargs"]["blob"])
+        self.assertEqual(len(leftover_segments()), 2)
+
+        mappings = []
+        args = attach_value(request["args"], mappings)
+        self.assertEqual(bytes(args[0]), b"x" * 32)
+        self.assertTrue(args[0].readonly)
+        del args
+        release_mappings(mappings)
+
+        session.cleanup()
+        self.assertEqual(leftover_segments(), [])
+
+    def test_result_segments(self):
+        session = SharedMemorySession(threshold=16)
+        request = session.export_call({"name": "f", "args": [], "kwargs": {}})
+        result = export_value([b"z" * 20], request["shm"]["prefix"], 16, [])
+        self.assertEqual(len(leftover_segments()), 1)
+        self.assertEqual(bytes(session.attach(result)[0]), b"z" * 20)
+        # Result segments are unlinked as soon as they are mapped.
+        self.assertEqual(leftover_segments(), [])
+
+        # Segments left behind by a crashed pod are swept by cleanup.
+        export_value(b"z" * 20, request["shm"]["prefix"], 16, [])
+        session.cleanup()
+        self.assertEqual(leftover_segments(), [])
+
+    def test_disabled(self):
+        session = SharedMemorySession(threshold=None)
+        request = {"name": "f", "args": [b"x" * 32], "kwargs": {}}
+        self.assertIs(session.export_call(request), request)
+        self.assertEqual(leftover_segments(), [])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_ndarray(self):
+        session = SharedMemorySession(threshold=16)
+        array = numpy.arange(64, dtype="float64").reshape(8, 8)
+        request = session.export_call({"name": "f", "args": [array], "kwargs": {}})
+        self.assertEqual(request["args"][0][SHM_KEY]["shape"], [8, 8])
+        mapped = attach_value(request["args"], [])[0]
+        self.assertTrue(numpy.array_equal(mapped, array))
+        self.assertFalse(mapped.flags.writeable)
+        session.cleanup()
+
+
+@patch("pypods.pods.PodLoader.pod_module", new_callable=PropertyMock, return_value="tests.fixtures.worker_pod")
+@patch("pypods.pods.PodLoader.pod_interpreter", new_callable=PropertyMock, return_value=sys.executable)
+@patch("pypods.pods.PodLoader.create_pod")
+@patch("pypods.pods.get_pod_namespace", return_value=FIXTURE_NS)
+class TestSharedMemoryPod(unittest.TestCase):
+    def test_pod_round_trip(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker", shm_threshold=1024)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        pod = pl.namespace["worker_pod"]
+        data = os.urandom(1 << 20)
+        result = pod.reverse(data)
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(bytes(result), data[::-1])
+        self.assertEqual(pod.nbytes(data), len(data))
+        self.assertEqual(pod.echo(b"small"), b"small")
+        with pl.batch() as b:
+            futures = [b.reverse(data), b.nbytes(data)]
+        self.assertEqual(bytes(futures[0].result()), data[::-1])
+        self.assertEqual(futures[1].result(), len(data))
+        self.assertEqual(leftover_segments(), [])
+
+    def test_cleanup_after_crash(self, *mocks):
+        pl = PodLoader("worker_pod", {}, mode="worker", shm_threshold=1024)
+        pl.load_pod()
+        self.addCleanup(pl.unload_pod)
+        with self.assertRaises(Exception):
+            pl.namespace["worker_pod"].crash(b"x" * 4096)
+        self.assertEqual(leftover_segments(), [])
+
+    def test_requires_worker_mode(self, *mocks):
+        with self.assertRaises(ValueError):
+            PodLoader("worker_pod", {}, shm_threshold=1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from pypods.deadline import Deadline
+from pypods.errors import PyPodError, PyPodNotStartedError, PyPodTimeoutError, PyPodWorkerError
+from pypods.worker import MultiplexedPodWorker, PodWorker
+
+FIXTURE_MODULE = "tests.fixtures.worker_pod"
+THREADSAFE_MODULE = "tests.fixtures.threadsafe_pod"
+
+
+def call(worker, name, *args, **kwargs):
+    return worker.call({"name": name, "args": args, "kwargs": kwargs})
+
+
+class TestPodWorker(unittest.TestCase):
+    def setUp(self):
+        self.worker = PodWorker(sys.executable, FIXTURE_MODULE)
+        self.worker.start()
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_calls_share_one_process(self):
+        first = call(self.worker, "pid")["response"]
+        self.assertEqual(call(self.worker, "add", 1, 2), {"response": 3})
+        self.assertEqual(call(self.worker, "noisy", "x"), {"response": "x"})
+        self.assertEqual(call(self.worker, "pid")["response"], first)
+
+    def test_errors(self):
+        self.assertEqual(call(self.worker, "fail", "boom"), {"error": "boom"})
+        reply = call(self.worker, "unknown")
+        self.assertIn("does not exist", reply["error"])
+
+    def test_restart_after_crash(self):
+        first = call(self.worker, "pid")["response"]
+        with self.assertRaises(PyPodWorkerError):
+            call(self.worker, "crash")
+        self.assertFalse(self.worker.is_alive())
+        second = call(self.worker, "pid")["response"]
+        self.assertNotEqual(first, second)
+
+    def test_stream(self):
+        replies = list(self.worker.request({"name": "count", "args": [3], "kwargs": {}}))
+        self.assertEqual(
+            replies,
+            [{"stream": True}, {"chunk": 0}, {"chunk": 1}, {"chunk": 2}, {"end": True}],
+        )
+        self.assertEqual(call(self.worker, "add", 1, 2), {"response": 3})
+
+        replies = list(self.worker.request({"name": "count_then_fail", "args": [1], "kwargs": {}}))
+        self.assertEqual(replies[-1], {"error": "stream broke"})
+
+    def test_stream_closed_early(self):
+        first = call(self.worker, "pid")["response"]
+        frames = self.worker.request({"name": "count", "args": [10 ** 6], "kwargs": {}})
+        next(frames)
+        next(frames)
+        frames.close()
+        self.assertNotEqual(call(self.worker, "pid")["response"], first)
+
+    def test_stop(self):
+        process = self.worker.process
+        self.worker.stop()
+        self.assertEqual(process.returncode, 0)
+        self.assertIsNone(self.worker.process)
+
+    def test_codec_negotiation(self):
+        self.assertEqual(self.worker.codec.name, "bson")
+        worker = PodWorker(sys.executable, FIXTURE_MODULE, codecs=["missing", "pickle"])
+        worker.start()
+        try:
+            self.assertEqual(worker.codec.name, "pickle")
+            reply = call(worker, "echo", (1, {2, 3}, b"x" * 100000))
+            self.assertEqual(reply, {"response": (1, {2, 3}, b"x" * 100000)})
+            replies = list(worker.request({"name": "count", "args": [2], "kwargs": {}}))
+            self.assertEqual(replies[1:3], [{"chunk": 0}, {"chunk": 1}])
+        finally:
+            worker.stop()
+        with self.assertRaises(PyPodWorkerError):
+            PodWorker(sys.executable, FIXTURE_MODULE, codecs=["missing"]).start()
+        # The process is stopped when the client cannot create the codec the pod picked.
+        worker = PodWorker(sys.executable, FIXTURE_MODULE)
+        with patch("pypods.worker.get_codec", side_effect=PyPodError("Codec bson is not available")):
+            with self.assertRaises(PyPodError):
+                worker.start()
+        self.assertIsNone(worker.process)
+
+    def test_start_failures(self):
+        with self.assertRaises(PyPodNotStartedError):
+            PodWorker("missing/python3", FIXTURE_MODULE).start()
+        with self.assertRaises(PyPodWorkerError):
+            PodWorker(sys.executable, "tests.fixtures.missing_pod").start()
+
+
+class TestForkingPodWorker(unittest.TestCase):
+    def setUp(self):
+        self.worker = PodWorker(sys.executable, FIXTURE_MODULE, fork=True)
+        self.worker.start()
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_fresh_process_per_call(self):
+        self.assertEqual(call(self.worker, "bump"), {"response": 1})
+        self.assertEqual(call(self.worker, "bump"), {"response": 1})
+        pids = {call(self.worker, "pid")["response"] for _ in range(3)}
+        self.assertEqual(len(pids), 3)
+        self.assertNotIn(self.worker.process.pid, pids)
+
+    def test_crash_keeps_zygote(self):
+        process = self.worker.process
+        reply = call(self.worker, "crash")
+        self.assertIn("exited with code 1", reply["error"])
+        self.assertEqual(call(self.worker, "add", 1, 2), {"response": 3})
+        self.assertIs(self.worker.process, process)
+
+    def test_stream_and_batch(self):
+        replies = list(self.worker.request({"name": "count", "args": [2], "kwargs": {}}))
+        self.assertEqual(replies, [{"stream": True}, {"chunk": 0}, {"chunk": 1}, {"end": True}])
+        calls = [{"name": "bump", "args": [], "kwargs": {}}] * 2
+        self.assertEqual(self.worker.call({"batch": calls}), {"batch": [{"response": 1}, {"response": 2}]})
+
+
+class TestMultiplexedPodWorker(unittest.TestCase):
+    def setUp(self):
+        self.worker = MultiplexedPodWorker(sys.executable, THREADSAFE_MODULE, concurrency=4)
+        self.worker.start()
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.worker.stop()
+
+    def test_no_head_of_line_blocking(self):
+        slow = self.executor.submit(call, self.worker, "sleep", 1.0)
+        time.sleep(0.1)
+        start = time.perf_counter()
+        self.assertEqual(call(self.worker, "add", 1, 2), {"response": 3})
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertFalse(slow.done())
+        self.assertEqual(slow.result(), {"response": 1.0})
+
+    def test_out_of_order_replies(self):
+        done = []
+        for seconds in (0.6, 0.3, 0.0):
+            self.executor.submit(call, self.worker, "sleep", seconds).add_done_callback(
+                lambda f: done.append(f.result()["response"])
+            )
+        self.executor.shutdown()
+        self.assertEqual(done, [0.0, 0.3, 0.6])
+
+    def test_stream_and_batch(self):
+        pid = call(self.worker, "pid")["response"]
+        frames = self.worker.request({"name": "count", "args": [10 ** 6], "kwargs": {}})
+        self.assertEqual(next(frames), {"stream": True})
+        replies = list(self.worker.request({"name": "count", "args": [2], "kwargs": {}}))
+        self.assertEqual(replies, [{"stream": True}, {"chunk": 0}, {"chunk": 1}, {"end": True}])
+        calls = [{"name": "add", "args": [1, 2], "kwargs": {}}] * 2
+        self.assertEqual(self.worker.call({"batch": calls}), {"batch": [{"response": 3}, {"response": 3}]})
+        # Closing a stream early cancels it instead of restarting the shared worker.
+        frames.close()
+        self.assertEqual(call(self.worker, "pid")["response"], pid)
+
+    def test_deadline(self):
+        pid = call(self.worker, "pid")["response"]
+        start = time.perf_counter()
+        with self.assertRaises(PyPodTimeoutError):
+            self.worker.call({"name": "sleep", "args": [2], "kwargs": {}}, deadline=Deadline(0.2))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(call(self.worker, "pid")["response"], pid)
+
+    def test_deadline_of_serial_call(self):
+        worker = MultiplexedPodWorker(sys.executable, FIXTURE_MODULE, concurrency=4)
+        worker.start()
+        self.addCleanup(worker.stop)
+        pid = call(worker, "pid")["response"]
+        with self.assertRaises(PyPodTimeoutError):
+            worker.call({"name": "async_sleep", "args": [2], "kwargs": {}}, deadline=Deadline(0.2))
+        self.assertEqual(call(worker, "pid")["response"], pid)
+        # sleep would hold up every later call that is not threadsafe, so its worker is killed.
+        with self.assertRaises(PyPodTimeoutError):
+            worker.call({"name": "sleep", "args": [3], "kwargs": {}}, deadline=Deadline(0.2))
+        reply = worker.call({"name": "add", "args": [1, 2], "kwargs": {}}, deadline=Deadline(1))
+        self.assertEqual(reply, {"response": 3})
+        self.assertNotEqual(call(worker, "pid")["response"], pid)
+
+    def test_crash_fails_requests_in_flight(self):
+        slow = self.executor.submit(call, self.worker, "sleep", 2)
+        time.sleep(0.1)
+        with self.assertRaises(PyPodWorkerError):
+            call(self.worker, "crash")
+        with self.assertRaises(PyPodWorkerError):
+            slow.result()
+        self.assertEqual(call(self.worker, "add", 1, 2), {"response": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()